@@ -1,14 +1,23 @@
+import time
+import logging
 from flask import Flask
 from .config import Config
-from services.embedding import embedding_bp
-from services.retriever import retriever_bp
-from services.captioning import captioning_bp
-from services.fetching import fetch_bp
-from services.caption_db import caption_db_bp
-from services.campaign import campaign_bp
-from services.user_upload import user_upload_bp
+
+logger = logging.getLogger(__name__)
 
 def create_app():
+    start = time.perf_counter()
+
+    # Blueprints are imported here so that importing app.config from a service
+    # module does not pull in every other service (and cycle back into it)
+    from services.embedding import embedding_bp
+    from services.retriever import retriever_bp
+    from services.captioning import captioning_bp
+    from services.fetching import fetch_bp
+    from services.caption_db import caption_db_bp
+    from services.campaign import campaign_bp
+    from services.user_upload import user_upload_bp
+
     app = Flask(__name__)
     app.config.from_object(Config)
 
@@ -21,4 +30,8 @@ def create_app():
     app.register_blueprint(campaign_bp, url_prefix='/campaign')
     app.register_blueprint(user_upload_bp, url_prefix='/user_upload')
 
+    # Clients are created lazily on first use, so this covers imports and registration only
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - start
+    logger.info(f"App created in {app.config['STARTUP_SECONDS'] * 1000:.1f} ms")
+
     return app
\ No newline at end of file
@@ -0,0 +1,262 @@
+import time
+import logging
+import threading
+from .config import Config
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    """Module-level stand-in for a registry client, resolved on first use.
+
+    Attribute access and calls are forwarded to the shared instance, so service
+    modules can keep names like ``s3`` or ``vector_store`` at module level
+    without connecting to anything at import time.
+    """
+
+    __slots__ = ('_registry', '_name')
+
+    def __init__(self, registry, name):
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_name', name)
+
+    def __getattr__(self, attr):
+        # Introspection (mock.patch, asyncio, copy) probes private names;
+        # it must not trigger a connection
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._registry.get(self._name), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._registry.get(self._name)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<LazyClient {self._name}>"
+
+
+class ClientRegistry:
+    """Process-wide registry of clients, each created on first use and then shared.
+
+    Creation time of every client is recorded in ``init_seconds`` so slow
+    dependencies show up in the logs and in the startup benchmark.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+        self.init_seconds = {}
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        """Return the shared client, creating it if this is the first use."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self.init_seconds[name] = time.perf_counter() - start
+                logger.info(f"Initialized {name} client in {self.init_seconds[name] * 1000:.1f} ms")
+            return self._instances[name]
+
+    def lazy(self, name):
+        """Return a LazyClient that resolves to this registry's client."""
+        if name not in self._factories:
+            raise KeyError(f"Unknown client: {name}")
+        return LazyClient(self, name)
+
+    def is_initialized(self, name):
+        return name in self._instances
+
+    def reset(self, name=None):
+        """Drop one or all shared instances so they are rebuilt on next use."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+# Factories import their libraries lazily, which keeps app import cheap
+
+def create_s3_client():
+    import boto3
+    return boto3.client('s3', region_name=Config.AWS_REGION)
+
+
+def create_dynamodb_resource():
+    import boto3
+    return boto3.resource('dynamodb', region_name=Config.AWS_REGION)
+
+
+def create_products_table():
+    return clients.get('dynamodb').Table(Config.DYNAMODB_TABLE_NAME)
+
+
+def create_campaigns_table():
+    return clients.get('dynamodb').Table(Config.DYNAMODB_CAMPAIGNS_TABLE_NAME)
+
+
+def create_chromadb_client():
+    import chromadb
+    return chromadb.HttpClient(
+        host=Config.CHROMADB_HOST,
+        port=Config.CHROMADB_PORT,
+        ssl=False
+    )
+
+
+def create_openai_http_client():
+    """One keep-alive connection pool shared by every OpenAI client in the process."""
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=Config.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY
+        ),
+        timeout=Config.OPENAI_REQUEST_TIMEOUT
+    )
+
+
+def create_openai_client():
+    """OpenAI SDK client on the shared connection pool; LangChain models wrap its resources."""
+    import openai
+    return openai.OpenAI(
+        api_key=Config.OPENAI_API_KEY,
+        http_client=clients.get('openai_http_client')
+    )
+
+
+def create_embedding_model():
+    from langchain.embeddings import OpenAIEmbeddings
+    from services.embedding.cache import TieredCache
+    from services.embedding.embeddings import CachedEmbeddings, EMBEDDING_MODEL_NAME
+    return CachedEmbeddings(
+        OpenAIEmbeddings(
+            model=EMBEDDING_MODEL_NAME,
+            openai_api_key=Config.OPENAI_API_KEY,
+            client=clients.get('openai_client').embeddings
+        ),
+        TieredCache(
+            max_size=Config.EMBEDDING_CACHE_SIZE,
+            path=Config.EMBEDDING_CACHE_PATH,
+            table="text_embeddings"
+        ),
+        EMBEDDING_MODEL_NAME
+    )
+
+
+def create_vector_store():
+    from langchain_chroma import Chroma
+    return Chroma(
+        collection_name="insta_posts",
+        embedding_function=clients.get('embedding_model'),
+        client=clients.get('chromadb_client')
+    )
+
+
+def create_vision_llm():
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(
+        model="gpt-4o",
+        max_tokens=4096,
+        openai_api_key=Config.OPENAI_API_KEY,
+        client=clients.get('openai_client').chat.completions
+    )
+
+
+def create_chroma_collection():
+    """Raw insta_posts collection, for reading and writing precomputed embeddings."""
+    return clients.get('chromadb_client').get_or_create_collection(
+        name="insta_posts",
+        embedding_function=None
+    )
+
+
+def create_caption_llm():
+    from langchain.chat_models import ChatOpenAI
+    return ChatOpenAI(
+        model="gpt-4",
+        openai_api_key=Config.OPENAI_API_KEY,
+        max_tokens=4096,
+        client=clients.get('openai_client').chat.completions
+    )
+
+
+def create_encoder():
+    from tiktoken import get_encoding
+    return get_encoding("cl100k_base")
+
+
+def create_feature_cache():
+    from services.embedding.cache import TieredCache
+    return TieredCache(
+        max_size=Config.FEATURE_CACHE_SIZE,
+        path=Config.FEATURE_CACHE_PATH,
+        table="image_features"
+    )
+
+
+def create_search_cache():
+    from services.retriever.cache import QueryResultCache
+    return QueryResultCache(
+        max_size=Config.SEARCH_CACHE_SIZE,
+        ttl_seconds=Config.SEARCH_CACHE_TTL,
+        marker_path=Config.SEARCH_CACHE_MARKER_PATH or None
+    )
+
+
+def create_vector_index():
+    from services.retriever.index import NumpyVectorIndex, load_from_chroma
+    index = NumpyVectorIndex(
+        Config.VECTOR_INDEX_PATH,
+        quantization=Config.VECTOR_INDEX_QUANTIZATION,
+        rescore_candidates=Config.VECTOR_INDEX_RESCORE_CANDIDATES,
+        filter_fields=Config.VECTOR_INDEX_FILTER_FIELDS,
+        gather_ratio=Config.VECTOR_INDEX_GATHER_RATIO
+    )
+    if Config.RETRIEVER_BACKEND == "numpy" and not index.exists():
+        # Serving from an empty index would answer every search with nothing
+        load_from_chroma(index, clients.get('chroma_collection'))
+    return index
+
+
+def create_lexical_index():
+    from services.retriever.lexical import BM25Index, build_from_chroma
+    index = BM25Index(Config.LEXICAL_INDEX_PATH)
+    if not index.exists():
+        # Otherwise lexical searches find nothing and the first add saves a one-document index
+        build_from_chroma(index, clients.get('chroma_collection'))
+    return index
+
+
+def create_caption_cache():
+    from services.embedding.cache import LRUCache
+    return LRUCache(Config.CAPTION_CACHE_SIZE)
+
+
+clients = ClientRegistry()
+clients.register('s3', create_s3_client)
+clients.register('dynamodb', create_dynamodb_resource)
+clients.register('products_table', create_products_table)
+clients.register('campaigns_table', create_campaigns_table)
+clients.register('chromadb_client', create_chromadb_client)
+clients.register('openai_http_client', create_openai_http_client)
+clients.register('openai_client', create_openai_client)
+clients.register('embedding_model', create_embedding_model)
+clients.register('vector_store', create_vector_store)
+clients.register('chroma_collection', create_chroma_collection)
+clients.register('vision_llm', create_vision_llm)
+clients.register('caption_llm', create_caption_llm)
+clients.register('encoder', create_encoder)
+clients.register('feature_cache', create_feature_cache)
+clients.register('search_cache', create_search_cache)
+clients.register('vector_index', create_vector_index)
+clients.register('lexical_index', create_lexical_index)
+clients.register('caption_cache', create_caption_cache)
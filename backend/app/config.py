@@ -18,4 +18,63 @@ class Config:
     RDS_USER = os.getenv('RDS_USER')
     RDS_PASSWORD = os.getenv('RDS_PASSWORD')
     RDS_PORT = os.getenv('RDS_PORT')
-    DYNAMODB_CAMPAIGNS_TABLE_NAME = os.getenv('DYNAMODB_CAMPAIGNS_TABLE_NAME')
\ No newline at end of file
+    DYNAMODB_CAMPAIGNS_TABLE_NAME = os.getenv('DYNAMODB_CAMPAIGNS_TABLE_NAME')
+    INDEX_MANIFEST_PATH = os.getenv('INDEX_MANIFEST_PATH', 'index_manifest.json')
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '100'))
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+    FEATURE_CACHE_SIZE = int(os.getenv('FEATURE_CACHE_SIZE', '1024'))
+    FEATURE_CACHE_PATH = os.getenv('FEATURE_CACHE_PATH', 'feature_cache.sqlite3')
+    VISION_MAX_DIMENSION = int(os.getenv('VISION_MAX_DIMENSION', '1024'))
+    VISION_IMAGE_FORMAT = os.getenv('VISION_IMAGE_FORMAT', 'JPEG')
+    VISION_IMAGE_QUALITY = int(os.getenv('VISION_IMAGE_QUALITY', '85'))
+    VISION_IMAGE_DETAIL = os.getenv('VISION_IMAGE_DETAIL', 'auto')
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '32'))
+    PIPELINE_FETCH_CONCURRENCY = int(os.getenv('PIPELINE_FETCH_CONCURRENCY', '16'))
+    PIPELINE_DECODE_CONCURRENCY = int(os.getenv('PIPELINE_DECODE_CONCURRENCY', '4'))
+    PIPELINE_VISION_CONCURRENCY = int(os.getenv('PIPELINE_VISION_CONCURRENCY', str(MAX_THREADS)))
+    PIPELINE_EMBED_CONCURRENCY = int(os.getenv('PIPELINE_EMBED_CONCURRENCY', '2'))
+    PIPELINE_CHROMA_CONCURRENCY = int(os.getenv('PIPELINE_CHROMA_CONCURRENCY', '2'))
+    PIPELINE_DYNAMODB_CONCURRENCY = int(os.getenv('PIPELINE_DYNAMODB_CONCURRENCY', '4'))
+    PIPELINE_BATCH_LINGER_SECONDS = float(os.getenv('PIPELINE_BATCH_LINGER_SECONDS', '2.0'))
+    INDEX_CHECKPOINT_INTERVAL = int(os.getenv('INDEX_CHECKPOINT_INTERVAL', '25'))
+    INDEX_JOBS_DIR = os.getenv('INDEX_JOBS_DIR', 'index_jobs')
+    INDEX_JOB_STALE_SECONDS = float(os.getenv('INDEX_JOB_STALE_SECONDS', '1800'))
+    DYNAMODB_BATCH_MAX_RETRIES = int(os.getenv('DYNAMODB_BATCH_MAX_RETRIES', '5'))
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '2048'))
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '30'))
+    OPENAI_REQUEST_TIMEOUT = float(os.getenv('OPENAI_REQUEST_TIMEOUT', '120'))
+    RETRIEVER_MAX_BATCH_QUERIES = int(os.getenv('RETRIEVER_MAX_BATCH_QUERIES', '256'))
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '1024'))
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+    SEARCH_CACHE_MARKER_PATH = os.getenv('SEARCH_CACHE_MARKER_PATH', 'search_cache.marker')
+    RETRIEVER_BACKEND = os.getenv('RETRIEVER_BACKEND', 'chroma')  # 'chroma' or 'numpy'
+    VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH', 'vector_index')
+    VECTOR_INDEX_QUANTIZATION = os.getenv('VECTOR_INDEX_QUANTIZATION', 'none')  # 'none', 'float16' or 'int8'
+    VECTOR_INDEX_RESCORE_CANDIDATES = int(os.getenv('VECTOR_INDEX_RESCORE_CANDIDATES', '100'))
+    VECTOR_INDEX_FILTER_FIELDS = os.getenv('VECTOR_INDEX_FILTER_FIELDS', 'source,product_id').split(',')
+    VECTOR_INDEX_GATHER_RATIO = float(os.getenv('VECTOR_INDEX_GATHER_RATIO', '0.25'))
+    LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', 'lexical_index.json')
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    MMR_CANDIDATES = int(os.getenv('MMR_CANDIDATES', '20'))
+    MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.5'))
+    CAPTION_CONTEXT_MMR = os.getenv('CAPTION_CONTEXT_MMR', 'false').lower() == 'true'
+    CAPTION_FETCH_TIMEOUT = float(os.getenv('CAPTION_FETCH_TIMEOUT', '10'))
+    CAPTION_FETCH_WORKERS = int(os.getenv('CAPTION_FETCH_WORKERS', '16'))
+    CAPTION_CHUNK_DAYS = int(os.getenv('CAPTION_CHUNK_DAYS', '7'))
+    CAPTION_CHUNK_CONCURRENCY = int(os.getenv('CAPTION_CHUNK_CONCURRENCY', '4'))
+    CAPTION_CONTEXT_POSTS = int(os.getenv('CAPTION_CONTEXT_POSTS', '4'))
+    CAPTION_CONTEXT_MAX_TOKENS = int(os.getenv('CAPTION_CONTEXT_MAX_TOKENS', '1000'))
+    CAPTION_CONTEXT_POST_TOKENS = int(os.getenv('CAPTION_CONTEXT_POST_TOKENS', '300'))
+    CAPTION_CONTEXT_DEDUPE_THRESHOLD = float(os.getenv('CAPTION_CONTEXT_DEDUPE_THRESHOLD', '0.8'))
+    CAPTION_CACHE_SIZE = int(os.getenv('CAPTION_CACHE_SIZE', '512'))
+    CAPTION_CACHE_TTL = float(os.getenv('CAPTION_CACHE_TTL', '300'))
+    CAPTION_JOB_WORKERS = int(os.getenv('CAPTION_JOB_WORKERS', '4'))
+    CAPTION_JOB_MAX_PENDING = int(os.getenv('CAPTION_JOB_MAX_PENDING', '32'))
+    CAPTION_JOBS_DIR = os.getenv('CAPTION_JOBS_DIR', 'caption_jobs')
+    CAPTION_JOB_STALE_SECONDS = float(os.getenv('CAPTION_JOB_STALE_SECONDS', '1800'))
+    CAPTION_JOB_RETENTION_SECONDS = float(os.getenv('CAPTION_JOB_RETENTION_SECONDS', '86400'))
+    CAPTION_BULK_CONCURRENCY = int(os.getenv('CAPTION_BULK_CONCURRENCY', '8'))
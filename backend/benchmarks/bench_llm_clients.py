@@ -0,0 +1,92 @@
+"""Compare per-call latency of a fresh ChatOpenAI per request with the pooled shared client.
+
+Usage (from backend/):
+    python -m benchmarks.bench_llm_clients [--calls N] [--delay-ms MS]
+
+Runs against a local stub of the chat completions endpoint, so the numbers
+isolate client construction and connection setup from model latency. A
+--delay-ms can be added to the stub to mimic server time.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import openai
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import HumanMessage
+from app.config import Config
+from app.clients import create_openai_http_client
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "red, glass bottle"},
+                 "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+    delay_seconds = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay_seconds)
+        body = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_calls(get_llm, calls):
+    prompt = [HumanMessage(content="Describe the contents of this image.")]
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        get_llm()(prompt)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28}p50 {statistics.median(timings):>7.2f} ms   p95 {p95:>7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    StubHandler.delay_seconds = args.delay_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    common = {"model": "gpt-4o", "max_tokens": 4096, "openai_api_key": "sk-bench", "openai_api_base": base_url}
+
+    # Before: a new client (and connection) for every call, as extract_image_features used to do
+    fresh = time_calls(lambda: ChatOpenAI(**common), args.calls)
+
+    # After: one client on the pooled keep-alive HTTP client, as app.clients builds it
+    openai_client = openai.OpenAI(api_key="sk-bench", base_url=base_url, http_client=create_openai_http_client())
+    shared = ChatOpenAI(**common, client=openai_client.chat.completions)
+    pooled = time_calls(lambda: shared, args.calls)
+
+    print(f"{args.calls} calls, stub delay {args.delay_ms:.0f} ms, "
+          f"pool limit {Config.OPENAI_MAX_CONNECTIONS} connections")
+    report("new ChatOpenAI per call", fresh)
+    report("shared pooled client", pooled)
+    server.shutdown()
@@ -0,0 +1,36 @@
+"""Measure the latency MMR reranking adds on top of a similarity search.
+
+Usage (from backend/):
+    python -m benchmarks.bench_mmr [--candidates N ...] [--k K] [--dim D] [--runs R]
+
+Times mmr_select alone over synthetic candidate embeddings, for each
+over-fetch size; the search itself is unchanged by the rerank.
+"""
+import argparse
+import statistics
+import time
+import numpy as np
+from services.retriever.utils import mmr_select
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 200])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(args.dim).astype(np.float32)
+    print(f"k={args.k}, dim={args.dim}, {args.runs} runs\n")
+    for count in args.candidates:
+        candidates = rng.standard_normal((count, args.dim)).astype(np.float32)
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            mmr_select(query, candidates, args.k)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{count:>4} candidates   p50 {statistics.median(timings):>6.3f} ms   p95 {p95:>6.3f} ms")
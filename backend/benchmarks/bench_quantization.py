@@ -0,0 +1,48 @@
+"""Compare recall, latency and memory of full-precision and quantized vector index storage.
+
+Usage (from backend/):
+    python -m benchmarks.bench_quantization [--vectors N] [--queries Q] [--k K] [--rescore C]
+
+Builds a NumPy vector index of N synthetic clustered vectors in a temporary
+directory and queries it with every storage mode. Memory is the size of the
+matrix each query scans; recall@k is measured against an exact float64 search.
+"""
+import argparse
+import statistics
+import tempfile
+import numpy as np
+from services.retriever.index import NumpyVectorIndex, QUANTIZATIONS, normalize_rows, top_k
+from benchmarks.bench_vector_index import synthetic_vectors, time_queries, recall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--rescore", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(args.vectors, args.dim, rng)
+    queries = synthetic_vectors(args.queries, args.dim, rng)
+    ids = [str(i) for i in range(args.vectors)]
+
+    exact = normalize_rows(queries).astype(np.float64) @ normalize_rows(vectors).astype(np.float64).T
+    expected = [[ids[i] for i in row] for row in top_k(exact, args.k)]
+
+    with tempfile.TemporaryDirectory() as path:
+        NumpyVectorIndex(path).write(ids, vectors, ids, [{"source": "insta_posts"}] * args.vectors)
+        print(f"{args.vectors} x {args.dim} vectors, {args.queries} queries, k={args.k}, "
+              f"re-scoring {args.rescore} candidates\n")
+
+        for quantization in QUANTIZATIONS:
+            index = NumpyVectorIndex(path, quantization=quantization, rescore_candidates=args.rescore)
+            timings, results = time_queries(
+                lambda q: [hit["id"] for hit in index.search([q], args.k)[0]], queries)
+            timings = sorted(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f"{quantization:<8}memory {index.memory_bytes() / 2 ** 20:>7.1f} MiB   "
+                  f"p50 {statistics.median(timings):>7.2f} ms   p95 {p95:>7.2f} ms   "
+                  f"recall@k {recall(results, expected):.3f}")
@@ -0,0 +1,62 @@
+"""Measure app startup time and the first-use cost of each shared client.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup [--runs N] [--clients]
+
+Each run imports the app and calls create_app() in a fresh interpreter, which is
+what a gunicorn worker or a test session pays before serving anything.
+--clients additionally creates every registered client once (this connects to
+ChromaDB and the AWS/OpenAI SDKs) and reports how long each took.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP_SNIPPET = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def measure_startup(runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SNIPPET],
+            check=True, capture_output=True, text=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_clients():
+    from app.clients import clients
+    for name in list(clients._factories):
+        try:
+            clients.get(name)
+            print(f"  {name:<20}{clients.init_seconds[name] * 1000:>10.1f} ms")
+        except Exception as e:
+            print(f"  {name:<20}{'failed':>10}  ({type(e).__name__}: {e})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--clients", action="store_true", help="also time first use of every client")
+    args = parser.parse_args()
+
+    timings = measure_startup(args.runs)
+    print(f"create_app (import + blueprint registration) over {args.runs} runs:")
+    print(f"  median {statistics.median(timings) * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms")
+
+    if args.clients:
+        print("first use of each shared client:")
+        start = time.perf_counter()
+        measure_clients()
+        print(f"  total {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,99 @@
+"""Compare query latency and recall of the ChromaDB server with the in-process NumPy index.
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_index [--vectors N] [--queries Q] [--k K] [--dim D]
+
+Loads N synthetic clustered vectors into a scratch collection on the ChromaDB
+server from Config (deleted afterwards), bulk loads the NumPy index from that
+collection, then runs the same queries against both. Recall@k is measured
+against an exact float64 brute-force search.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+import chromadb
+import numpy as np
+from app.config import Config
+from services.retriever.index import NumpyVectorIndex, load_from_chroma, normalize_rows, top_k
+
+COLLECTION_PREFIX = "bench_vector_index_"
+
+
+def synthetic_vectors(count, dim, rng, clusters=50):
+    """Clustered vectors, closer to real embeddings than uniform noise."""
+    centers = rng.standard_normal((clusters, dim))
+    labels = rng.integers(0, clusters, count)
+    return (centers[labels] + 0.5 * rng.standard_normal((count, dim))).astype(np.float32)
+
+
+def time_queries(search, queries):
+    timings, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, results
+
+
+def recall(found, expected):
+    return statistics.mean(len(set(f) & set(e)) / len(e) for f, e in zip(found, expected))
+
+
+def report(label, timings, found, expected):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<10}p50 {statistics.median(timings):>8.2f} ms   p95 {p95:>8.2f} ms   "
+          f"recall@k {recall(found, expected):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(args.vectors, args.dim, rng)
+    queries = synthetic_vectors(args.queries, args.dim, rng)
+    ids = [str(i) for i in range(args.vectors)]
+
+    exact = normalize_rows(queries).astype(np.float64) @ normalize_rows(vectors).astype(np.float64).T
+    expected = [[ids[i] for i in row] for row in top_k(exact, args.k)]
+
+    client = chromadb.HttpClient(host=Config.CHROMADB_HOST, port=Config.CHROMADB_PORT, ssl=False)
+    name = COLLECTION_PREFIX + uuid.uuid4().hex[:8]
+    collection = client.create_collection(name, metadata={"hnsw:space": "cosine"}, embedding_function=None)
+    try:
+        for start in range(0, args.vectors, 1000):
+            end = start + 1000
+            collection.add(
+                ids=ids[start:end],
+                embeddings=vectors[start:end].tolist(),
+                documents=[f"doc {i}" for i in ids[start:end]],
+                metadatas=[{"source": "insta_posts"}] * len(ids[start:end])
+            )
+
+        with tempfile.TemporaryDirectory() as path:
+            index = NumpyVectorIndex(path)
+            start = time.perf_counter()
+            load_from_chroma(index, collection)
+            print(f"Bulk loaded {len(index)} x {args.dim} vectors from ChromaDB in "
+                  f"{time.perf_counter() - start:.2f} s")
+            print(f"{args.queries} queries, k={args.k}, filter source=insta_posts\n")
+
+            chroma_timings, chroma_results = time_queries(
+                lambda q: collection.query(query_embeddings=[q.tolist()], n_results=args.k,
+                                           where={"source": "insta_posts"}, include=[])["ids"][0],
+                queries)
+            report("chroma", chroma_timings, chroma_results, expected)
+
+            numpy_timings, numpy_results = time_queries(
+                lambda q: [hit["id"] for hit in index.search([q], args.k, where={"source": "insta_posts"})[0]],
+                queries)
+            report("numpy", numpy_timings, numpy_results, expected)
+    finally:
+        client.delete_collection(name)
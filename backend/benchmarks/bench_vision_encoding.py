@@ -0,0 +1,78 @@
+"""Compare vision payload size and encode time before and after image preprocessing.
+
+Usage (from backend/):
+    python -m benchmarks.bench_vision_encoding [IMAGE ...]
+
+Without arguments a set of synthetic camera-sized photos is generated.
+"""
+import io
+import math
+import random
+import sys
+import time
+from PIL import Image, ImageFilter
+from services.embedding.imaging import preprocess_image, encode_image_data_url
+
+REPEATS = 3
+
+# (label, preprocess_image kwargs); the first entry reproduces the old full-size PNG path
+SETTINGS = [
+    ("png-full (before)", {"max_dimension": None, "image_format": "PNG"}),
+    ("jpeg-q85-1024", {"max_dimension": 1024, "image_format": "JPEG", "quality": 85}),
+    ("webp-q80-1024", {"max_dimension": 1024, "image_format": "WEBP", "quality": 80}),
+    ("jpeg-q85-low", {"max_dimension": 1024, "image_format": "JPEG", "quality": 85, "detail": "low"}),
+]
+
+
+def synthetic_photos():
+    """Generate noisy gradient images at common phone-camera resolutions."""
+    rng = random.Random(0)
+    photos = []
+    for size in [(4032, 3024), (3000, 4000), (2048, 2048)]:
+        base = Image.linear_gradient("L").resize(size).convert("RGB")
+        noise = Image.effect_noise(size, 40).convert("RGB")
+        photo = Image.blend(base, noise, 0.35).filter(ImageFilter.GaussianBlur(rng.uniform(0.5, 1.5)))
+        photos.append((f"synthetic-{size[0]}x{size[1]}", photo))
+    return photos
+
+
+def estimate_vision_tokens(width, height, detail):
+    """Approximate the vision token cost of an image using OpenAI's published tiling rules."""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def run(images):
+    print(f"{'image':<28}{'setting':<20}{'payload KB':>12}{'encode ms':>12}{'est. tokens':>13}")
+    totals = {label: [0, 0.0, 0] for label, _ in SETTINGS}
+    for name, image in images:
+        for label, options in SETTINGS:
+            start = time.perf_counter()
+            for _ in range(REPEATS):
+                data_url = encode_image_data_url(image, **options)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / REPEATS
+
+            encoded, _ = preprocess_image(image, **options)
+            with Image.open(io.BytesIO(encoded)) as sent:
+                tokens = estimate_vision_tokens(*sent.size, options.get("detail", "auto"))
+
+            totals[label][0] += len(data_url)
+            totals[label][1] += elapsed_ms
+            totals[label][2] += tokens
+            print(f"{name[:27]:<28}{label:<20}{len(data_url) / 1024:>12.1f}{elapsed_ms:>12.1f}{tokens:>13}")
+
+    print()
+    baseline_bytes = totals[SETTINGS[0][0]][0]
+    for label, (payload, elapsed_ms, tokens) in totals.items():
+        print(f"{'TOTAL':<28}{label:<20}{payload / 1024:>12.1f}{elapsed_ms:>12.1f}{tokens:>13}"
+              f"   ({payload / baseline_bytes:.1%} of baseline bytes)")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:]
+    run([(path, Image.open(path)) for path in paths] if paths else synthetic_photos())
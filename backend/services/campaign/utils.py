@@ -174,4 +174,49 @@ def get_campaign_from_client(client_id, product_id):
     finally:
         if conn:
             cur.close()
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+def list_client_campaigns(client_id):
+    """Retrieves every campaign record of a client from the 'campaign_data' table, or None on error."""
+
+    select_sql = """
+    SELECT * FROM campaign_data
+    WHERE client_id = %s
+    ORDER BY prod_id;
+    """
+
+    conn = None
+
+    try:
+        # Connection details
+        conn = psycopg2.connect(
+            host=Config.RDS_HOST,
+            database=Config.RDS_DBNAME,
+            user=Config.RDS_USER,
+            password=Config.RDS_PASSWORD,
+            port=Config.RDS_PORT
+        )
+
+        # Execute the SELECT query
+        cur = conn.cursor()
+        cur.execute(select_sql, (client_id,))
+
+        return [
+            {
+                "client_id": row[0],
+                "prod_id": row[1],
+                "campaign_id": row[2],
+                "campaign_type": row[3],
+                "length": row[4],
+                "target_demographic": row[5]
+            }
+            for row in cur.fetchall()
+        ]
+
+    except Exception as e:
+        logger.error(f"Error listing campaign records for client_id {client_id}: {e}")
+        return None
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
@@ -1,28 +1,186 @@
 import logging
-from flask import jsonify
-import boto3
+from concurrent.futures import as_completed
+from flask import request, jsonify
 from . import caption_db_bp
-from app.config import Config
 from services.captioning.service import generate_marketing_captions
-from services.campaign.utils import get_campaign_from_client
+from services.campaign.utils import get_campaign_from_client, list_client_campaigns
+from services.captioning.jobs import start_caption_job, get_caption_job
+from services.embedding.batch_writer import DynamoBatchWriter
+from app.config import Config
+from .utils import table, bulk_executor, fingerprint_product, get_cached_captions, remember_captions
+
+def resolve_captions(client_id, product_id, regenerate=False, campaign=None):
+    """Return ``(result, cache_status, fingerprint)`` for a product without storing anything.
+
+    A result stored for the same campaign settings, image, description and
+    prompt version is returned as a "hit" unless ``regenerate`` is set;
+    otherwise captions are generated ("miss"). Returns ``(None, None, None)``
+    when generation fails.
+    """
+    campaign, fingerprint = fingerprint_product(client_id, product_id, campaign)
+    if fingerprint and not regenerate:
+        cached = get_cached_captions(campaign["campaign_id"], fingerprint)
+        if cached:
+            return cached, "hit", fingerprint
+
+    result = generate_marketing_captions(client_id, product_id)
+    if not result:
+        return None, None, None
+    if fingerprint:
+        result["campaign_id"] = campaign["campaign_id"]
+        result["fingerprint"] = fingerprint
+    return result, "miss", fingerprint
+
+def generate_and_store_captions(client_id, product_id, regenerate=False):
+    """Return ``(result, cache_status)`` for a product, storing newly generated captions in DynamoDB."""
+    result, cache_status, fingerprint = resolve_captions(client_id, product_id, regenerate)
+    if cache_status == "miss":
+        store_captions_in_dynamodb(result)
+        if fingerprint:
+            remember_captions(fingerprint, result)
+    return result, cache_status
+
+def bulk_counts(products):
+    counts = {"total": len(products), "pending": 0, "generated": 0, "cached": 0, "failed": 0}
+    for status in products.values():
+        counts[status["status"]] += 1
+    return counts
+
+def generate_client_captions(client_id, regenerate=False, progress=None):
+    """Generate and store captions for every product of a client listed in campaign_data.
+
+    Products run on the shared bulk pool (CAPTION_BULK_CONCURRENCY across all
+    bulk runs) and go through the same image-feature, retrieval and result
+    caches as single requests. New results are written with BatchWriteItem.
+    Returns per-product status plus counts, reporting each finished product
+    through ``progress(products=..., **counts)`` when given.
+    """
+    campaigns = list_client_campaigns(client_id)
+    if campaigns is None:
+        raise RuntimeError(f"Could not list campaigns for client_id {client_id}")
 
-dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION) 
-table = dynamodb.Table(Config.DYNAMODB_CAMPAIGNS_TABLE_NAME) 
+    # One campaign per product, as for single requests
+    by_product = {}
+    for campaign in campaigns:
+        by_product.setdefault(campaign["prod_id"], campaign)
+    products = {product_id: {"status": "pending"} for product_id in by_product}
+
+    futures = {
+        bulk_executor.submit(resolve_captions, client_id, product_id, regenerate, campaign): product_id
+        for product_id, campaign in by_product.items()
+    }
+    generated = []
+    with DynamoBatchWriter(table, 'campaign_id', max_retries=Config.DYNAMODB_BATCH_MAX_RETRIES) as writer:
+        for future in as_completed(futures):
+            product_id = futures[future]
+            campaign_id = by_product[product_id]["campaign_id"]
+            try:
+                result, cache_status, fingerprint = future.result()
+            except Exception as e:
+                logging.error(f"Error generating captions for client_id {client_id} and product_id {product_id}: {str(e)}")
+                products[product_id] = {"status": "failed", "campaign_id": campaign_id, "error": str(e)}
+            else:
+                if not result:
+                    products[product_id] = {"status": "failed", "campaign_id": campaign_id,
+                                            "error": "Caption generation failed"}
+                elif cache_status == "hit":
+                    products[product_id] = {"status": "cached", "campaign_id": campaign_id}
+                else:
+                    result.setdefault("campaign_id", campaign_id)
+                    writer.put(result)
+                    generated.append((product_id, fingerprint, result))
+                    products[product_id] = {"status": "generated", "campaign_id": campaign_id}
+            if progress:
+                progress(products=dict(products), **bulk_counts(products))
+
+    failed_keys = set(writer.failed_keys)
+    for product_id, fingerprint, result in generated:
+        if result["campaign_id"] in failed_keys:
+            products[product_id] = {"status": "failed", "campaign_id": result["campaign_id"],
+                                    "error": "Could not store captions in DynamoDB"}
+        elif fingerprint:
+            remember_captions(fingerprint, result)
+
+    logging.info(f"Bulk caption run for client_id {client_id}: {bulk_counts(products)}")
+    return {"products": products, **bulk_counts(products)}
 
 @caption_db_bp.route('/generate-captions/<client_id>/<product_id>', methods=['GET'])
 def generate_captions(client_id, product_id):
-    """Endpoint to generate and store captions in DynamoDB."""
+    """Endpoint to generate and store captions in DynamoDB.
+
+    A result stored for the same campaign settings, image, description and
+    prompt version is returned as is; pass ?regenerate=true to force a new one.
+    """
+    regenerate = request.args.get('regenerate', 'false').lower() == 'true'
     try:
-        result = generate_marketing_captions(client_id, product_id)
+        result, cache_status = generate_and_store_captions(client_id, product_id, regenerate)
         if result:
-            store_captions_in_dynamodb(result)
-            return jsonify(result), 200
+            return jsonify(result), 200, {"X-Caption-Cache": cache_status}
         else:
             return jsonify({"status": "error", "message": "Caption generation failed"}), 500
     except Exception as e:
         logging.error(f"Error generating captions for client_id {client_id} and product_id {product_id}: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@caption_db_bp.route('/generate-captions/<client_id>/<product_id>/jobs', methods=['POST'])
+def submit_caption_job(client_id, product_id):
+    """Queue caption generation and storage; poll /jobs/<job_id> for the stored result."""
+    regenerate = request.args.get('regenerate', 'false').lower() == 'true'
+
+    def task(client_id, product_id, progress):
+        result, cache_status = generate_and_store_captions(client_id, product_id, regenerate)
+        return {"campaign_id": result["campaign_id"], "cache": cache_status} if result else None
+
+    try:
+        response, status_code = start_caption_job(client_id, product_id, task, kind="caption_db")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error submitting caption job for client_id {client_id} and product_id {product_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@caption_db_bp.route('/generate-captions/<client_id>', methods=['POST'])
+def submit_bulk_caption_job(client_id):
+    """Queue caption generation for all of a client's products; poll /bulk/<job_id> for per-product status."""
+    regenerate = request.args.get('regenerate', 'false').lower() == 'true'
+
+    def task(client_id, product_id, progress):
+        return generate_client_captions(client_id, regenerate, progress)
+
+    try:
+        response, status_code = start_caption_job(client_id, None, task, kind="caption_db_bulk")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error submitting bulk caption job for client_id {client_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@caption_db_bp.route('/bulk/<job_id>', methods=['GET'])
+def bulk_caption_job_status(job_id):
+    """Report a bulk job's state with the status of every product."""
+    try:
+        response, status_code = get_caption_job(job_id, kind="caption_db_bulk")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error fetching bulk caption job {job_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@caption_db_bp.route('/jobs/<job_id>', methods=['GET'])
+def caption_job_status(job_id):
+    """Report a caption job's state, with the result read back from DynamoDB once it has completed."""
+    try:
+        response, status_code = get_caption_job(job_id, kind="caption_db")
+        job = response.get("job")
+        if job and job["state"] == "completed":
+            item = table.get_item(Key={'campaign_id': job["campaign_id"]}).get('Item')
+            if item:
+                job["result"] = item
+            else:
+                # store_captions_in_dynamodb logs and swallows write errors
+                job.update(state="failed", error="Generated captions were not found in DynamoDB")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error fetching caption job {job_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 
 def get_campaign_id(client_id, product_id):
     """Generate a unique campaign_id based on client_id and product_id."""
@@ -33,10 +191,9 @@ def get_campaign_id(client_id, product_id):
 def store_captions_in_dynamodb(campaign_data):
     """Stores the generated captions in DynamoDB."""
     try:
-        campaign_id = get_campaign_id(campaign_data['client_id'], campaign_data['product_id'])
-
         if 'campaign_id' not in campaign_data:
-            campaign_data['campaign_id'] = campaign_id
+            campaign_data['campaign_id'] = get_campaign_id(campaign_data['client_id'], campaign_data['product_id'])
+        campaign_id = campaign_data['campaign_id']
         
         table.put_item(Item=campaign_data)
 
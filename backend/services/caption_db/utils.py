@@ -0,0 +1,100 @@
+import time
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from app.config import Config
+from app.clients import clients
+from services.embedding.utils import get_s3_etag, IMAGE_FEATURES_PROMPT_VERSION
+from services.captioning.utils import CAPTION_PROMPT_VERSION, fetch_executor
+from services.campaign.utils import get_campaign_from_client
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Shared campaigns table, created on first use
+table = clients.lazy('campaigns_table')
+
+# Recently served results in this process, keyed by fingerprint
+caption_cache = clients.lazy('caption_cache')
+
+# Products of bulk runs share one pool, capping concurrent caption generations across all bulk jobs
+bulk_executor = ThreadPoolExecutor(max_workers=Config.CAPTION_BULK_CONCURRENCY, thread_name_prefix="caption-bulk")
+
+# Campaign row fields that shape the generated captions
+CAMPAIGN_FIELDS = ("client_id", "prod_id", "campaign_id", "campaign_type", "length", "target_demographic")
+
+
+def caption_fingerprint(campaign, image_etag, description_etag):
+    """Hash everything a caption result depends on: campaign settings, inputs and prompt versions."""
+    payload = {
+        "campaign": {field: campaign.get(field) for field in CAMPAIGN_FIELDS},
+        "image_etag": image_etag,
+        "description_etag": description_etag,
+        "caption_prompt_version": CAPTION_PROMPT_VERSION,
+        "features_prompt_version": IMAGE_FEATURES_PROMPT_VERSION,
+        "context": [Config.CAPTION_CONTEXT_POSTS, Config.CAPTION_CONTEXT_MAX_TOKENS, Config.CAPTION_CONTEXT_MMR]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def fingerprint_product(client_id, product_id, campaign=None):
+    """Look up the campaign row and both ETags concurrently; returns (campaign, fingerprint) or (None, None).
+
+    Pass ``campaign`` when the row is already at hand (bulk runs) to skip its lookup.
+    """
+    base_key = f"client_uploads/{client_id}/{product_id}"
+    futures = {
+        "image": fetch_executor.submit(get_s3_etag, Config.S3_BUCKET_NAME, f"{base_key}/image.png"),
+        "description": fetch_executor.submit(get_s3_etag, Config.S3_BUCKET_NAME, f"{base_key}/description.txt")
+    }
+    if campaign is None:
+        futures["campaign"] = fetch_executor.submit(get_campaign_from_client, client_id, product_id)
+    # The lookups share one CAPTION_FETCH_TIMEOUT budget, as in fetch_product_data
+    done, pending = wait(futures.values(), timeout=Config.CAPTION_FETCH_TIMEOUT)
+    if pending:
+        late = [stage for stage, future in futures.items() if future in pending]
+        logger.error(f"Timed out after {Config.CAPTION_FETCH_TIMEOUT}s fingerprinting ({', '.join(late)}) "
+                     f"client_id {client_id} and product_id {product_id}")
+        return None, None
+
+    try:
+        if campaign is None:
+            campaign = futures["campaign"].result()
+        image_etag = futures["image"].result()
+        description_etag = futures["description"].result()
+    except Exception as e:
+        logger.error(f"Error fingerprinting client_id {client_id} and product_id {product_id}: {e}")
+        return None, None
+
+    if not campaign or not image_etag or not description_etag:
+        return None, None
+    return campaign, caption_fingerprint(campaign, image_etag, description_etag)
+
+
+def get_cached_captions(campaign_id, fingerprint):
+    """Return the stored result for these exact inputs, from this process or DynamoDB, else None."""
+    cached = caption_cache.get(fingerprint)
+    if cached is not None:
+        stored_at, result = cached
+        if time.monotonic() - stored_at < Config.CAPTION_CACHE_TTL:
+            return result
+
+    try:
+        item = table.get_item(Key={'campaign_id': campaign_id}).get('Item')
+    except Exception as e:
+        logger.error(f"Error reading cached captions for campaign_id {campaign_id}: {e}")
+        return None
+    if not item or item.get('fingerprint') != fingerprint:
+        return None
+    remember_captions(fingerprint, item)
+    return item
+
+
+def remember_captions(fingerprint, result):
+    """Keep a result in this process for CAPTION_CACHE_TTL seconds.
+
+    The TTL bounds how long another worker's regenerated result for the same
+    inputs can go unnoticed here.
+    """
+    caption_cache.set(fingerprint, (time.monotonic(), result))
@@ -0,0 +1,71 @@
+import re
+import logging
+from services.embedding.utils import count_tokens, truncate_text
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# A post cut shorter than this adds little; skip it instead
+MIN_POST_TOKENS = 32
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def word_set(text):
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def overlap(a, b):
+    """Jaccard similarity of two word sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def build_caption_context(results, max_tokens, max_post_tokens, dedupe_threshold=0.8):
+    """Pack retrieved posts into a compact prompt context within a token budget.
+
+    Only each post's text is kept (metadata such as S3 paths and ids carries
+    nothing the caption model can use). Posts whose words overlap an earlier,
+    more relevant post by ``dedupe_threshold`` or more are skipped. Posts are
+    added in relevance order, each capped at ``max_post_tokens``, until
+    ``max_tokens`` is used. Returns the context and a report comparing it with
+    the raw results that used to be interpolated into the prompt.
+    """
+    raw_tokens = count_tokens(str(results))
+    kept_words = []
+    posts = []
+    used = 0
+    duplicates = 0
+
+    for result in results:
+        content = " ".join(result.get("content", "").split())
+        if not content:
+            continue
+        words = word_set(content)
+        if any(overlap(words, seen) >= dedupe_threshold for seen in kept_words):
+            duplicates += 1
+            continue
+
+        label = f"Post {len(posts) + 1}: "
+        remaining = max_tokens - used - count_tokens(label)
+        post_budget = min(max_post_tokens, remaining)
+        if post_budget < MIN_POST_TOKENS:
+            break
+        content = truncate_text(content, post_budget)
+
+        posts.append(label + content)
+        kept_words.append(words)
+        used += count_tokens(posts[-1]) + 1
+
+    context = "\n".join(posts)
+    context_tokens = count_tokens(context) if context else 0
+    report = {
+        "raw_tokens": raw_tokens,
+        "context_tokens": context_tokens,
+        "tokens_saved": raw_tokens - context_tokens,
+        "posts_retrieved": len(results),
+        "posts_used": len(posts),
+        "duplicates_dropped": duplicates
+    }
+    return context, report
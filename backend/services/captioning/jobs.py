@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app.config import Config
+from services.embedding.jobs import owner_gone
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Caption jobs share a small pool so a burst of submissions cannot saturate the LLM quota
+executor = ThreadPoolExecutor(max_workers=Config.CAPTION_JOB_WORKERS, thread_name_prefix="caption-job")
+
+# Jobs owned by this process; anything else on disk came from another worker or an earlier process
+jobs = {}
+jobs_lock = threading.Lock()
+
+ACTIVE_STATES = ("queued", "running")
+
+# Expired job files are swept at most this often, on submission
+CLEANUP_INTERVAL_SECONDS = 60
+last_cleanup = 0.0
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def job_path(job_id):
+    """Path of the JSON file that records a job's state for every worker process."""
+    return os.path.join(Config.CAPTION_JOBS_DIR, f"{job_id}.json")
+
+
+def save_job(job):
+    """Persist a job's state atomically."""
+    os.makedirs(Config.CAPTION_JOBS_DIR, exist_ok=True)
+    path = job_path(job["job_id"])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def load_job(job_id):
+    """Return a copy of the job, from this process or from disk, or None if unknown."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return None
+
+    with jobs_lock:
+        if job_id in jobs:
+            return dict(jobs[job_id])
+
+    path = job_path(job_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            job = json.load(f)
+        updated = os.path.getmtime(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading caption job {job_id}: {e}")
+        return None
+    if job.get("state") in ACTIVE_STATES and owner_gone(job, updated, Config.CAPTION_JOB_STALE_SECONDS):
+        job["state"] = "interrupted"
+    return job
+
+
+def cleanup_jobs():
+    """Delete job files untouched for CAPTION_JOB_RETENTION_SECONDS, at most once per interval."""
+    global last_cleanup
+    now = time.time()
+    if now - last_cleanup < CLEANUP_INTERVAL_SECONDS:
+        return
+    last_cleanup = now
+    try:
+        names = os.listdir(Config.CAPTION_JOBS_DIR)
+    except FileNotFoundError:
+        return
+
+    with jobs_lock:
+        owned = {f"{job_id}.json" for job_id in jobs}
+    removed = 0
+    for name in names:
+        path = os.path.join(Config.CAPTION_JOBS_DIR, name)
+        try:
+            if name not in owned and now - os.path.getmtime(path) > Config.CAPTION_JOB_RETENTION_SECONDS:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove expired caption job file {path}: {e}")
+    if removed:
+        logger.info(f"Removed {removed} expired caption job files")
+
+
+def pending_count():
+    """Number of jobs queued or running in this process. Caller holds jobs_lock."""
+    return sum(1 for job in jobs.values() if job["state"] in ACTIVE_STATES)
+
+
+def update_job(job_id, **fields):
+    with jobs_lock:
+        job = jobs[job_id]
+        job.update(fields)
+        job["updated_at"] = now_iso()
+        snapshot = dict(job)
+    try:
+        save_job(snapshot)
+    except OSError as e:
+        logger.error(f"Error recording caption job {job_id}: {e}")
+    if snapshot["state"] not in ACTIVE_STATES:
+        # Finished jobs are served from disk from now on
+        with jobs_lock:
+            jobs.pop(job_id, None)
+
+
+def run_job(job_id, task, client_id, product_id):
+    """Worker entry point: run the task and record the fields it returns."""
+    update_job(job_id, state="running", started_at=now_iso())
+    started = time.monotonic()
+
+    def progress(**fields):
+        update_job(job_id, **fields)
+
+    try:
+        fields = task(client_id, product_id, progress)
+        duration = round(time.monotonic() - started, 2)
+        if fields:
+            update_job(job_id, state="completed", finished_at=now_iso(), duration_seconds=duration, **fields)
+        else:
+            update_job(job_id, state="failed", error="Caption generation failed",
+                       finished_at=now_iso(), duration_seconds=duration)
+    except Exception as e:
+        logger.error(f"Caption job {job_id} failed: {e}")
+        update_job(job_id, state="failed", error=str(e), finished_at=now_iso(),
+                   duration_seconds=round(time.monotonic() - started, 2))
+
+
+def start_caption_job(client_id, product_id, task, kind):
+    """Queue ``task(client_id, product_id, progress)`` on the caption job pool and return its job id.
+
+    The task may call ``progress(**fields)`` to record intermediate state and
+    returns the fields to record on the job when it succeeds (for example the
+    result, or where it was stored), or None when it fails.
+    Submissions beyond CAPTION_JOB_MAX_PENDING active jobs are refused with
+    429 so the queue, and the wait behind it, stays bounded. Job files are
+    removed once CAPTION_JOB_RETENTION_SECONDS pass without an update.
+    """
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "kind": kind,
+        "state": "queued",
+        "client_id": client_id,
+        "product_id": product_id,
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "created_at": now_iso(),
+        "updated_at": now_iso(),
+        "started_at": None,
+        "finished_at": None
+    }
+    cleanup_jobs()
+    with jobs_lock:
+        if pending_count() >= Config.CAPTION_JOB_MAX_PENDING:
+            return {"status": "error", "message": "Too many caption jobs in progress, retry later"}, 429
+        jobs[job["job_id"]] = job
+        save_job(job)
+    executor.submit(run_job, job["job_id"], task, client_id, product_id)
+    logger.info(f"Queued {kind} job {job['job_id']} for client_id {client_id} and product_id {product_id}")
+    return {"status": "success", "job_id": job["job_id"], "state": "queued"}, 202
+
+
+def get_caption_job(job_id, kind):
+    """Return a job of the given kind as a ``(response, status_code)`` pair."""
+    job = load_job(job_id)
+    if not job or job.get("kind") != kind:
+        return {"status": "error", "message": "Job not found"}, 404
+    return {"status": "success", "job": job}, 200
@@ -1,7 +1,9 @@
+import json
 import logging
-from flask import jsonify
+from flask import Response, jsonify, stream_with_context
 from . import captioning_bp
-from .utils import generate_marketing_captions
+from .utils import generate_marketing_captions, stream_marketing_captions
+from .jobs import start_caption_job, get_caption_job
 
 @captioning_bp.route('/generate-captions/<client_id>/<product_id>', methods=['GET'])
 def generate_captions(client_id, product_id):
@@ -14,3 +16,59 @@ def generate_captions(client_id, product_id):
     except Exception as e:
         logging.error(f"Error generating captions for client_id {client_id} and product_id {product_id}: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@captioning_bp.route('/generate-captions/<client_id>/<product_id>/stream', methods=['GET'])
+def stream_captions(client_id, product_id):
+    try:
+        days = stream_marketing_captions(client_id, product_id)
+    except Exception as e:
+        logging.error(f"Error preparing caption stream for client_id {client_id} and product_id {product_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if days is None:
+        return jsonify({"status": "error", "message": "Caption generation failed"}), 500
+
+    def events():
+        count = 0
+        try:
+            for day in days:
+                count += 1
+                yield sse_event("day", day)
+            yield sse_event("done", {"client_id": client_id, "product_id": product_id, "days": count})
+        except Exception as e:
+            logging.error(f"Error streaming captions for client_id {client_id} and product_id {product_id}: {str(e)}")
+            yield sse_event("error", {"message": str(e), "days": count})
+
+    # Stop proxies from buffering the stream
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+
+def caption_job_task(client_id, product_id, progress):
+    """Job body for /jobs: the generated captions are kept on the job record."""
+    result = generate_marketing_captions(client_id, product_id)
+    return {"result": result} if result else None
+
+@captioning_bp.route('/generate-captions/<client_id>/<product_id>/jobs', methods=['POST'])
+def submit_caption_job(client_id, product_id):
+    """Queue caption generation and return a job id to poll instead of holding the request open."""
+    try:
+        response, status_code = start_caption_job(client_id, product_id, caption_job_task, kind="captioning")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error submitting caption job for client_id {client_id} and product_id {product_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@captioning_bp.route('/jobs/<job_id>', methods=['GET'])
+def caption_job_status(job_id):
+    """Report a caption job's state, with the captions once it has completed."""
+    try:
+        response, status_code = get_caption_job(job_id, kind="captioning")
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error fetching caption job {job_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
@@ -1,55 +1,147 @@
 import io
-import boto3
+import json
+import time
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
-from langchain.chat_models import ChatOpenAI
 from langchain.schema import AIMessage, HumanMessage
 from app.config import Config
+from app.clients import clients
 from services.retriever.utils import perform_similarity_search
-from services.embedding.utils import extract_image_features, get_s3_file
+from services.embedding.utils import extract_image_features, get_s3_file, IMAGE_FEATURES_ERROR
+from services.embedding.singleflight import SingleFlight
 from services.campaign.utils import get_campaign_from_client
+from .context import build_caption_context
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
-# Initialize AWS S3 client
-s3 = boto3.client('s3', region_name=Config.AWS_REGION)
+# OpenAI client for generating captions, created on first use
+llm = clients.lazy('caption_llm')
 
-# OpenAI client for generating captions
-llm = ChatOpenAI(model="gpt-4", openai_api_key=Config.OPENAI_API_KEY, max_tokens=4096)
+# Shared pool for the concurrent S3 and RDS fetches of caption requests
+fetch_executor = ThreadPoolExecutor(max_workers=Config.CAPTION_FETCH_WORKERS, thread_name_prefix="caption-fetch")
 
-def fetch_product_data(client_id, product_id):
-    """Fetch the image and description from S3 for a given product."""
+# Shared pool for the day-range chunks of long campaigns
+chunk_executor = ThreadPoolExecutor(max_workers=Config.CAPTION_CHUNK_CONCURRENCY, thread_name_prefix="caption-chunk")
+
+# Concurrent identical caption prompts (double clicks, several tabs) share one LLM run
+caption_flight = SingleFlight("caption")
+
+def timed(timings, stage, fn, *args):
+    """Call fn, recording its duration in milliseconds under timings[stage]."""
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+def fetch_product_data(client_id, product_id, timings=None):
+    """Fetch the image and description from S3 and the campaign settings from RDS.
+
+    The three fetches run concurrently and share a CAPTION_FETCH_TIMEOUT budget,
+    so latency follows the slowest of them. Per-stage durations (ms) are
+    recorded in ``timings`` when a dict is passed.
+    """
+    timings = {} if timings is None else timings
+    failed = (None, None, None, None, None)
     
     image_key = f"client_uploads/{client_id}/{product_id}/image.png"
     description_key = f"client_uploads/{client_id}/{product_id}/description.txt"
     
-    image_data = get_s3_file(Config.S3_BUCKET_NAME, image_key)
-    description_data = get_s3_file(Config.S3_BUCKET_NAME, description_key)
+    start = time.perf_counter()
+    futures = {
+        "image": fetch_executor.submit(timed, timings, "image", get_s3_file, Config.S3_BUCKET_NAME, image_key),
+        "description": fetch_executor.submit(
+            timed, timings, "description", get_s3_file, Config.S3_BUCKET_NAME, description_key),
+        "campaign": fetch_executor.submit(
+            timed, timings, "campaign", get_campaign_from_client, client_id, product_id)
+    }
+    done, pending = wait(futures.values(), timeout=Config.CAPTION_FETCH_TIMEOUT)
+    timings["fetch"] = round((time.perf_counter() - start) * 1000, 1)
+
+    if pending:
+        # Stragglers finish in the background; their results are discarded
+        late = [stage for stage, future in futures.items() if future in pending]
+        logger.error(f"Timed out after {Config.CAPTION_FETCH_TIMEOUT}s fetching {', '.join(late)} "
+                     f"for client_id {client_id} and product_id {product_id}")
+        return failed
+
+    try:
+        image_data = futures["image"].result()
+        description_data = futures["description"].result()
+        campaign_data = futures["campaign"].result()
+    except Exception as e:
+        logger.error(f"Error fetching data for client_id {client_id} and product_id {product_id}: {e}")
+        return failed
 
     if not image_data or not description_data:
         logger.error(f"Missing image or description for client_id {client_id} and product_id {product_id}")
-        return None, None
+        return failed
+    if not campaign_data:
+        logger.error(f"Missing campaign for client_id {client_id} and product_id {product_id}")
+        return failed
 
     description_text = description_data.decode('utf-8')
     
     try:
-        image = Image.open(io.BytesIO(image_data))
+        image = timed(timings, "decode", Image.open, io.BytesIO(image_data))
     except Exception as e:
         logger.error(f"Error opening image for client_id {client_id} and product_id {product_id}: {e}")
-        return None, None
-
-    campaign_data = get_campaign_from_client(client_id, product_id)
+        return failed
 
     return image, description_text, campaign_data["campaign_type"], campaign_data["target_demographic"], campaign_data["length"]
 
-def generate_captions_from_context(query, context, campaign_type, demographic, length):
-    """Generate 7 days worth of captions and hashtags based on query and context."""
+# Bump the version whenever the prompt or parsing changes so stored captions are regenerated
+CAPTION_PROMPT_VERSION = "v1"
+
+def build_caption_prompt(query, context, campaign_type, demographic, length, first_day=1, last_day=None, avoid=()):
+    """Prompt for a whole campaign, or for days first_day..last_day of it when generating in chunks."""
+    if last_day is None or (first_day == 1 and last_day >= length):
+        request = f"Create {length} days' worth of Instagram captions to market this product: {query}."
+    else:
+        request = (f"This is a {length}-day Instagram campaign to market this product: {query}. "
+                   f"Create the captions for days {first_day} to {last_day} only, {last_day - first_day + 1} days in total.")
     prompt = [
-        HumanMessage(content=f"Using the following context: {context}. Create {length} days' worth of Instagram captions to market this product: {query}. For each day, generate captions along with relevant hashtags."),
+        HumanMessage(content=f"Using the following context: {context}. {request} For each day, generate captions along with relevant hashtags."),
         AIMessage(content=f"Each day should have a unique caption and a unique set of hashtags. Campaign type should be {campaign_type}. Target demographic is {demographic}."),
         HumanMessage(content="Output should be in the format: {\"day\": \"Day 1\", \"caption\": \"Caption text\", \"hashtags\": \"#hashtag1 #hashtag2\"}"),
     ]
+    if avoid:
+        prompt.append(HumanMessage(content="Do not repeat any of these captions: " + " | ".join(avoid)))
+    return prompt
+
+def parse_day(index, day_content):
+    """Turn one blank-line-separated block of model output into a day's caption and hashtags."""
+    lines = day_content.split("\n")
+    caption = lines[0]
+    hashtags = lines[1] if len(lines) > 1 else ""
+
+    return {
+        "day": f"Day {index}",
+        "caption": caption,
+        "hashtags": hashtags
+    }
+
+def caption_request_key(query, context, campaign_type, demographic, length):
+    """Identify a caption generation by everything that goes into its prompt."""
+    payload = [CAPTION_PROMPT_VERSION, query, context, campaign_type, demographic, length, Config.CAPTION_CHUNK_DAYS]
+    return hashlib.sha256(json.dumps(payload, default=str).encode('utf-8')).hexdigest()
+
+def generate_captions_from_context(query, context, campaign_type, demographic, length):
+    """Generate 7 days worth of captions and hashtags based on query and context.
+
+    Identical requests already in flight are joined rather than repeated.
+    """
+    key = caption_request_key(query, context, campaign_type, demographic, length)
+    return caption_flight.do(key, run_caption_generation, query, context, campaign_type, demographic, length)
+
+def run_caption_generation(query, context, campaign_type, demographic, length):
+    if isinstance(length, int) and length > Config.CAPTION_CHUNK_DAYS:
+        return generate_chunked_captions(query, context, campaign_type, demographic, length)
+
+    prompt = build_caption_prompt(query, context, campaign_type, demographic, length)
 
     try:
         response = llm(prompt)
@@ -59,15 +151,7 @@ def generate_captions_from_context(query, context, campaign_type, demographic, l
 
         captions = []
         for i, day_content in enumerate(days_content):
-            lines = day_content.split("\n")
-            caption = lines[0]
-            hashtags = lines[1] if len(lines) > 1 else ""
-
-            captions.append({
-                "day": f"Day {i+1}",
-                "caption": caption,
-                "hashtags": hashtags
-            })
+            captions.append(parse_day(i + 1, day_content))
 
         return captions
 
@@ -75,26 +159,183 @@ def generate_captions_from_context(query, context, campaign_type, demographic, l
         logger.error(f"Error generating captions from context: {e}")
         return None
 
-def generate_marketing_captions(client_id, product_id):
-    """Main function to generate 7 days of Instagram captions and hashtags."""
+def plan_chunks(length, chunk_days):
+    """Split days 1..length into consecutive (first_day, last_day) ranges of at most chunk_days."""
+    return [(first, min(first + chunk_days - 1, length)) for first in range(1, length + 1, chunk_days)]
+
+def generate_caption_chunk(query, context, campaign_type, demographic, length, first_day, last_day, avoid=()):
+    """Generate the days of one range; returns at most that many days, numbered from 1."""
+    prompt = build_caption_prompt(query, context, campaign_type, demographic, length, first_day, last_day, avoid)
+    content = llm(prompt).content.strip()
+    blocks = [block for block in content.split("\n\n") if block.strip()]
+    return [parse_day(i + 1, block.strip()) for i, block in enumerate(blocks[:last_day - first_day + 1])]
+
+def normalize_caption(caption):
+    return " ".join(caption.lower().split())
+
+def dedupe_hashtags(hashtags):
+    """Drop repeated hashtags within a day, keeping the first occurrence."""
+    seen = set()
+    tags = []
+    for tag in hashtags.split():
+        if tag.lower() not in seen:
+            seen.add(tag.lower())
+            tags.append(tag)
+    return " ".join(tags)
+
+def normalize_hashtags(hashtags):
+    """A day's hashtags as a set, ignoring case and order."""
+    return frozenset(tag.lower() for tag in hashtags.split())
+
+def merge_chunks(chunks):
+    """Concatenate chunk days in order, renumbering the days.
+
+    A day repeating an earlier day's caption or its whole set of hashtags is
+    dropped, so the follow-up call replaces it.
+    """
+    seen = set()
+    seen_hashtags = set()
+    days = []
+    for chunk in chunks:
+        for day in chunk:
+            key = normalize_caption(day["caption"])
+            hashtags = normalize_hashtags(day["hashtags"])
+            if not key or key in seen or (hashtags and hashtags in seen_hashtags):
+                continue
+            seen.add(key)
+            if hashtags:
+                seen_hashtags.add(hashtags)
+            days.append({**day, "day": f"Day {len(days) + 1}", "hashtags": dedupe_hashtags(day["hashtags"])})
+    return days
+
+def generate_chunked_captions(query, context, campaign_type, demographic, length):
+    """Generate a long campaign as concurrent day-range chunks sharing the same context.
+
+    Chunks are merged in day order with days repeating a caption or a hashtag
+    set removed. Days lost to duplicates, truncation or a failed chunk are filled by one follow-up
+    call that is told which captions already exist.
+    """
+    start = time.perf_counter()
+    ranges = plan_chunks(length, Config.CAPTION_CHUNK_DAYS)
+    futures = [
+        chunk_executor.submit(generate_caption_chunk, query, context, campaign_type, demographic, length, first, last)
+        for first, last in ranges
+    ]
+    chunks = []
+    for (first, last), future in zip(ranges, futures):
+        try:
+            chunks.append(future.result())
+        except Exception as e:
+            logger.error(f"Error generating captions for days {first}-{last}: {e}")
+            chunks.append([])
+
+    days = merge_chunks(chunks)
+    missing = length - len(days)
+    if missing > 0:
+        try:
+            top_up = generate_caption_chunk(query, context, campaign_type, demographic, length,
+                                            len(days) + 1, length, avoid=[day["caption"] for day in days])
+            days = merge_chunks([days, top_up])
+        except Exception as e:
+            logger.error(f"Error generating the remaining {missing} days: {e}")
+
+    logger.info(f"Generated {len(days)} of {length} days in {len(ranges)} chunks "
+                f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return days[:length] or None
+
+class DayStreamParser:
+    """Incrementally split streamed model output into days.
+
+    Text is buffered until a blank line closes a day's block; ``feed``
+    returns the days completed by each chunk and ``finish`` the last one.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.days = 0
+
+    def feed(self, text):
+        self.buffer += text
+        days = []
+        while "\n\n" in self.buffer:
+            block, self.buffer = self.buffer.split("\n\n", 1)
+            days.extend(self._emit(block))
+        return days
+
+    def finish(self):
+        block, self.buffer = self.buffer, ""
+        return self._emit(block)
+
+    def _emit(self, block):
+        block = block.strip()
+        # Runs of blank lines separate days; they are not days themselves
+        if not block:
+            return []
+        self.days += 1
+        return [parse_day(self.days, block)]
+
+def stream_captions_from_context(query, context, campaign_type, demographic, length):
+    """Yield each day's caption and hashtags as soon as the model has finished writing it."""
+    prompt = build_caption_prompt(query, context, campaign_type, demographic, length)
+    parser = DayStreamParser()
+    for chunk in llm.stream(prompt):
+        yield from parser.feed(chunk.content)
+    yield from parser.finish()
+
+def prepare_caption_inputs(client_id, product_id, context_report=None):
+    """Fetch the product, describe its image and retrieve context; None if any input is missing.
+
+    ``context_report``, when a dict is passed, receives the context builder's token report.
+    """
     
-    # Fetch product data from S3
-    image, description_text, campaign_type, demographic, length = fetch_product_data(client_id, product_id)
+    # Fetch product data from S3 and the campaign from RDS
+    timings = {}
+    image, description_text, campaign_type, demographic, length = fetch_product_data(client_id, product_id, timings)
+    logger.info(f"Fetched data for client_id {client_id} and product_id {product_id}: "
+                + ", ".join(f"{stage} {ms} ms" for stage, ms in timings.items()))
     
     if not image or not description_text:
         return None
 
     # Extract image features
     image_features = extract_image_features(image)
+    if image_features == IMAGE_FEATURES_ERROR:
+        # Captions built on the error text would be fingerprinted and served as a cache hit
+        logger.error(f"No image features for client_id {client_id} and product_id {product_id}")
+        return None
     
     # Combine image features with the product description
     combined_text = f"Features: {image_features}\nDescription: {description_text}"
 
-    # Perform similarity search using the combined text
-    context = perform_similarity_search(combined_text)
+    # Perform similarity search using the combined text, optionally diversified so
+    # near-duplicate posts do not crowd the context
+    results = perform_similarity_search(combined_text, k=Config.CAPTION_CONTEXT_POSTS,
+                                        rerank="mmr" if Config.CAPTION_CONTEXT_MMR else None)
+
+    # Pack the posts into the prompt's token budget
+    context, report = build_caption_context(
+        results,
+        max_tokens=Config.CAPTION_CONTEXT_MAX_TOKENS,
+        max_post_tokens=Config.CAPTION_CONTEXT_POST_TOKENS,
+        dedupe_threshold=Config.CAPTION_CONTEXT_DEDUPE_THRESHOLD
+    )
+    logger.info(f"Caption context for client_id {client_id} and product_id {product_id}: "
+                f"{report['context_tokens']} tokens from {report['posts_used']} posts, "
+                f"{report['tokens_saved']} tokens saved")
+    if context_report is not None:
+        context_report.update(report)
+
+    return combined_text, context, campaign_type, demographic, length
+
+def generate_marketing_captions(client_id, product_id):
+    """Main function to generate 7 days of Instagram captions and hashtags."""
+    context_report = {}
+    inputs = prepare_caption_inputs(client_id, product_id, context_report)
+    if not inputs:
+        return None
 
     # Generate captions based on the query and the retrieved context
-    captions = generate_captions_from_context(combined_text, context, campaign_type, demographic, length)
+    captions = generate_captions_from_context(*inputs)
 
     if not captions:
         return None
@@ -103,5 +344,13 @@ def generate_marketing_captions(client_id, product_id):
     return {
         "client_id": client_id,
         "product_id": product_id,
-        "campaign_day": captions
+        "campaign_day": captions,
+        "prompt_context": context_report
     }
+
+def stream_marketing_captions(client_id, product_id):
+    """Streaming variant of generate_marketing_captions: a generator of days, or None if inputs are missing."""
+    inputs = prepare_caption_inputs(client_id, product_id)
+    if not inputs:
+        return None
+    return stream_captions_from_context(*inputs)
@@ -0,0 +1,69 @@
+import time
+import logging
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# BatchWriteItem accepts at most 25 put requests
+MAX_BATCH_ITEMS = 25
+
+
+class DynamoBatchWriter:
+    """Buffer DynamoDB puts and send them with BatchWriteItem.
+
+    Works like ``table.batch_writer()`` but retries unprocessed items with
+    exponential backoff for a bounded number of attempts and records the keys
+    of items that could not be written in ``failed_keys``. Items sharing a key
+    are de-duplicated (last write wins), since one request may not contain the
+    same key twice. Use as a context manager to flush on exit.
+    """
+
+    def __init__(self, table, key_name, max_retries=5, backoff_seconds=0.1):
+        self.table = table
+        self.key_name = key_name
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.failed_keys = []
+        self._buffer = {}
+
+    def put(self, item):
+        """Queue an item, sending a request once a full batch has accumulated."""
+        self._buffer[item[self.key_name]] = item
+        if len(self._buffer) >= MAX_BATCH_ITEMS:
+            self.flush()
+
+    def flush(self):
+        """Send everything still buffered."""
+        items = list(self._buffer.values())
+        self._buffer = {}
+        for start in range(0, len(items), MAX_BATCH_ITEMS):
+            self._send(items[start:start + MAX_BATCH_ITEMS])
+
+    def _send(self, items):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        attempt = 0
+        while requests:
+            try:
+                response = self.table.meta.client.batch_write_item(
+                    RequestItems={self.table.name: requests}
+                )
+                requests = response.get('UnprocessedItems', {}).get(self.table.name, [])
+            except Exception as e:
+                logger.error(f"Error writing a batch of {len(requests)} items to {self.table.name}: {e}")
+
+            if not requests:
+                return
+            attempt += 1
+            if attempt > self.max_retries:
+                break
+            time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+        failed = [request['PutRequest']['Item'][self.key_name] for request in requests]
+        logger.error(f"Giving up on {len(failed)} items for {self.table.name} after {self.max_retries} retries")
+        self.failed_keys.extend(failed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.flush()
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import logging
+from array import array
+from langchain_core.embeddings import Embeddings
+from app.clients import clients
+from .singleflight import SingleFlight
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "text-embedding-ada-002"
+
+
+def pack_vector(vector):
+    """Store a vector compactly as base64-encoded float32s."""
+    return base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+
+
+def unpack_vector(packed):
+    vector = array('f')
+    vector.frombytes(base64.b64decode(packed))
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from a cache.
+
+    Keys are the model name plus a SHA-256 of the text, so documents and
+    queries share entries. Only the texts that miss are sent to the wrapped
+    model, in a single ``embed_documents`` call. Concurrent ``embed_query``
+    calls for the same text share one request.
+    """
+
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.flight = SingleFlight("embedding")
+
+    def cache_key(self, text):
+        return f"{self.model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def embed_documents(self, texts):
+        keys = [self.cache_key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                vectors[i] = unpack_vector(cached)
+            else:
+                # Embed each distinct text once, even if it repeats within the call
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            miss_keys = list(missing)
+            embedded = self.embeddings.embed_documents([texts[missing[key][0]] for key in miss_keys])
+            for key, vector in zip(miss_keys, embedded):
+                self.cache.set(key, pack_vector(vector))
+                for i in missing[key]:
+                    vectors[i] = list(vector)
+            logger.info(f"Embedded {len(miss_keys)} texts, {len(texts) - sum(map(len, missing.values()))} from cache")
+        return vectors
+
+    def embed_query(self, text):
+        return self.flight.do(self.cache_key(text), lambda: self.embed_documents([text])[0])
+
+
+# Shared by the indexing and retrieval services, created on first use
+embedding_model = clients.lazy('embedding_model')
@@ -0,0 +1,68 @@
+import io
+import base64
+from PIL import Image
+
+# Longest side used for "low" detail; the vision model downsamples to 512px anyway
+LOW_DETAIL_MAX_DIMENSION = 512
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp"
+}
+
+
+def downscale_image(image, max_dimension):
+    """Return a copy of the image whose longest side is at most max_dimension pixels."""
+    if not max_dimension or max(image.size) <= max_dimension:
+        return image
+    scale = max_dimension / max(image.size)
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def flatten_alpha(image):
+    """Convert an image to RGB, compositing any transparency onto a white background."""
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return image.convert("RGB")
+
+
+def preprocess_image(image, max_dimension=None, image_format="JPEG", quality=85, detail="auto"):
+    """Downscale and re-encode an image for a vision request.
+
+    Returns the encoded bytes and their MIME type. "low" detail caps the longest
+    side at LOW_DETAIL_MAX_DIMENSION regardless of max_dimension.
+    """
+    image_format = image_format.upper()
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported vision image format: {image_format}")
+
+    if detail == "low":
+        max_dimension = min(max_dimension or LOW_DETAIL_MAX_DIMENSION, LOW_DETAIL_MAX_DIMENSION)
+    image = downscale_image(image, max_dimension)
+
+    save_options = {}
+    if image_format == "JPEG":
+        image = flatten_alpha(image)
+        save_options = {"quality": quality, "optimize": True}
+    elif image_format == "WEBP":
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        save_options = {"quality": quality, "method": 4}
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **save_options)
+    return buffer.getvalue(), MIME_TYPES[image_format]
+
+
+def encode_image_data_url(image, max_dimension=None, image_format="JPEG", quality=85, detail="auto"):
+    """Preprocess an image and return it as a base64 data URL."""
+    image_bytes, mime_type = preprocess_image(image, max_dimension, image_format, quality, detail)
+    base64_image = base64.b64encode(image_bytes).decode("utf-8")
+    return f"data:{mime_type};base64,{base64_image}"
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app.config import Config
+from .utils import process_all_products
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Bulk indexing jobs run one at a time: they share the index manifest
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-job")
+
+# Jobs owned by this process; anything else on disk came from an earlier process
+jobs = {}
+jobs_lock = threading.Lock()
+
+ACTIVE_STATES = ("queued", "running")
+
+# Held by whichever process on this host is running a bulk indexing run
+RUN_LOCK_FILE = "bulk-run.lock"
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def job_path(job_id):
+    """Path of the JSON file that checkpoints a job's state."""
+    return os.path.join(Config.INDEX_JOBS_DIR, f"{job_id}.json")
+
+
+def save_job(job):
+    """Persist a job's state atomically."""
+    os.makedirs(Config.INDEX_JOBS_DIR, exist_ok=True)
+    path = job_path(job["job_id"])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_job(job_id):
+    """Return a copy of the job, marking jobs left active by a dead process as interrupted."""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return None
+
+    with jobs_lock:
+        if job_id in jobs:
+            return dict(jobs[job_id])
+
+    path = job_path(job_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            job = json.load(f)
+        updated = os.path.getmtime(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading indexing job {job_id}: {e}")
+        return None
+    if job.get("state") in ACTIVE_STATES and owner_gone(job, updated, Config.INDEX_JOB_STALE_SECONDS):
+        job["state"] = "interrupted"
+    return job
+
+
+def owner_gone(job, updated, stale_seconds):
+    """Whether the process that owns an active job on disk has died.
+
+    A job not in this process belongs to another worker. It is abandoned if
+    that worker runs on this host and no longer exists, or if its file has
+    not been touched for ``stale_seconds`` (which also covers other hosts
+    and reused process ids).
+    """
+    if time.time() - updated > stale_seconds:
+        return True
+    if job.get("host") != socket.gethostname() or not job.get("pid"):
+        return False
+    if job["pid"] == os.getpid():
+        # Not in this process's jobs, so it was left by an earlier process with the same id
+        return True
+    try:
+        os.kill(job["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def acquire_run_lock(owner):
+    """Take the host-wide bulk indexing lock without waiting; returns its open file, or None if held.
+
+    The kernel releases the lock when its holder exits, so a crashed run never
+    blocks the next one. ``owner`` (a job id) is written into the file for
+    ``run_lock_owner``.
+    """
+    os.makedirs(Config.INDEX_JOBS_DIR, exist_ok=True)
+    lock_file = open(os.path.join(Config.INDEX_JOBS_DIR, RUN_LOCK_FILE), 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(owner)
+    lock_file.flush()
+    return lock_file
+
+
+def release_run_lock(lock_file):
+    lock_file.seek(0)
+    lock_file.truncate()
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+def run_lock_owner():
+    """Id of the job holding the bulk indexing lock, as written by its holder."""
+    try:
+        with open(os.path.join(Config.INDEX_JOBS_DIR, RUN_LOCK_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def job_status(job):
+    """Add derived progress figures (remaining work and throughput) to a job record."""
+    status = dict(job)
+    done = job["processed"] + job["failed"]
+    status["remaining"] = max(job["pending"] - done, 0)
+
+    elapsed = None
+    if job.get("run_started_at"):
+        run_end = job.get("run_finished_at")
+        if run_end is None:
+            run_end = time.time() if job["state"] in ACTIVE_STATES else job.get("last_progress_at")
+        elapsed = (run_end or job["run_started_at"]) - job["run_started_at"]
+    status["elapsed_seconds"] = round(elapsed, 1) if elapsed else 0.0
+    status["throughput_per_minute"] = round(done / elapsed * 60, 2) if elapsed else 0.0
+    return status
+
+
+def update_job(job_id, **fields):
+    with jobs_lock:
+        job = jobs[job_id]
+        job.update(fields)
+        job["updated_at"] = now_iso()
+        job["last_progress_at"] = time.time()
+        snapshot = dict(job)
+    try:
+        save_job(snapshot)
+    except OSError as e:
+        logger.error(f"Error checkpointing indexing job {job_id}: {e}")
+
+
+def run_job(job_id, force, lock_file):
+    """Worker entry point: run process_all_products and record its progress, then release the run lock."""
+    try:
+        run_locked_job(job_id, force)
+    finally:
+        release_run_lock(lock_file)
+
+
+def run_locked_job(job_id, force):
+    update_job(job_id, state="running", run_started_at=time.time(), run_finished_at=None)
+
+    def progress(summary):
+        update_job(job_id, **summary)
+
+    try:
+        summary = process_all_products(force=force, progress=progress)
+        update_job(job_id, state="completed", run_finished_at=time.time(), finished_at=now_iso(), **summary)
+    except Exception as e:
+        logger.error(f"Indexing job {job_id} failed: {e}")
+        update_job(job_id, state="failed", error=str(e), run_finished_at=time.time(), finished_at=now_iso())
+
+
+def enqueue_job(job, force):
+    """Hand a job to the worker unless a run is active in any process on this host.
+
+    Returns the active run's job id (or "unknown") if so, else None.
+    """
+    lock_file = acquire_run_lock(job["job_id"])
+    if lock_file is None:
+        return run_lock_owner() or "unknown"
+    try:
+        job.update(host=socket.gethostname(), pid=os.getpid())
+        with jobs_lock:
+            jobs[job["job_id"]] = job
+            save_job(job)
+        executor.submit(run_job, job["job_id"], force, lock_file)
+    except Exception:
+        with jobs_lock:
+            jobs.pop(job["job_id"], None)
+        release_run_lock(lock_file)
+        raise
+    return None
+
+
+def run_indexing_now(force=False):
+    """Run process_all_products in this request under the run lock; ``(summary, None)`` or ``(None, job_id)``."""
+    lock_file = acquire_run_lock("sync")
+    if lock_file is None:
+        return None, run_lock_owner() or "unknown"
+    try:
+        return process_all_products(force=force), None
+    finally:
+        release_run_lock(lock_file)
+
+
+def start_indexing_job(force=False):
+    """Start a background bulk-indexing job, unless one is already running."""
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "state": "queued",
+        "force": force,
+        "attempts": 1,
+        "created_at": now_iso(),
+        "updated_at": now_iso(),
+        "finished_at": None,
+        "total": 0,
+        "pending": 0,
+        "processed": 0,
+        "skipped": 0,
+        "failed": 0
+    }
+    active_job_id = enqueue_job(job, force)
+    if active_job_id:
+        return {"status": "error", "message": "An indexing job is already running", "job_id": active_job_id}, 409
+    logger.info(f"Started indexing job {job['job_id']}")
+    return {"status": "success", "job_id": job["job_id"]}, 202
+
+
+def resume_indexing_job(job_id):
+    """Restart a failed or interrupted job; the manifest checkpoint skips work already done."""
+    job = load_job(job_id)
+    if not job:
+        return {"status": "error", "message": "Job not found"}, 404
+    if job["state"] in ACTIVE_STATES:
+        return {"status": "error", "message": f"Job is already {job['state']}"}, 409
+    if job["state"] == "completed":
+        return {"status": "error", "message": "Job has already completed"}, 409
+
+    job.update({
+        "state": "queued",
+        "attempts": job.get("attempts", 1) + 1,
+        "error": None,
+        "finished_at": None,
+        "processed": 0,
+        "failed": 0
+    })
+    # A forced run already cleared the manifest when it first started
+    active_job_id = enqueue_job(job, force=False)
+    if active_job_id:
+        return {"status": "error", "message": "An indexing job is already running", "job_id": active_job_id}, 409
+    logger.info(f"Resumed indexing job {job_id}")
+    return {"status": "success", "job_id": job_id}, 202
+
+
+def get_indexing_job_status(job_id):
+    """Return a job's progress: processed, failed and remaining counts plus throughput."""
+    job = load_job(job_id)
+    if not job:
+        return {"status": "error", "message": "Job not found"}, 404
+    return {"status": "success", "job": job_status(job)}, 200
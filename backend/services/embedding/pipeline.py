@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class PipelineStage:
+    """One step of an IndexingPipeline.
+
+    ``fn`` is a blocking callable run on the stage's own thread pool of
+    ``concurrency`` workers. It receives a job dict (or, after a batching stage,
+    a list of job dicts) and returns what the next stage should receive, or
+    None to fail every product in it. A function may also fail individual
+    products in a batch by setting ``job["error"]``.
+
+    When ``batch_size`` is set, the stage first groups incoming jobs into lists
+    of at most ``batch_size`` jobs and ``batch_max_weight`` total ``weigh(job)``,
+    flushing early after ``batch_linger`` seconds without new input.
+    """
+
+    def __init__(self, name, fn, concurrency, batch_size=None, batch_max_weight=None, weigh=None,
+                 batch_linger=1.0):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, concurrency)
+        self.batch_size = batch_size
+        self.batch_max_weight = batch_max_weight
+        self.weigh = weigh or (lambda job: 0)
+        self.batch_linger = batch_linger
+
+
+class IndexingPipeline:
+    """Run product jobs through stages connected by bounded asyncio queues.
+
+    Every stage has its own concurrency limit, and the bounded queues between
+    stages provide backpressure: a fast stage (e.g. S3 fetch) blocks once the
+    slower stage after it (e.g. the vision model) has ``queue_size`` jobs
+    waiting, instead of buffering the whole catalog in memory.
+    """
+
+    def __init__(self, stages, queue_size=32, on_result=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_result = on_result
+        self.results = {}
+
+    def run(self, product_ids):
+        """Process the products and return a mapping of product_id to success."""
+        self.results = {}
+        asyncio.run(self._run(product_ids))
+        return self.results
+
+    def _finish(self, job, success):
+        product_id = job["product_id"]
+        if product_id in self.results:
+            return
+        self.results[product_id] = success
+        if not success:
+            logger.error(f"Processing failed for product_id {product_id}: {job.get('error', 'unknown error')}")
+        if self.on_result:
+            try:
+                self.on_result(product_id, success)
+            except Exception as e:
+                logger.error(f"Error in pipeline result callback for product_id {product_id}: {e}")
+
+    def _fail(self, item, error):
+        for job in item if isinstance(item, list) else [item]:
+            job.setdefault("error", error)
+            self._finish(job, False)
+
+    def _drop_failed(self, item):
+        """Finish jobs a stage marked as failed and return what remains, or None."""
+        if isinstance(item, list):
+            for job in item:
+                if job.get("error"):
+                    self._finish(job, False)
+            remaining = [job for job in item if not job.get("error")]
+            return remaining or None
+        if item.get("error"):
+            self._finish(item, False)
+            return None
+        return item
+
+    async def _run(self, product_ids):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        executors = [
+            ThreadPoolExecutor(max_workers=stage.concurrency, thread_name_prefix=f"index-{stage.name}")
+            for stage in self.stages
+        ]
+        try:
+            tasks = [asyncio.ensure_future(self._feed(product_ids, queues[0]))]
+            for i, stage in enumerate(self.stages):
+                outbox = queues[i + 1] if i + 1 < len(queues) else None
+                inbox = queues[i]
+                if stage.batch_size:
+                    batches = asyncio.Queue(maxsize=self.queue_size)
+                    tasks.append(asyncio.ensure_future(self._batch(stage, inbox, batches)))
+                    inbox = batches
+                tasks.append(asyncio.ensure_future(self._stage(stage, executors[i], inbox, outbox)))
+            await asyncio.gather(*tasks)
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=False)
+
+    async def _feed(self, product_ids, outbox):
+        for product_id in product_ids:
+            await outbox.put({"product_id": product_id})
+        await outbox.put(_DONE)
+
+    async def _batch(self, stage, inbox, outbox):
+        batch, weight, done = [], 0, False
+        while not done:
+            try:
+                item = await asyncio.wait_for(inbox.get(), timeout=stage.batch_linger if batch else None)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is _DONE:
+                done = True
+            elif item is not None:
+                item_weight = stage.weigh(item)
+                if batch and stage.batch_max_weight and weight + item_weight > stage.batch_max_weight:
+                    await outbox.put(batch)
+                    batch, weight = [], 0
+                batch.append(item)
+                weight += item_weight
+
+            full = len(batch) >= stage.batch_size or (
+                stage.batch_max_weight and weight >= stage.batch_max_weight)
+            if batch and (full or done or item is None):
+                await outbox.put(batch)
+                batch, weight = [], 0
+        await outbox.put(_DONE)
+
+    async def _stage(self, stage, executor, inbox, outbox):
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # Let sibling workers see the end of input too
+                    await inbox.put(_DONE)
+                    return
+                try:
+                    result = await loop.run_in_executor(executor, stage.fn, item)
+                except Exception as e:
+                    logger.error(f"Unhandled exception in {stage.name} stage: {e}")
+                    result = None
+
+                if result is None:
+                    self._fail(item, f"{stage.name} stage failed")
+                    continue
+                result = self._drop_failed(result)
+                if result is None:
+                    continue
+                if outbox is None:
+                    for job in result if isinstance(result, list) else [result]:
+                        self._finish(job, True)
+                else:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(stage.concurrency)))
+        if outbox is not None:
+            await outbox.put(_DONE)
@@ -1,7 +1,8 @@
 import logging
-from flask import jsonify
+from flask import jsonify, request
 from . import embedding_bp
-from .utils import process_product, process_all_products
+from .utils import process_product
+from .jobs import start_indexing_job, get_indexing_job_status, resume_indexing_job, run_indexing_now
 
 @embedding_bp.route('/process/<product_id>', methods=['GET'])
 def process_embedding(product_id):
@@ -18,8 +19,43 @@ def process_embedding(product_id):
 @embedding_bp.route('/process_all', methods=['GET'])
 def process_all_embeddings():
     try:
-        process_all_products()
-        return jsonify({"status": "success", "message": "All products processed"}), 200
+        force = request.args.get('force', 'false').lower() == 'true'
+        summary, active_job_id = run_indexing_now(force=force)
+        if summary is None:
+            return jsonify({"status": "error", "message": "An indexing job is already running",
+                            "job_id": active_job_id}), 409
+        return jsonify({"status": "success", "message": "All products processed", "summary": summary}), 200
     except Exception as e:
         logging.error(f"Error processing all embeddings: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
+
+@embedding_bp.route('/jobs', methods=['POST'])
+def start_embedding_job():
+    """Start bulk indexing in the background and return its job id."""
+    try:
+        data = request.get_json(silent=True) or {}
+        response, status_code = start_indexing_job(force=bool(data.get('force', False)))
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error starting indexing job: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@embedding_bp.route('/jobs/<job_id>', methods=['GET'])
+def embedding_job_status(job_id):
+    """Report processed, failed and remaining counts and throughput for a job."""
+    try:
+        response, status_code = get_indexing_job_status(job_id)
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error fetching indexing job {job_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@embedding_bp.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_embedding_job(job_id):
+    """Resume an interrupted or failed job from its last checkpoint."""
+    try:
+        response, status_code = resume_indexing_job(job_id)
+        return jsonify(response), status_code
+    except Exception as e:
+        logging.error(f"Error resuming indexing job {job_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
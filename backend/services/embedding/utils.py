@@ -1,20 +1,21 @@
 import io
-import boto3
+import os
+import json
 import botocore
-import base64
 import logging
 import uuid
+import hashlib
+from datetime import datetime, timezone
 from PIL import Image
-from boto3.dynamodb.conditions import Key
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tiktoken import get_encoding
-from langchain.chat_models import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.schema import HumanMessage, AIMessage
-from langchain_chroma import Chroma
-import chromadb
 import warnings
 from app.config import Config
+from app.clients import clients
+from .imaging import encode_image_data_url
+from .pipeline import IndexingPipeline, PipelineStage
+from .batch_writer import DynamoBatchWriter
+from .embeddings import embedding_model
+from .singleflight import SingleFlight
 
 warnings.filterwarnings("ignore")
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -22,31 +23,37 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Initialize clients with configurations
-s3 = boto3.client('s3', region_name=Config.AWS_REGION)
-dynamodb = boto3.resource('dynamodb', region_name=Config.AWS_REGION)
-table = dynamodb.Table(Config.DYNAMODB_TABLE_NAME)
-
-# Initialize the embedding model
-embedding_model = OpenAIEmbeddings(
-    model="text-embedding-ada-002",
-    openai_api_key=Config.OPENAI_API_KEY
-)
-
-# Initialize the ChromaDB client and vector store
-chromadb_client = chromadb.HttpClient(
-    host=Config.CHROMADB_HOST,
-    port=Config.CHROMADB_PORT,
-    ssl=False
-)
-vector_store = Chroma(
-    collection_name="insta_posts",
-    embedding_function=embedding_model,
-    client=chromadb_client
+# Shared clients, created on first use by the registry
+s3 = clients.lazy('s3')
+table = clients.lazy('products_table')
+vector_store = clients.lazy('vector_store')
+
+# Token encoder
+encoder = clients.lazy('encoder')
+
+# GPT-4o client for image features, reused across requests and threads
+vision_llm = clients.lazy('vision_llm')
+
+# Cache of vision-model features, keyed by image content and prompt version
+feature_cache = clients.lazy('feature_cache')
+# Concurrent requests for the same uncached image share one vision call
+vision_flight = SingleFlight("vision")
+# Retriever results cached in this process, invalidated on every ChromaDB write
+search_cache = clients.lazy('search_cache')
+# Local copies of the collection: vectors when RETRIEVER_BACKEND is numpy, BM25 terms always
+vector_index = clients.lazy('vector_index')
+lexical_index = clients.lazy('lexical_index')
+
+# Bump the version whenever the prompt changes so stale features are not reused
+IMAGE_FEATURES_PROMPT_VERSION = "v1"
+IMAGE_FEATURES_PROMPT = (
+    "Generate a list of features separated by commas of the products from this photo. "
+    "Generate 10 prominent features from this image about whatever product it focuses on. "
+    "Generate just a paragraph of words separated by commas. "
+    "The features should not contain names of any brand or product. It can contain chemical names, "
+    "colour, other visually identifiable features."
 )
-
-# Initialize token encoder
-encoder = get_encoding("cl100k_base")
+IMAGE_FEATURES_ERROR = "Error in generating image features"
 
 # Utility Functions
 
@@ -67,6 +74,53 @@ def list_product_ids(bucket_name, base_folder):
     return list(product_ids)
 
 
+def list_product_etags(bucket_name, base_folder):
+    """List the ETags of each product's image and description in a single listing pass."""
+    paginator = s3.get_paginator('list_objects_v2')
+    operation_parameters = {'Bucket': bucket_name, 'Prefix': base_folder}
+    product_etags = {}
+
+    for page in paginator.paginate(**operation_parameters):
+        for obj in page.get('Contents', []):
+            relative_key = obj['Key'][len(base_folder):]
+            if '/' not in relative_key:
+                continue
+            product_id, file_name = relative_key.split('/', 1)
+            etags = product_etags.setdefault(product_id, {})
+            if file_name in ('image.png', 'description.txt'):
+                etags[file_name] = obj['ETag'].strip('"')
+    logger.info(f"Found {len(product_etags)} product IDs.")
+    return product_etags
+
+
+def load_index_manifest(path):
+    """Load the indexing manifest, returning an empty one if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable index manifest {path}: {e}")
+        return {}
+
+
+def save_index_manifest(path, manifest):
+    """Write the indexing manifest atomically so an interrupted run never corrupts it."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def needs_reindex(entry, etags):
+    """Check whether a product is new, previously failed, or changed since it was last indexed."""
+    if not entry or entry.get('status') != 'indexed':
+        return True
+    return (entry.get('image_etag') != etags.get('image.png')
+            or entry.get('description_etag') != etags.get('description.txt'))
+
+
 def get_s3_file(bucket_name, file_key):
     """Fetch a file from S3."""
     try:
@@ -77,15 +131,30 @@ def get_s3_file(bucket_name, file_key):
         return None
 
 
+def get_s3_etag(bucket_name, file_key):
+    """Fetch a file's ETag from S3 without downloading it."""
+    try:
+        response = s3.head_object(Bucket=bucket_name, Key=file_key)
+        return response['ETag'].strip('"')
+    except botocore.exceptions.ClientError as e:
+        logger.error(f"Error fetching the ETag of {file_key} from S3: {e}")
+        return None
+
+
+def product_link_item(product_id, chromadb_id, campaign_id):
+    """Build the DynamoDB item linking S3 resources and ChromaDB embeddings."""
+    return {
+        'product_id': product_id,
+        'chroma_id': chromadb_id,
+        'CampaignID': campaign_id
+    }
+
+
 def update_dynamo_db(product_id, chromadb_id, campaign_id):
     """Link S3 resources and ChromaDB embeddings in DynamoDB."""
     try:
         table.put_item(
-            Item={
-                'product_id': product_id,
-                'chroma_id': chromadb_id,
-                'CampaignID': campaign_id
-            }
+            Item=product_link_item(product_id, chromadb_id, campaign_id)
         )
         logger.info(f"DynamoDB updated for product_id {product_id}")
     except Exception as e:
@@ -106,61 +175,81 @@ def truncate_text(text, max_tokens):
     return text
 
 
-def encode_image(image):
-    """Encode a PIL image as a base64 string."""
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    buffer.seek(0)
-    base64_image = base64.b64encode(buffer.read()).decode("utf-8")
-    return base64_image
+def image_cache_key(image):
+    """Build a content-addressed cache key from the image pixels and the prompt version."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}:".encode("utf-8"))
+    digest.update(image.tobytes())
+    return f"{IMAGE_FEATURES_PROMPT_VERSION}:{vision_settings_tag()}:{digest.hexdigest()}"
+
+
+def vision_settings_tag():
+    """Describe the image preprocessing settings, since they change what the model sees."""
+    return (f"{Config.VISION_IMAGE_DETAIL}-{Config.VISION_MAX_DIMENSION}-"
+            f"{Config.VISION_IMAGE_FORMAT}-{Config.VISION_IMAGE_QUALITY}")
 
 
 def extract_image_features(image):
     """Extract image features using Langchain's OpenAI and a base64-encoded image."""
-    # Encode the image to base64 format
-    base64_image = encode_image(image)
-    
-    # Initialize the OpenAI client
-    llm = ChatOpenAI(
-        model="gpt-4o",
-        max_tokens=4096,
-        openai_api_key=Config.OPENAI_API_KEY
-    )
-    
-    # Create the prompt
-    prompt = [
-        AIMessage(content=(
-            "Generate a list of features separated by commas of the products from this photo. "
-            "Generate 10 prominent features from this image about whatever product it focuses on. "
-            "Generate just a paragraph of words separated by commas. "
-            "The features should not contain names of any brand or product. It can contain chemical names, "
-            "colour, other visually identifiable features."
-        )),
-        HumanMessage(content=[
-            {"type": "text", "text": "Describe the contents of this image."},
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{base64_image}"
-                },
-            },
-        ])
-    ]
+    # Serve repeated images from the cache instead of the vision model
+    try:
+        cache_key = image_cache_key(image)
+    except Exception as e:
+        logger.warning(f"Could not compute image cache key, skipping cache: {e}")
+        cache_key = None
+
+    if not cache_key:
+        return describe_image(image, cache_key)
+
+    cached_features = feature_cache.get(cache_key)
+    if cached_features is not None:
+        logger.info(f"Image features served from cache for {cache_key}")
+        return cached_features
+    return vision_flight.do(cache_key, describe_image, image, cache_key)
+
 
+def describe_image(image, cache_key=None):
+    """Ask the vision model for the image's features, caching them under cache_key."""
     try:
+        # Downscale and encode the image to a compact base64 data URL
+        image_url = encode_image_data_url(
+            image,
+            max_dimension=Config.VISION_MAX_DIMENSION,
+            image_format=Config.VISION_IMAGE_FORMAT,
+            quality=Config.VISION_IMAGE_QUALITY,
+            detail=Config.VISION_IMAGE_DETAIL
+        )
+
+        # Create the prompt
+        prompt = [
+            AIMessage(content=IMAGE_FEATURES_PROMPT),
+            HumanMessage(content=[
+                {"type": "text", "text": "Describe the contents of this image."},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                        "detail": Config.VISION_IMAGE_DETAIL
+                    },
+                },
+            ])
+        ]
+
         # Send the prompt to the model
-        response = llm(prompt)
+        response = vision_llm(prompt)
         image_description = response.content.strip()
+        if cache_key:
+            feature_cache.set(cache_key, image_description)
         return image_description
 
     except Exception as e:
         logger.error(f"Error in generating image features: {e}")
-        return "Error in generating image features"
+        return IMAGE_FEATURES_ERROR
 
 
-def process_product(product_id):
-    """Process a single product ID: fetch data, generate embeddings, and update databases."""
-    logger.info(f"Processing product_id {product_id}")
+def fetch_product_files(job):
+    """Pipeline stage: fetch a product's image and description from S3."""
+    product_id = job["product_id"]
     image_key = f"{Config.S3_BASE_FOLDER}{product_id}/image.png"
     description_key = f"{Config.S3_BASE_FOLDER}{product_id}/description.txt"
 
@@ -169,76 +258,269 @@ def process_product(product_id):
 
     if not image_data:
         logger.warning(f"Skipping product_id {product_id} due to missing image.")
-        return False
-
-    try:
-        image = Image.open(io.BytesIO(image_data))
-    except Exception as e:
-        logger.error(f"Error opening image for product_id {product_id}: {e}")
-        return False
+        return None
 
     # Load description
     description_data = get_s3_file(Config.S3_BUCKET_NAME, description_key)
 
     if not description_data:
         logger.warning(f"Skipping product_id {product_id} due to missing description.")
-        return False
+        return None
+
+    job.update({
+        "image_key": image_key,
+        "description_key": description_key,
+        "image_data": image_data,
+        "description_text": description_data.decode('utf-8')
+    })
+    return job
 
-    description_text = description_data.decode('utf-8')
 
+def decode_product_image(job):
+    """Pipeline stage: decode the fetched image bytes into a PIL image."""
+    try:
+        image = Image.open(io.BytesIO(job.pop("image_data")))
+        image.load()
+    except Exception as e:
+        logger.error(f"Error opening image for product_id {job['product_id']}: {e}")
+        return None
+    job["image"] = image
+    return job
+
+
+def describe_product(job):
+    """Pipeline stage: extract image features and build the text and metadata to embed."""
     # Extract image features
-    image_features = extract_image_features(image)
+    image_features = extract_image_features(job.pop("image"))
+    if image_features == IMAGE_FEATURES_ERROR:
+        # Fail the product so the manifest records it and the next run retries it
+        job["error"] = IMAGE_FEATURES_ERROR
+        return job
 
     # Concatenate features with the description
-    combined_text = f"Features: {image_features}\nDescription: {description_text}"
+    job["text"] = f"Features: {image_features}\nDescription: {job['description_text']}"
+    job["metadata"] = {
+        "source": "insta_posts",
+        "product_id": job["product_id"],
+        "image_s3_path": f"s3://{Config.S3_BUCKET_NAME}/{job['image_key']}",
+        "description_s3_path": f"s3://{Config.S3_BUCKET_NAME}/{job['description_key']}"
+    }
+    return job
+
+
+def prepare_product(product_id):
+    """Fetch a product's image and description and build the text and metadata to embed."""
+    job = {"product_id": product_id}
+    for stage in (fetch_product_files, decode_product_image, describe_product):
+        job = stage(job)
+        if job is None or job.get("error"):
+            return None
+    return job["text"], job["metadata"]
+
+
+def link_product(product_id):
+    """Record the product's ChromaDB link in DynamoDB under a fresh CampaignID."""
+    # Generate a unique CampaignID
+    campaign_id = str(uuid.uuid4())
+
+    # Update DynamoDB
+    try:
+        update_dynamo_db(product_id, str(product_id), campaign_id)
+    except Exception as e:
+        logger.error(f"Error updating DynamoDB for product_id {product_id}: {e}")
+        return False
+
+    return True
+
+
+def process_product(product_id):
+    """Process a single product ID: fetch data, generate embeddings, and update databases."""
+    logger.info(f"Processing product_id {product_id}")
+    prepared = prepare_product(product_id)
+    if not prepared:
+        return False
+    combined_text, metadata = prepared
 
     # Store embeddings in ChromaDB
     try:
-        metadata = {
-            "source": "insta_posts",
-            "product_id": product_id,
-            "image_s3_path": f"s3://{Config.S3_BUCKET_NAME}/{image_key}",
-            "description_s3_path": f"s3://{Config.S3_BUCKET_NAME}/{description_key}"
-        }
-    
-        # Add embeddings to ChromaDB
         vector_store.add_texts(
             [combined_text],
             metadatas=[metadata],
             ids=[str(product_id)]
         )
         logger.info(f"Embeddings added to ChromaDB for product_id {product_id}")
+        sync_local_indexes([str(product_id)], [combined_text], [metadata])
     except Exception as e:
         logger.error(f"Error adding embeddings to ChromaDB for product_id {product_id}: {e}")
         return False
-    
-    # Generate a unique CampaignID
-    campaign_id = str(uuid.uuid4())
-    
-    # Update DynamoDB
+    finally:
+        # Even a failed write may have partially landed
+        search_cache.invalidate()
+
+    return link_product(product_id)
+
+
+def sync_local_indexes(ids, documents, metadatas, embeddings=None, save=True):
+    """Mirror ChromaDB writes into the retriever's local indexes.
+
+    The BM25 index is always updated; the vector index only when it serves
+    retrieval. Without ``embeddings`` the documents are embedded again, which
+    the embedding cache answers without an API call. Bulk runs pass
+    ``save=False`` and write both indexes with ``save_local_indexes`` at each
+    manifest checkpoint instead of once per batch.
+    """
     try:
-        update_dynamo_db(product_id, str(product_id), campaign_id)
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            lexical_index.add(doc_id, document, metadata)
+        if save:
+            lexical_index.save()
     except Exception as e:
-        logger.error(f"Error updating DynamoDB for product_id {product_id}: {e}")
-        return False
+        logger.error(f"Error updating the lexical index for {len(ids)} products: {e}")
+
+    if Config.RETRIEVER_BACKEND != "numpy":
+        return
+    try:
+        if embeddings is None:
+            embeddings = embedding_model.embed_documents(documents)
+        vector_index.add(ids, embeddings, documents, metadatas)
+        if save:
+            vector_index.save()
+    except Exception as e:
+        logger.error(f"Error updating the local vector index for {len(ids)} products: {e}")
+
+
+def save_local_indexes():
+    """Write what bulk runs staged in the local indexes, then drop cached searches that predate it."""
+    try:
+        lexical_index.save()
+    except Exception as e:
+        logger.error(f"Error saving the lexical index: {e}")
+    try:
+        if Config.RETRIEVER_BACKEND == "numpy":
+            vector_index.save()
+    except Exception as e:
+        logger.error(f"Error saving the local vector index: {e}")
+    finally:
+        search_cache.invalidate()
+
+
+def get_chroma_collection():
+    """Return the raw ChromaDB collection behind the vector store, for writing precomputed embeddings."""
+    return clients.get('chroma_collection')
 
-    return True
 
+def embed_batch(batch):
+    """Pipeline stage: embed a batch of product texts in one embedding request."""
+    embeddings = embedding_model.embed_documents([job["text"] for job in batch])
+    for job, embedding in zip(batch, embeddings):
+        job["embedding"] = embedding
+    return batch
 
-def process_all_products():
-    """Process all products by listing product IDs and processing each one."""
-    product_ids = list_product_ids(Config.S3_BUCKET_NAME, Config.S3_BASE_FOLDER)
-    if not product_ids:
+
+def write_batch_to_chroma(batch):
+    """Pipeline stage: upsert a batch of embedded products into ChromaDB in one write."""
+    try:
+        get_chroma_collection().upsert(
+            ids=[str(job["product_id"]) for job in batch],
+            embeddings=[job["embedding"] for job in batch],
+            metadatas=[job["metadata"] for job in batch],
+            documents=[job["text"] for job in batch]
+        )
+        sync_local_indexes(
+            [str(job["product_id"]) for job in batch],
+            [job["text"] for job in batch],
+            [job["metadata"] for job in batch],
+            embeddings=[job["embedding"] for job in batch],
+            save=False
+        )
+    finally:
+        # After the local indexes too, so no search caches results read from them before the sync
+        search_cache.invalidate()
+    logger.info(f"Embeddings added to ChromaDB for {len(batch)} products")
+    return batch
+
+
+def link_batch(batch):
+    """Pipeline stage: record a batch of written products in DynamoDB with batched writes."""
+    with DynamoBatchWriter(table, 'product_id', max_retries=Config.DYNAMODB_BATCH_MAX_RETRIES) as writer:
+        for job in batch:
+            # Generate a unique CampaignID per product, as link_product does
+            writer.put(product_link_item(job["product_id"], str(job["product_id"]), str(uuid.uuid4())))
+
+    failed = set(writer.failed_keys)
+    for job in batch:
+        if job["product_id"] in failed:
+            job["error"] = "DynamoDB update failed"
+    logger.info(f"DynamoDB updated for {len(batch) - len(failed)} products")
+    return batch
+
+
+def build_indexing_pipeline(on_result=None):
+    """Assemble the staged bulk-indexing pipeline from Config concurrency limits."""
+    stages = [
+        PipelineStage("fetch", fetch_product_files, Config.PIPELINE_FETCH_CONCURRENCY),
+        PipelineStage("decode", decode_product_image, Config.PIPELINE_DECODE_CONCURRENCY),
+        PipelineStage("vision", describe_product, Config.PIPELINE_VISION_CONCURRENCY),
+        PipelineStage(
+            "embed", embed_batch, Config.PIPELINE_EMBED_CONCURRENCY,
+            batch_size=Config.EMBEDDING_BATCH_SIZE,
+            batch_max_weight=Config.EMBEDDING_BATCH_MAX_TOKENS,
+            weigh=lambda job: count_tokens(job["text"]),
+            batch_linger=Config.PIPELINE_BATCH_LINGER_SECONDS
+        ),
+        PipelineStage("chroma", write_batch_to_chroma, Config.PIPELINE_CHROMA_CONCURRENCY),
+        PipelineStage("dynamodb", link_batch, Config.PIPELINE_DYNAMODB_CONCURRENCY),
+    ]
+    return IndexingPipeline(stages, queue_size=Config.PIPELINE_QUEUE_SIZE, on_result=on_result)
+
+
+def process_all_products(force=False, progress=None):
+    """Process new or changed products, skipping those whose S3 ETags match the index manifest.
+
+    The manifest is checkpointed every INDEX_CHECKPOINT_INTERVAL products, so an
+    interrupted run picks up where it stopped the next time it is started.
+    ``progress``, if given, is called with the running summary after each product.
+    """
+    product_etags = list_product_etags(Config.S3_BUCKET_NAME, Config.S3_BASE_FOLDER)
+    summary = {"total": len(product_etags), "pending": 0, "processed": 0, "skipped": 0, "failed": 0}
+    if not product_etags:
         logger.error("No product IDs found. Exiting.")
-        return
-    # Use ThreadPoolExecutor for concurrency
-    with ThreadPoolExecutor(max_workers=Config.MAX_THREADS) as executor:
-        futures = {executor.submit(process_product, pid): pid for pid in product_ids}
-        for future in as_completed(futures):
-            pid = futures[future]
-            try:
-                result = future.result()
-                if not result:
-                    logger.error(f"Processing failed for product_id {pid}")
-            except Exception as e:
-                logger.error(f"Unhandled exception processing product_id {pid}: {e}")
+        return summary
+
+    manifest = {} if force else load_index_manifest(Config.INDEX_MANIFEST_PATH)
+    # Drop products that no longer exist in S3
+    manifest = {pid: entry for pid, entry in manifest.items() if pid in product_etags}
+    if force:
+        # Clear the old checkpoint so a resumed forced run does not skip anything
+        save_index_manifest(Config.INDEX_MANIFEST_PATH, manifest)
+
+    pending = [pid for pid, etags in product_etags.items() if needs_reindex(manifest.get(pid), etags)]
+    summary["pending"] = len(pending)
+    summary["skipped"] = len(product_etags) - len(pending)
+    logger.info(f"{len(pending)} products to process, {summary['skipped']} unchanged.")
+    if progress:
+        progress(dict(summary))
+
+    def record(pid, result):
+        etags = product_etags[pid]
+        manifest[pid] = {
+            "image_etag": etags.get('image.png'),
+            "description_etag": etags.get('description.txt'),
+            "status": "indexed" if result else "failed",
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        summary["processed" if result else "failed"] += 1
+        if (summary["processed"] + summary["failed"]) % Config.INDEX_CHECKPOINT_INTERVAL == 0:
+            # Local indexes first, so the manifest never lists products they are missing
+            save_local_indexes()
+            save_index_manifest(Config.INDEX_MANIFEST_PATH, manifest)
+        if progress:
+            progress(dict(summary))
+
+    try:
+        build_indexing_pipeline(on_result=record).run(pending)
+    finally:
+        save_local_indexes()
+        save_index_manifest(Config.INDEX_MANIFEST_PATH, manifest)
+
+    return summary
@@ -1,21 +1,22 @@
 import io
-import boto3
+import botocore.exceptions
 import logging
 import base64
 from app.config import Config
+from app.clients import clients
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
-# Initialize S3 client
-s3 = boto3.client('s3', region_name=Config.AWS_REGION)
+# Shared S3 client, created on first use
+s3 = clients.lazy('s3')
 
 def get_s3_file(bucket_name, file_key):
     """Fetch a file from S3."""
     try:
         response = s3.get_object(Bucket=bucket_name, Key=file_key)
         return response['Body'].read()
-    except boto3.exceptions.S3UploadFailedError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"Error fetching {file_key} from S3: {e}")
         return None
 
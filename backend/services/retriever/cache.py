@@ -0,0 +1,143 @@
+import os
+import json
+import uuid
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Collapse runs of whitespace so trivially different spellings share an entry."""
+    return " ".join(query.split())
+
+
+class QueryResultCache:
+    """TTL + LRU cache of search results, invalidated when the index changes.
+
+    Entries are keyed by normalized query, k and filter, and tagged with the
+    generation current when they were stored. ``invalidate()`` bumps the
+    generation, so every older entry becomes a miss at once without walking
+    the cache; stale entries are dropped lazily as they are looked up or
+    evicted.
+
+    With ``marker_path`` set, invalidations are shared between processes:
+    ``invalidate()`` replaces the marker file, and every ``get``/``set``
+    compares the file's identity (mtime and inode) with the last one seen,
+    bumping the local generation when another process has invalidated. As
+    with the local indexes, this covers processes sharing a filesystem; the
+    TTL bounds staleness for anything else.
+    """
+
+    def __init__(self, max_size, ttl_seconds, marker_path=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.marker_path = marker_path
+        self._marker = self.read_marker()
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def make_key(self, query, k, filter=None, mode="vector"):
+        return (normalize_query(query), k, json.dumps(filter, sort_keys=True), mode)
+
+    def read_marker(self):
+        if not self.marker_path:
+            return None
+        try:
+            stat = os.stat(self.marker_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def sync(self):
+        """Adopt invalidations made by other processes since the marker was last seen."""
+        if not self.marker_path:
+            return
+        marker = self.read_marker()
+        if marker != self._marker:
+            with self._lock:
+                if marker != self._marker:
+                    self._marker = marker
+                    self.generation += 1
+                    self.invalidations += 1
+
+    def get(self, key):
+        """Return the cached results, or None on a miss, expiry or invalidation."""
+        self.sync()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                generation, stored_at, results = entry
+                if generation == self.generation and time.monotonic() - stored_at < self.ttl_seconds:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self._data[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, results, generation=None):
+        """Store results computed under ``generation`` (default: the current one).
+
+        Pass the generation read before searching, so results computed while a
+        write landed are not cached as fresh.
+        """
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        self.sync()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (self.generation, time.monotonic(), results)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self):
+        """Mark every cached result stale, here and in processes sharing the marker; called on every write."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if not self.marker_path:
+                return
+            try:
+                # Replace rather than touch, so the inode changes even within one mtime tick
+                tmp_path = f"{self.marker_path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(str(self.generation))
+                os.replace(tmp_path, self.marker_path)
+                self._marker = self.read_marker()
+            except OSError as e:
+                logger.error(f"Could not update the search cache marker {self.marker_path}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "generation": self.generation,
+                "shared": bool(self.marker_path),
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+    def __len__(self):
+        return len(self._data)
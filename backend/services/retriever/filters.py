@@ -0,0 +1,129 @@
+import json
+from collections import OrderedDict
+import numpy as np
+
+# Supported predicate operators, a subset of ChromaDB's where syntax
+OPERATORS = ("$eq", "$ne", "$in", "$nin")
+SCALAR_TYPES = (str, int, float, bool)
+
+# Row masks kept per FilterIndex; each costs one byte per row
+MASK_CACHE_SIZE = 64
+
+
+def validate_filter(predicates):
+    """Check a metadata filter such as ``{"account": "acme", "product_id": {"$in": ["1", "2"]}}``.
+
+    Each field maps to a scalar (equality) or to a single-operator dict;
+    fields are combined with AND. Raises ValueError on anything else.
+    """
+    if not isinstance(predicates, dict):
+        raise ValueError("Filter must be an object mapping metadata fields to values")
+    for field, condition in predicates.items():
+        if not isinstance(field, str) or not field or field.startswith("$"):
+            raise ValueError(f"Invalid filter field: {field!r}")
+        if isinstance(condition, SCALAR_TYPES):
+            continue
+        if not isinstance(condition, dict) or len(condition) != 1:
+            raise ValueError(f"Filter on {field} must be a value or a single-operator object")
+        (operator, value), = condition.items()
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported operator {operator} on {field}; use one of {', '.join(OPERATORS)}")
+        if operator in ("$in", "$nin"):
+            if not isinstance(value, list) or not value or not all(isinstance(v, SCALAR_TYPES) for v in value):
+                raise ValueError(f"{operator} on {field} needs a non-empty list of values")
+        elif not isinstance(value, SCALAR_TYPES):
+            raise ValueError(f"{operator} on {field} needs a single value")
+    return predicates
+
+
+def condition_parts(condition):
+    """Split a condition into its operator and value, treating a bare value as $eq."""
+    if isinstance(condition, dict):
+        (operator, value), = condition.items()
+        return operator, value
+    return "$eq", condition
+
+
+def matches(metadata, where):
+    """Whether a record's metadata satisfies every predicate of a filter."""
+    for field, condition in where.items():
+        operator, value = condition_parts(condition)
+        actual = metadata.get(field)
+        if operator == "$eq" and actual != value:
+            return False
+        if operator == "$ne" and actual == value:
+            return False
+        if operator == "$in" and actual not in value:
+            return False
+        if operator == "$nin" and actual in value:
+            return False
+    return True
+
+
+def to_chroma_where(where):
+    """Express a filter in ChromaDB's syntax, which needs $and for more than one field."""
+    if len(where) <= 1:
+        return where
+    return {"$and": [{field: condition} for field, condition in where.items()]}
+
+
+class FilterIndex:
+    """Postings (field -> value -> row ids) over a list of metadata dicts.
+
+    Postings for ``fields`` are built up front and kept; filters on any other
+    field scan the metadata for that field when their mask is computed. A
+    filter is resolved to a boolean row mask by combining bitmaps from the
+    postings. The masks of the ``max_cached_masks`` most recently used
+    filters are kept, so memory stays bounded however many distinct filters
+    callers send.
+    """
+
+    def __init__(self, metadatas, fields=(), max_cached_masks=MASK_CACHE_SIZE):
+        self.metadatas = metadatas
+        self.count = len(metadatas)
+        self.max_cached_masks = max_cached_masks
+        self.postings = {}
+        self._masks = OrderedDict()
+        for field in fields:
+            self.postings[field] = self.build_postings(field)
+
+    def build_postings(self, field):
+        rows = {}
+        for row, metadata in enumerate(self.metadatas):
+            value = metadata.get(field)
+            if value is not None:
+                rows.setdefault(value, []).append(row)
+        return {value: np.asarray(ids, dtype=np.int64) for value, ids in rows.items()}
+
+    def field_postings(self, field):
+        postings = self.postings.get(field)
+        return postings if postings is not None else self.build_postings(field)
+
+    def bitmap(self, postings, values):
+        """Rows whose field equals any of the values."""
+        bitmap = np.zeros(self.count, dtype=bool)
+        for value in values:
+            rows = postings.get(value)
+            if rows is not None:
+                bitmap[rows] = True
+        return bitmap
+
+    def mask(self, where):
+        """Boolean row mask for a filter, cached for recently used filters."""
+        key = json.dumps(where, sort_keys=True)
+        cached = self._masks.get(key)
+        if cached is not None:
+            self._masks.move_to_end(key)
+            return cached
+
+        cached = np.ones(self.count, dtype=bool)
+        for field, condition in where.items():
+            operator, value = condition_parts(condition)
+            values = value if operator in ("$in", "$nin") else [value]
+            bitmap = self.bitmap(self.field_postings(field), values)
+            cached &= ~bitmap if operator in ("$ne", "$nin") else bitmap
+        if self.max_cached_masks > 0:
+            self._masks[key] = cached
+            while len(self._masks) > self.max_cached_masks:
+                self._masks.popitem(last=False)
+        return cached
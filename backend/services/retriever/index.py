@@ -0,0 +1,375 @@
+import os
+import json
+import uuid
+import logging
+import threading
+import numpy as np
+from .filters import FilterIndex
+from .locking import file_lock
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+RECORDS_FILE = "records.json"
+
+# Held by writers across the refresh, patch and publish of a save
+LOCK_FILE = "write.lock"
+
+# Storage modes for the matrix scanned at query time
+QUANTIZATIONS = ("none", "float16", "int8")
+
+# Quantized rows are widened to float32 this many at a time while scoring;
+# small blocks stay in CPU cache between the conversion and the matmul
+SCORE_BLOCK_ROWS = 256
+
+
+def normalize_rows(matrix):
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores in each row, best first.
+
+    ``argpartition`` finds the top k in linear time; only those k are sorted.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def quantize(vectors, quantization):
+    """Return compact codes for unit vectors plus per-row scales (int8 only).
+
+    int8 uses symmetric per-row scaling, so each row keeps its own dynamic
+    range: ``vector ~= codes * scale``.
+    """
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            block_scales = np.abs(block).max(axis=1) / 127
+            block_scales[block_scales == 0] = 1.0
+            codes[start:start + len(block)] = np.rint(block / block_scales[:, np.newaxis])
+            scales[start:start + len(block)] = block_scales
+        return codes, scales
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+class NumpyVectorIndex:
+    """Exact cosine-similarity index over a memory-mapped float32 matrix.
+
+    The directory at ``path`` holds the unit-normalized vectors in a raw
+    float32 file and the ids, documents and metadata in ``records.json``. The
+    records file names the vectors file it belongs to and is replaced last
+    and atomically, so it is the index's version: readers reload when its
+    mtime changes, and a reader never pairs new records with old vectors.
+
+    ``add`` stages records in memory and ``save`` writes them: replaced rows
+    are patched and new rows appended in place in the vectors file before the
+    records file is republished, so a save costs the new rows plus the
+    records file rather than the whole matrix. ``write`` replaces everything
+    (bulk loads). Both hold an exclusive file lock in the index directory, so
+    writers in other processes on the host wait rather than publish records
+    built from a version that was replaced under them.
+
+    With ``quantization`` set to ``float16`` or ``int8``, queries scan an
+    in-memory quantized copy of the matrix (half or a quarter of the bytes)
+    and only the best ``rescore_candidates`` rows per query are re-scored
+    exactly from the float32 file, so the full-precision vectors need not be
+    resident in RAM.
+
+    Metadata filters are resolved through a FilterIndex with postings for
+    ``filter_fields`` precomputed on load. A filter matching fewer than
+    ``gather_ratio`` of the rows narrows scoring to just those rows; broader
+    filters scan everything and rule out the rest.
+    """
+
+    def __init__(self, path, quantization="none", rescore_candidates=100, filter_fields=("source",),
+                 gather_ratio=0.25):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.path = path
+        self.quantization = quantization
+        self.rescore_candidates = rescore_candidates
+        self.filter_fields = tuple(filter_fields)
+        self.gather_ratio = gather_ratio
+        self.filter_index = FilterIndex([])
+        self.codes = None
+        self.scales = None
+        self.dim = 0
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.vectors_file = None
+        self._pending = {}
+        self._version = None
+        self._lock = threading.RLock()
+
+    def records_path(self):
+        return os.path.join(self.path, RECORDS_FILE)
+
+    def lock_path(self):
+        return os.path.join(self.path, LOCK_FILE)
+
+    def exists(self):
+        """Whether an index has been written at ``path``."""
+        return os.path.exists(self.records_path())
+
+    def refresh(self):
+        """Reload from disk if another writer replaced the index since the last load."""
+        try:
+            stat = os.stat(self.records_path())
+        except FileNotFoundError:
+            return
+        # The inode changes on every replace, even within one mtime tick
+        version = (stat.st_mtime_ns, stat.st_ino)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    try:
+                        self._load(version)
+                    except FileNotFoundError:
+                        # Replaced again mid-load; keep serving the loaded version and retry next time
+                        logger.warning(f"Vector index at {self.path} changed while loading")
+
+    def _load(self, version):
+        with open(self.records_path()) as f:
+            records = json.load(f)
+        count, dim = len(records["ids"]), records["dim"]
+        if count:
+            vectors = np.memmap(os.path.join(self.path, records["vectors_file"]), dtype=np.float32,
+                                mode='r', shape=(count, dim))
+        else:
+            vectors = np.empty((0, dim), dtype=np.float32)
+        self.dim = dim
+        self.vectors_file = records["vectors_file"]
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+        self.vectors = vectors
+        if self.quantization != "none":
+            self.codes, self.scales = quantize(vectors, self.quantization)
+        self.filter_index = FilterIndex(self.metadatas, self.filter_fields)
+        self._version = version
+        logger.info(f"Loaded vector index with {count} vectors from {self.path}")
+
+    def write(self, ids, embeddings, documents, metadatas):
+        """Replace the whole index with the given records, discarding anything staged."""
+        with self._lock, file_lock(self.lock_path()):
+            self._pending = {}
+            self._write(ids, embeddings, documents, metadatas)
+
+    def _write(self, ids, embeddings, documents, metadatas):
+        """Write a fresh vectors file and publish it. Caller holds both locks."""
+        vectors = normalize_rows(embeddings) if len(ids) else np.empty((0, self.dim), dtype=np.float32)
+        vectors_file = f"vectors-{uuid.uuid4().hex}.f32"
+        vectors.tofile(os.path.join(self.path, vectors_file))
+        self._publish(vectors_file, int(vectors.shape[1]), ids, documents, metadatas)
+
+        # Earlier vector files stay readable by processes that still map them
+        for name in os.listdir(self.path):
+            if name.startswith("vectors-") and name != vectors_file:
+                os.remove(os.path.join(self.path, name))
+
+    def _publish(self, vectors_file, dim, ids, documents, metadatas):
+        """Atomically replace the records file, making the rows it lists visible, and reload."""
+        records = {
+            "dim": dim,
+            "vectors_file": vectors_file,
+            "ids": list(ids),
+            "documents": list(documents),
+            "metadatas": list(metadatas)
+        }
+        tmp_path = f"{self.records_path()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(records, f)
+        os.replace(tmp_path, self.records_path())
+        stat = os.stat(self.records_path())
+        self._load((stat.st_mtime_ns, stat.st_ino))
+
+    def add(self, ids, embeddings, documents, metadatas):
+        """Stage records to add or replace by id; they become searchable on ``save()``."""
+        vectors = normalize_rows(embeddings)
+        with self._lock:
+            staged_dim = next(iter(self._pending.values()))[0].shape[0] if self._pending else 0
+            dim = self.dim or staged_dim
+            if dim and vectors.shape[1] != dim:
+                raise ValueError(f"Expected {dim}-dimensional embeddings, got {vectors.shape[1]}")
+            for record_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                self._pending[record_id] = (vector, document, metadata)
+
+    def save(self):
+        """Write the staged records: patch replaced rows in place, append new ones, then publish."""
+        with self._lock:
+            if not self._pending:
+                return
+            with file_lock(self.lock_path()):
+                self._save()
+
+    def _save(self):
+        """Apply the staged records to the latest published version. Caller holds both locks."""
+        self.refresh()
+        pending, self._pending = self._pending, {}
+        if not self.dim or not self.ids:
+            self._write(list(pending), [vector for vector, _, _ in pending.values()],
+                        [document for _, document, _ in pending.values()],
+                        [metadata for _, _, metadata in pending.values()])
+            return
+
+        ids, documents, metadatas = list(self.ids), list(self.documents), list(self.metadatas)
+        positions = {record_id: i for i, record_id in enumerate(ids)}
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        appended = []
+        with open(os.path.join(self.path, self.vectors_file), 'r+b') as f:
+            for record_id, (vector, document, metadata) in pending.items():
+                i = positions.get(record_id)
+                if i is None:
+                    ids.append(record_id)
+                    documents.append(document)
+                    metadatas.append(metadata)
+                    appended.append(vector)
+                else:
+                    documents[i], metadatas[i] = document, metadata
+                    f.seek(i * row_bytes)
+                    f.write(vector.tobytes())
+            # Rows past the published count are leftovers of an unfinished save
+            f.seek(len(self.ids) * row_bytes)
+            if appended:
+                f.write(np.stack(appended).tobytes())
+            f.truncate()
+        self._publish(self.vectors_file, self.dim, ids, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """Add or replace records by id and write them at once."""
+        with self._lock:
+            self.add(ids, embeddings, documents, metadatas)
+            self.save()
+
+    def search(self, query_embeddings, k, where=None, include_vectors=False):
+        """Return the top-k records for each query as dicts with content, metadata and score.
+
+        With ``include_vectors`` each hit also carries its normalized float32 vector.
+        """
+        self.refresh()
+        with self._lock:
+            vectors, codes, scales, ids = self.vectors, self.codes, self.scales, self.ids
+            documents, metadatas = self.documents, self.metadatas
+            mask = self.filter_index.mask(where) if where else None
+
+        queries = normalize_rows(query_embeddings)
+        rows = None
+        if mask is not None and not mask.all():
+            rows = np.flatnonzero(mask)
+            k = min(k, len(rows))
+        if not len(ids) or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        if rows is not None and len(rows) < self.gather_ratio * len(ids):
+            # Selective filter: score only the matching rows
+            scores = self.score(queries, vectors[rows], codes[rows] if codes is not None else None,
+                                scales[rows] if scales is not None else None)
+        else:
+            scores = self.score(queries, vectors, codes, scales)
+            if rows is not None:
+                # Broad filter: cheaper to score everything and rule out the rest than to gather
+                scores[:, ~mask] = -np.inf
+                rows = None
+
+        if codes is None:
+            best = top_k(scores, k)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            if rows is not None:
+                best = rows[best]
+        else:
+            best, best_scores = self.rescore(queries, vectors, scores, k, rows)
+
+        results = []
+        for query_best, query_scores in zip(best, best_scores):
+            hits = []
+            for i, score in zip(query_best, query_scores):
+                hit = {"id": ids[i], "content": documents[i], "metadata": metadatas[i], "score": float(score)}
+                if include_vectors:
+                    hit["vector"] = np.asarray(vectors[i])
+                hits.append(hit)
+            results.append(hits)
+        return results
+
+    def score(self, queries, vectors, codes, scales):
+        return queries @ vectors.T if codes is None else self.score_quantized(queries, codes, scales)
+
+    def score_quantized(self, queries, codes, scales):
+        """Approximate scores against the quantized matrix, widening one block of rows at a time."""
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def rescore(self, queries, vectors, approximate, k, rows=None):
+        """Re-score the best approximate candidates exactly from the float32 vectors.
+
+        ``rows`` maps the columns of ``approximate`` to index rows when only a
+        subset was scored. Returns the final top-k rows and their exact scores.
+        """
+        candidates = top_k(approximate, max(k, self.rescore_candidates))
+        # Filtered-out rows stay excluded
+        valid = np.take_along_axis(approximate, candidates, axis=1) > -np.inf
+        if rows is not None:
+            candidates = rows[candidates]
+        exact = np.einsum('qcd,qd->qc', vectors[candidates], queries)
+        exact[~valid] = -np.inf
+
+        order = top_k(exact, k)
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+    def memory_bytes(self):
+        """Bytes of the matrix scanned by every query (the quantized copy when enabled)."""
+        self.refresh()
+        if self.codes is None:
+            return self.vectors.nbytes
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        self.refresh()
+        return len(self.ids)
+
+
+def load_from_chroma(index, collection, batch_size=1000):
+    """Bulk load every record of a ChromaDB collection into the index, replacing its contents."""
+    ids, embeddings, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        embeddings.extend(page["embeddings"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        offset += len(page["ids"])
+
+    index.write(ids, embeddings, documents, metadatas)
+    logger.info(f"Loaded {len(ids)} vectors from ChromaDB into {index.path}")
+    return len(ids)
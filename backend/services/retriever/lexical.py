@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import math
+import heapq
+import logging
+import threading
+from collections import Counter
+from .filters import matches
+from .locking import file_lock
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Words, numbers and hashtag bodies ("#VitaminC" -> "vitaminc")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the indexed product texts.
+
+    Documents (text and metadata, keyed by id) are persisted as JSON at
+    ``path``; postings and lengths are derived from them on load. As with the
+    vector index, the file is replaced atomically and other processes reload
+    when it changes. Call ``save()`` after a group of ``add`` calls.
+
+    Unsaved adds are also kept in ``_pending`` and re-applied whenever a
+    reload picks up another writer's file, so they survive until this
+    instance saves. ``save`` holds an exclusive lock on ``<path>.lock``
+    across the reload and the write, so concurrent writers merge rather than
+    overwrite each other.
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.documents = {}
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+        self._pending = {}
+        self._version = None
+        self._lock = threading.RLock()
+
+    def exists(self):
+        """Whether an index has been saved at ``path``."""
+        return bool(self.path) and os.path.exists(self.path)
+
+    def refresh(self):
+        """Reload from disk if another writer replaced the index since the last load."""
+        if not self.path:
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        version = (stat.st_mtime_ns, stat.st_ino)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._load(version)
+
+    def _load(self, version):
+        with open(self.path) as f:
+            documents = json.load(f)
+        self.documents, self.postings, self.lengths, self.total_length = {}, {}, {}, 0
+        for doc_id, document in documents.items():
+            self._index(doc_id, document["text"], document["metadata"])
+        for doc_id, (text, metadata) in self._pending.items():
+            self.remove(doc_id)
+            self._index(doc_id, text, metadata)
+        self._version = version
+        logger.info(f"Loaded lexical index with {len(self.documents)} documents from {self.path}")
+
+    def _index(self, doc_id, text, metadata):
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        self.lengths[doc_id] = sum(terms.values())
+        self.total_length += self.lengths[doc_id]
+        self.documents[doc_id] = {"text": text, "metadata": metadata}
+
+    def remove(self, doc_id):
+        with self._lock:
+            document = self.documents.pop(doc_id, None)
+            if document is None:
+                return
+            for term in set(tokenize(document["text"])):
+                postings = self.postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(doc_id)
+
+    def add(self, doc_id, text, metadata):
+        """Index a document, replacing any earlier version with the same id; written on ``save()``."""
+        with self._lock:
+            self.refresh()
+            self.remove(doc_id)
+            self._index(doc_id, text, metadata)
+            if self.path:
+                self._pending[doc_id] = (text, metadata)
+
+    def replace(self, records):
+        """Replace the whole index with ``(doc_id, text, metadata)`` records and save it."""
+        with self._lock:
+            self.documents, self.postings, self.lengths, self.total_length = {}, {}, {}, 0
+            self._pending = {}
+            for doc_id, text, metadata in records:
+                self._index(doc_id, text, metadata)
+            if self.path:
+                with file_lock(f"{self.path}.lock"):
+                    self._write()
+
+    def save(self):
+        """Merge the unsaved adds into the latest saved index and write it."""
+        if not self.path:
+            return
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self.refresh()
+            self._write()
+
+    def _write(self):
+        """Atomically replace the file with the in-memory documents. Caller holds both locks."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.documents, f)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._version = (stat.st_mtime_ns, stat.st_ino)
+        self._pending = {}
+
+    def search(self, query, k, where=None):
+        """Return the top-k documents by BM25 score as dicts with id, content, metadata and score."""
+        self.refresh()
+        with self._lock:
+            count = len(self.documents)
+            if not count:
+                return []
+            average_length = self.total_length / count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            eligible = (
+                (score, doc_id) for doc_id, score in scores.items()
+                if not where or matches(self.documents[doc_id]["metadata"], where)
+            )
+            return [
+                {
+                    "id": doc_id,
+                    "content": self.documents[doc_id]["text"],
+                    "metadata": self.documents[doc_id]["metadata"],
+                    "score": score
+                }
+                for score, doc_id in heapq.nlargest(k, eligible)
+            ]
+
+    def __len__(self):
+        self.refresh()
+        return len(self.documents)
+
+
+def build_from_chroma(index, collection, batch_size=1000):
+    """Rebuild the lexical index from every document in a ChromaDB collection."""
+    records = []
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            break
+        records.extend(zip(page["ids"], page["documents"], page["metadatas"]))
+        offset += len(page["ids"])
+
+    index.replace(records)
+    logger.info(f"Built lexical index with {len(records)} documents")
+    return len(records)
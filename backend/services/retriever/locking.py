@@ -0,0 +1,20 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on ``path`` (created if missing) for the block.
+
+    Serializes writers across processes on one host. ``flock`` locks belong
+    to the open file, so nested use from the same process deadlocks: take it
+    once around the whole read-modify-write.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,20 +1,84 @@
 import logging
 from flask import request, jsonify
 from . import retriever_bp
-from .utils import perform_similarity_search
+from app.config import Config
+from .filters import validate_filter
+from .utils import (
+    perform_similarity_search,
+    perform_batch_similarity_search,
+    get_search_cache_stats,
+    rebuild_local_indexes,
+    SEARCH_MODES,
+    RERANKERS
+)
 
 @retriever_bp.route('/search', methods=['POST'])
 def similarity_search():
     data = request.get_json()
     query = data.get('query')
     k = data.get('k', 2)
+    mode = data.get('mode', 'vector')
+    filters = data.get('filter')
+    rerank = data.get('rerank')
     
     if not query:
         return jsonify({"status": "error", "message": "Query is required"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"status": "error", "message": f"Mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+    if rerank is not None and (rerank not in RERANKERS or mode != 'vector'):
+        return jsonify({"status": "error", "message": "Rerank must be 'mmr' and requires vector mode"}), 400
+    if filters is not None:
+        try:
+            validate_filter(filters)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
     
     try:
-        results = perform_similarity_search(query, k)
+        results = perform_similarity_search(query, k, mode, filters, rerank)
         return jsonify({"status": "success", "results": results}), 200
     except Exception as e:
         logging.error(f"Error during similarity search: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
+
+@retriever_bp.route('/search_batch', methods=['POST'])
+def batch_similarity_search():
+    data = request.get_json()
+    queries = data.get('queries')
+    k = data.get('k', 2)
+    filters = data.get('filter')
+
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"status": "error", "message": "Queries must be a non-empty list of strings"}), 400
+    if len(queries) > Config.RETRIEVER_MAX_BATCH_QUERIES:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {Config.RETRIEVER_MAX_BATCH_QUERIES} queries per batch"
+        }), 400
+    if filters is not None:
+        try:
+            validate_filter(filters)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        results = perform_batch_similarity_search(queries, k, filters)
+        return jsonify({
+            "status": "success",
+            "results": [{"query": query, "results": hits} for query, hits in zip(queries, results)]
+        }), 200
+    except Exception as e:
+        logging.error(f"Error during batch similarity search: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@retriever_bp.route('/cache_stats', methods=['GET'])
+def search_cache_stats():
+    return jsonify({"status": "success", "cache": get_search_cache_stats()}), 200
+
+@retriever_bp.route('/index/rebuild', methods=['POST'])
+def rebuild_index():
+    try:
+        counts = rebuild_local_indexes()
+        return jsonify({"status": "success", "counts": counts}), 200
+    except Exception as e:
+        logging.error(f"Error rebuilding the local indexes: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
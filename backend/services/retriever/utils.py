@@ -1,45 +1,244 @@
+import time
 import logging
-from langchain.embeddings import OpenAIEmbeddings
-from langchain_chroma import Chroma
-import chromadb
+import numpy as np
 from app.config import Config
+from app.clients import clients
+from .index import load_from_chroma, normalize_rows
+from .lexical import build_from_chroma
+from .filters import to_chroma_where
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
-# Initialize the embedding model
-embedding_model = OpenAIEmbeddings(model="text-embedding-ada-002", openai_api_key=Config.OPENAI_API_KEY)
-
-# Initialize the ChromaDB client and vector store
-chromadb_client = chromadb.HttpClient(
-    host=Config.CHROMADB_HOST,
-    port=Config.CHROMADB_PORT,
-    ssl=False
-)
-vector_store = Chroma(
-    collection_name="insta_posts",  # Make sure this matches your collection name
-    embedding_function=embedding_model,
-    client=chromadb_client
-)
-
-def perform_similarity_search(query, k=2):
-    """Perform a similarity search on the vector store based on a text query."""
+# Shared with the embedding service, created on first use
+vector_store = clients.lazy('vector_store')
+chroma_collection = clients.lazy('chroma_collection')
+embedding_model = clients.lazy('embedding_model')
+search_cache = clients.lazy('search_cache')
+# In-process index used instead of ChromaDB when RETRIEVER_BACKEND is numpy
+vector_index = clients.lazy('vector_index')
+# BM25 index kept up to date by the embedding service
+lexical_index = clients.lazy('lexical_index')
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+RERANKERS = ("mmr",)
+
+# Only indexed Instagram posts are searchable
+SEARCH_FILTER = {"source": "insta_posts"}
+
+
+def search_filter(filters=None):
+    """Combine caller predicates (validated by filters.validate_filter) with the fixed source filter."""
+    return {**(filters or {}), **SEARCH_FILTER}
+
+
+def perform_similarity_search(query, k=2, mode="vector", filters=None, rerank=None):
+    """Perform a similarity search based on a text query.
+
+    ``mode`` is "vector" (dense embeddings), "lexical" (BM25 keywords, no
+    embedding call) or "hybrid" (both, fused by reciprocal rank). ``filters``
+    restricts results by metadata, e.g. ``{"product_id": {"$in": ["1", "2"]}}``.
+    ``rerank="mmr"`` diversifies vector results by maximal marginal relevance.
+    """
+    where = search_filter(filters)
+    cache_key = search_cache.make_key(query, k, where, f"{mode}+{rerank}" if rerank else mode)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        # Perform the similarity search
-        results = vector_store.similarity_search(
-            query=query,
-            k=k,
-            filter={"source": "insta_posts"}  # Filter by source, modify as needed
-        )
-        
-        formatted_results = []
-        for res in results:
-            formatted_results.append({
-                "content": res.page_content,
-                "metadata": res.metadata
-            })
+        # Read the generation first, so a write during the search is not cached as fresh
+        generation = search_cache.generation
+
+        if mode == "lexical":
+            formatted_results = lexical_search(query, k, where)
+        elif mode == "hybrid":
+            formatted_results = hybrid_search(query, k, where)
+        elif rerank == "mmr":
+            formatted_results = diversified_search(query, k, where)
+        else:
+            formatted_results = vector_search(query, k, where)
+        search_cache.set(cache_key, formatted_results, generation)
         return formatted_results
 
     except Exception as e:
         logger.error(f"Error during similarity search: {e}")
         raise e
+
+
+def vector_search(query, k, where=SEARCH_FILTER):
+    """Dense search through the configured vector backend."""
+    if Config.RETRIEVER_BACKEND == "numpy":
+        return search_vector_index([embedding_model.embed_query(query)], k, where)[0]
+
+    # Perform the similarity search
+    results = vector_store.similarity_search(
+        query=query,
+        k=k,
+        filter=to_chroma_where(where)  # Filter by source plus any caller predicates
+    )
+    
+    formatted_results = []
+    for res in results:
+        formatted_results.append({
+            "content": res.page_content,
+            "metadata": res.metadata
+        })
+    return formatted_results
+
+
+def mmr_select(query_embedding, candidate_embeddings, k, lambda_mult=0.5):
+    """Pick k candidates by maximal marginal relevance, returning their indices in pick order.
+
+    Each pick maximizes ``lambda_mult * relevance - (1 - lambda_mult) * redundancy``,
+    where redundancy is the highest cosine similarity to anything already picked.
+    The pairwise similarities come from one matrix product; each step then only
+    updates a running maximum.
+    """
+    if k <= 0 or not len(candidate_embeddings):
+        return []
+    candidates = normalize_rows(candidate_embeddings)
+    relevance = candidates @ normalize_rows(query_embedding)[0]
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, len(candidates)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+def diversified_search(query, k, where=SEARCH_FILTER):
+    """Over-fetch MMR_CANDIDATES dense hits, then keep a diverse top-k chosen by MMR."""
+    query_embedding = embedding_model.embed_query(query)
+    fetch = max(k, Config.MMR_CANDIDATES)
+
+    if Config.RETRIEVER_BACKEND == "numpy":
+        hits = vector_index.search([query_embedding], fetch, where=where, include_vectors=True)[0]
+        candidates = [{"content": hit["content"], "metadata": hit["metadata"]} for hit in hits]
+        embeddings = [hit["vector"] for hit in hits]
+    else:
+        results = chroma_collection.query(
+            query_embeddings=[query_embedding],
+            n_results=fetch,
+            where=to_chroma_where(where),
+            include=["documents", "metadatas", "embeddings"]
+        )
+        candidates = [
+            {"content": document, "metadata": metadata}
+            for document, metadata in zip(results["documents"][0], results["metadatas"][0])
+        ]
+        embeddings = results["embeddings"][0]
+
+    if not candidates:
+        return []
+    start = time.perf_counter()
+    selected = mmr_select(query_embedding, embeddings, k, Config.MMR_LAMBDA)
+    logger.info(f"MMR reranked {len(candidates)} candidates to {len(selected)} "
+                f"in {(time.perf_counter() - start) * 1000:.2f} ms")
+    return [candidates[i] for i in selected]
+
+
+def lexical_search(query, k, where=SEARCH_FILTER):
+    """Keyword search over the BM25 index; needs no embedding call."""
+    return [
+        {"content": hit["content"], "metadata": hit["metadata"]}
+        for hit in lexical_index.search(query, k, where=where)
+    ]
+
+
+def hybrid_search(query, k, where=SEARCH_FILTER):
+    """Fuse dense and keyword rankings, each over-fetched to HYBRID_CANDIDATES results."""
+    candidates = max(k, Config.HYBRID_CANDIDATES)
+    return reciprocal_rank_fusion(
+        [vector_search(query, candidates, where), lexical_search(query, candidates, where)], k)
+
+
+def result_key(result):
+    return str(result["metadata"].get("product_id", result["content"]))
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """Merge ranked result lists by summing 1 / (HYBRID_RRF_K + rank) for each product.
+
+    Rank-based fusion needs no score calibration between BM25 and cosine
+    similarity, which live on unrelated scales.
+    """
+    scores, results = {}, {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            key = result_key(result)
+            scores[key] = scores.get(key, 0.0) + 1 / (Config.HYBRID_RRF_K + rank)
+            results.setdefault(key, result)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [results[key] for key in best]
+
+
+def perform_batch_similarity_search(queries, k=2, filters=None):
+    """Search many queries at once: one batched embedding call and one ChromaDB query."""
+    where = search_filter(filters)
+    cache_keys = [search_cache.make_key(query, k, where) for query in queries]
+    batch_results = [search_cache.get(key) for key in cache_keys]
+    missing = [i for i, results in enumerate(batch_results) if results is None]
+    if not missing:
+        return batch_results
+
+    try:
+        generation = search_cache.generation
+
+        # Embed every uncached query in a single request
+        query_embeddings = embedding_model.embed_documents([queries[i] for i in missing])
+
+        if Config.RETRIEVER_BACKEND == "numpy":
+            found = search_vector_index(query_embeddings, k, where)
+        else:
+            # Query ChromaDB with all the vectors together
+            results = chroma_collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=to_chroma_where(where),
+                include=["documents", "metadatas"]
+            )
+            found = [
+                [{"content": document, "metadata": metadata} for document, metadata in zip(documents, metadatas)]
+                for documents, metadatas in zip(results["documents"], results["metadatas"])
+            ]
+
+        for i, hits in zip(missing, found):
+            batch_results[i] = hits
+            search_cache.set(cache_keys[i], hits, generation)
+        return batch_results
+
+    except Exception as e:
+        logger.error(f"Error during batch similarity search: {e}")
+        raise e
+
+
+def search_vector_index(query_embeddings, k, where=SEARCH_FILTER):
+    """Search the local vector index, returning results in the same shape as the ChromaDB path."""
+    return [
+        [{"content": hit["content"], "metadata": hit["metadata"]} for hit in hits]
+        for hits in vector_index.search(query_embeddings, k, where=where)
+    ]
+
+
+def rebuild_local_indexes():
+    """Bulk load the local vector and BM25 indexes from the ChromaDB collection."""
+    counts = {
+        "vector": load_from_chroma(vector_index, chroma_collection),
+        "lexical": build_from_chroma(lexical_index, chroma_collection)
+    }
+    search_cache.invalidate()
+    return counts
+
+
+def get_search_cache_stats():
+    """Hit rate and size of the search result cache in this process."""
+    return search_cache.stats()
@@ -1,12 +1,13 @@
 import os
 import logging
-import boto3
 import uuid
 from flask import request
 from app.config import Config
+from app.clients import clients
 
 
-s3 = boto3.client('s3', region_name=Config.AWS_REGION)
+# Shared S3 client, created on first use
+s3 = clients.lazy('s3')
 
 def upload_file_to_s3(file, bucket_name, key):
     """Upload a file to S3."""
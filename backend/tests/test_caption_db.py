@@ -0,0 +1,172 @@
+import pytest
+from flask import Flask, json
+from services.caption_db.service import caption_db_bp
+from unittest.mock import patch, MagicMock
+from app.clients import clients
+
+# Create a test client for Flask
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(caption_db_bp, url_prefix='/caption_db')
+    client = app.test_client()
+    # Start every test with an empty local caption cache
+    clients.reset('caption_cache')
+    yield client
+
+CAMPAIGN = {
+    "client_id": "c1",
+    "prod_id": "p1",
+    "campaign_id": "camp-1",
+    "campaign_type": "launch",
+    "length": 3,
+    "target_demographic": "18-25"
+}
+
+
+def caption_result(client_id, product_id):
+    return {"client_id": client_id, "product_id": product_id,
+            "campaign_day": [{"day": "Day 1", "caption": "Glow", "hashtags": "#glow"}]}
+
+
+# Repeat requests for unchanged inputs are served from the stored result
+@patch('services.caption_db.service.generate_marketing_captions', side_effect=caption_result)
+@patch('services.caption_db.utils.get_s3_etag', side_effect=lambda bucket, key: f"etag-{key.rsplit('/', 1)[1]}")
+@patch('services.caption_db.utils.get_campaign_from_client', return_value=CAMPAIGN)
+def test_generate_captions_cached(mock_campaign, mock_etag, mock_generate, client):
+    mock_table = MagicMock()
+    stored = {}
+    mock_table.put_item.side_effect = lambda Item: stored.update(Item)
+    mock_table.get_item.side_effect = lambda Key: {"Item": dict(stored)} if stored else {}
+
+    with patch('services.caption_db.service.table', mock_table), patch('services.caption_db.utils.table', mock_table):
+        first = client.get('/caption_db/generate-captions/c1/p1')
+        second = client.get('/caption_db/generate-captions/c1/p1')
+        assert mock_generate.call_count == 1
+        assert first.headers["X-Caption-Cache"] == "miss"
+        assert second.headers["X-Caption-Cache"] == "hit"
+        assert json.loads(second.data)["fingerprint"] == json.loads(first.data)["fingerprint"]
+
+        # Another process (empty local cache) finds the result in DynamoDB
+        clients.reset('caption_cache')
+        assert client.get('/caption_db/generate-captions/c1/p1').headers["X-Caption-Cache"] == "hit"
+        assert mock_generate.call_count == 1
+
+        # A new description changes the fingerprint; regenerate=true always bypasses the cache
+        mock_etag.side_effect = lambda bucket, key: f"etag2-{key.rsplit('/', 1)[1]}"
+        assert client.get('/caption_db/generate-captions/c1/p1').headers["X-Caption-Cache"] == "miss"
+        assert client.get('/caption_db/generate-captions/c1/p1?regenerate=true').headers["X-Caption-Cache"] == "miss"
+        assert mock_generate.call_count == 3
+
+
+# A submitted job reports the result read back from DynamoDB once stored
+@patch('services.caption_db.service.generate_marketing_captions', side_effect=caption_result)
+@patch('services.caption_db.service.fingerprint_product', return_value=(CAMPAIGN, "fp-1"))
+def test_caption_job_stored_result(mock_fingerprint, mock_generate, client, tmp_path, monkeypatch):
+    import time
+    from app.config import Config
+
+    monkeypatch.setattr(Config, 'CAPTION_JOBS_DIR', str(tmp_path))
+    mock_table = MagicMock()
+    stored = {}
+    mock_table.put_item.side_effect = lambda Item: stored.update(Item)
+    mock_table.get_item.side_effect = lambda Key: {"Item": dict(stored)} if stored else {}
+
+    with patch('services.caption_db.service.table', mock_table), patch('services.caption_db.utils.table', mock_table):
+        response = client.post('/caption_db/generate-captions/c1/p1/jobs')
+        assert response.status_code == 202
+        job_id = json.loads(response.data)["job_id"]
+
+        deadline = time.monotonic() + 5
+        job = json.loads(client.get(f'/caption_db/jobs/{job_id}').data)["job"]
+        while job["state"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = json.loads(client.get(f'/caption_db/jobs/{job_id}').data)["job"]
+
+        assert job["state"] == "completed"
+        assert job["campaign_id"] == "camp-1"
+        assert job["result"]["fingerprint"] == "fp-1"
+        mock_table.get_item.assert_called_with(Key={'campaign_id': 'camp-1'})
+
+
+# A bulk run covers every product of the client with bounded concurrency and batched writes
+def test_bulk_caption_job(client, tmp_path, monkeypatch):
+    import time
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.config import Config
+    from services.caption_db.utils import remember_captions
+
+    monkeypatch.setattr(Config, 'CAPTION_JOBS_DIR', str(tmp_path))
+    campaigns = [dict(CAMPAIGN, prod_id=f"p{i}", campaign_id=f"camp-{i}") for i in range(1, 7)]
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow_generate(client_id, product_id):
+        with lock:
+            active.append(product_id)
+            peak.append(len(active))
+        time.sleep(0.1)
+        with lock:
+            active.remove(product_id)
+        return None if product_id == "p2" else caption_result(client_id, product_id)
+
+    mock_table = MagicMock()
+    mock_table.name = "campaigns"
+    mock_table.meta.client.batch_write_item.return_value = {}
+    remember_captions("fp-p3", {"client_id": "c1", "product_id": "p3", "campaign_id": "camp-3"})
+
+    with patch('services.caption_db.service.list_client_campaigns', return_value=campaigns), \
+            patch('services.caption_db.service.fingerprint_product',
+                  side_effect=lambda client_id, product_id, campaign=None: (campaign, f"fp-{product_id}")), \
+            patch('services.caption_db.service.generate_marketing_captions', side_effect=slow_generate) as mock_generate, \
+            patch('services.caption_db.service.bulk_executor', ThreadPoolExecutor(max_workers=2)), \
+            patch('services.caption_db.service.table', mock_table), patch('services.caption_db.utils.table', mock_table):
+        response = client.post('/caption_db/generate-captions/c1')
+        assert response.status_code == 202
+        job_id = json.loads(response.data)["job_id"]
+
+        deadline = time.monotonic() + 5
+        job = json.loads(client.get(f'/caption_db/bulk/{job_id}').data)["job"]
+        while job["state"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = json.loads(client.get(f'/caption_db/bulk/{job_id}').data)["job"]
+
+    assert job["state"] == "completed"
+    assert (job["total"], job["generated"], job["cached"], job["failed"], job["pending"]) == (6, 4, 1, 1, 0)
+    assert job["products"]["p2"]["status"] == "failed"
+    assert job["products"]["p3"] == {"status": "cached", "campaign_id": "camp-3"}
+    assert mock_generate.call_count == 5
+    assert max(peak) <= 2
+
+    # The four new results go out in one BatchWriteItem request
+    mock_table.meta.client.batch_write_item.assert_called_once()
+    written = mock_table.meta.client.batch_write_item.call_args.kwargs["RequestItems"]["campaigns"]
+    assert sorted(request["PutRequest"]["Item"]["campaign_id"] for request in written) == \
+        ["camp-1", "camp-4", "camp-5", "camp-6"]
+
+
+# The three lookups share one timeout: slow lookups that each finish within it still fail the fingerprint
+def test_fingerprint_product_shared_timeout(monkeypatch):
+    import time
+    from services.caption_db.utils import fingerprint_product, Config
+
+    delays = {"image.png": 0.3, "description.txt": 0.45}
+
+    def slow_etag(bucket, key):
+        time.sleep(delays[key.rsplit('/', 1)[1]])
+        return "etag"
+
+    def slow_campaign(client_id, product_id):
+        time.sleep(0.15)
+        return CAMPAIGN
+
+    monkeypatch.setattr(Config, 'CAPTION_FETCH_TIMEOUT', 0.2)
+    with patch('services.caption_db.utils.get_s3_etag', side_effect=slow_etag), \
+            patch('services.caption_db.utils.get_campaign_from_client', side_effect=slow_campaign):
+        start = time.monotonic()
+        assert fingerprint_product("c1", "p1") == (None, None)
+        assert time.monotonic() - start < 0.4
+        # Let the stragglers finish before the patches are undone
+        time.sleep(0.5)
@@ -0,0 +1,345 @@
+import io
+import time
+import pytest
+from flask import Flask
+from PIL import Image
+from services.captioning.service import captioning_bp
+from unittest.mock import patch
+
+# Create a test client for Flask
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(captioning_bp, url_prefix='/captioning')
+    client = app.test_client()
+    yield client
+
+CAMPAIGN = {
+    "client_id": "c1",
+    "prod_id": "p1",
+    "campaign_id": "camp-1",
+    "campaign_type": "launch",
+    "length": 3,
+    "target_demographic": "18-25"
+}
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def slow_s3_file(bucket, key):
+    time.sleep(0.2)
+    return png_bytes() if key.endswith("image.png") else b"Vitamin C serum"
+
+
+def slow_campaign(client_id, product_id):
+    time.sleep(0.2)
+    return CAMPAIGN
+
+
+# The S3 and RDS fetches overlap, so the total is close to the slowest one
+@patch('services.captioning.utils.get_campaign_from_client', side_effect=slow_campaign)
+@patch('services.captioning.utils.get_s3_file', side_effect=slow_s3_file)
+def test_fetch_product_data_concurrent(mock_get_s3_file, mock_campaign):
+    from services.captioning.utils import fetch_product_data
+
+    timings = {}
+    image, description, campaign_type, demographic, length = fetch_product_data("c1", "p1", timings)
+
+    assert image.size == (4, 4)
+    assert (description, campaign_type, demographic, length) == ("Vitamin C serum", "launch", "18-25", 3)
+    assert set(timings) == {"image", "description", "campaign", "fetch", "decode"}
+    assert timings["fetch"] < 500
+
+
+# A fetch that overruns the budget fails the request instead of hanging it
+@patch('services.captioning.utils.get_campaign_from_client', side_effect=slow_campaign)
+@patch('services.captioning.utils.get_s3_file', side_effect=slow_s3_file)
+def test_fetch_product_data_timeout(mock_get_s3_file, mock_campaign):
+    from services.captioning.utils import fetch_product_data, Config
+
+    with patch.object(Config, 'CAPTION_FETCH_TIMEOUT', 0.05):
+        assert fetch_product_data("c1", "p1") == (None, None, None, None, None)
+
+
+# Each day is sent as its own event as soon as its block of model output is complete
+@patch('services.captioning.utils.llm')
+@patch('services.captioning.utils.perform_similarity_search', return_value=[])
+@patch('services.captioning.utils.extract_image_features', return_value="red, glass bottle")
+@patch('services.captioning.utils.fetch_product_data')
+def test_stream_captions(mock_fetch, mock_features, mock_search, mock_llm, client):
+    import json
+    from unittest.mock import MagicMock
+
+    mock_fetch.return_value = (Image.new("RGB", (4, 4)), "Vitamin C serum", "launch", "18-25", 2)
+    chunks = ["Glow up", " with C\n#glow #", "vitaminc\n", "\nDay two caption\n#skin", "care"]
+    mock_llm.stream.return_value = iter(MagicMock(content=chunk) for chunk in chunks)
+
+    response = client.get('/captioning/generate-captions/c1/p1/stream')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = [block.split("\n", 1) for block in response.get_data(as_text=True).strip().split("\n\n")]
+    assert [name for name, _ in events] == ["event: day", "event: day", "event: done"]
+    assert json.loads(events[0][1][len("data: "):]) == {
+        "day": "Day 1", "caption": "Glow up with C", "hashtags": "#glow #vitaminc"
+    }
+    assert json.loads(events[1][1][len("data: "):])["hashtags"] == "#skincare"
+
+
+# Long campaigns are generated as concurrent chunks, merged in order, with repeated captions or hashtag sets replaced
+@patch('services.captioning.utils.llm')
+def test_generate_chunked_captions(mock_llm):
+    import re
+    from unittest.mock import MagicMock
+    from services.captioning.utils import generate_captions_from_context, Config
+
+    def fake_llm(prompt):
+        match = re.search(r"days (\d+) to (\d+)", prompt[0].content)
+        first, last = int(match.group(1)), int(match.group(2))
+        if len(prompt) > 3:
+            # Follow-up call for the days lost to duplicates
+            return MagicMock(content="\n\n".join(f"Fresh caption {d}\n#fresh{d}" for d in range(first, last + 1)))
+        days = [f"Caption {d}\n#tag{d} #tag{d}" for d in range(first, last + 1)]
+        if first == 4:
+            days[0] = "caption 1\n#dupe"  # repeats day 1
+        if first == 7:
+            days[0] = "Caption 7\n#TAG2 #tag2"  # repeats day 2's hashtags
+        return MagicMock(content="\n\n".join(days))
+
+    mock_llm.side_effect = fake_llm
+    with patch.object(Config, 'CAPTION_CHUNK_DAYS', 3):
+        captions = generate_captions_from_context("serum", [], "launch", "18-25", 8)
+
+    assert mock_llm.call_count == 4
+    assert [day["day"] for day in captions] == [f"Day {d}" for d in range(1, 9)]
+    assert [day["caption"] for day in captions] == [
+        "Caption 1", "Caption 2", "Caption 3", "Caption 5", "Caption 6", "Caption 8", "Fresh caption 7", "Fresh caption 8"
+    ]
+    assert len({frozenset(day["hashtags"].lower().split()) for day in captions}) == 8
+    assert captions[0]["hashtags"] == "#tag1"
+    assert "Caption 1" in mock_llm.call_args_list[-1].args[0][3].content
+
+
+# Context keeps only post text, drops near-duplicate posts and stays within the token budget
+def test_build_caption_context():
+    from services.captioning.context import build_caption_context
+
+    metadata = {"source": "insta_posts", "image_path": "s3://bucket/products/1/image.png",
+                "description_path": "s3://bucket/products/1/description.txt", "product_id": "1"}
+    results = [
+        {"content": "Features: amber glass dropper, vitamin c serum\nDescription: brightening serum", "metadata": metadata},
+        {"content": "Features: amber glass dropper, vitamin c  serum\nDescription: brightening serum!", "metadata": metadata},
+        {"content": "Features: white pump bottle\nDescription: " + "gentle hydrating cleanser " * 200, "metadata": metadata},
+    ]
+
+    context, report = build_caption_context(results, max_tokens=120, max_post_tokens=80)
+
+    assert "s3://" not in context
+    assert context.startswith("Post 1: Features: amber glass dropper")
+    assert "Post 2: Features: white pump bottle" in context
+    assert report["posts_used"] == 2
+    assert report["duplicates_dropped"] == 1
+    assert report["context_tokens"] <= 120
+    assert report["tokens_saved"] == report["raw_tokens"] - report["context_tokens"] > 0
+
+
+def wait_for_job(client, url, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(url).get_json()["job"]
+        if job["state"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job at {url} did not finish")
+
+
+# Submitting returns a job id at once; polling returns the captions when done
+def test_caption_job_submit_and_poll(client, tmp_path, monkeypatch):
+    from app.config import Config
+
+    monkeypatch.setattr(Config, 'CAPTION_JOBS_DIR', str(tmp_path))
+
+    def slow_generate(client_id, product_id):
+        time.sleep(0.3)
+        return {"client_id": client_id, "product_id": product_id, "campaign_day": [{"day": "Day 1"}]}
+
+    with patch('services.captioning.service.generate_marketing_captions', side_effect=slow_generate):
+        started = time.monotonic()
+        response = client.post('/captioning/generate-captions/c1/p1/jobs')
+        assert time.monotonic() - started < 0.2
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+
+        job = wait_for_job(client, f'/captioning/jobs/{job_id}')
+        assert job["state"] == "completed"
+        assert job["result"]["campaign_day"] == [{"day": "Day 1"}]
+
+    assert client.get('/captioning/jobs/not-a-job').status_code == 404
+
+
+# Submissions beyond the pending limit are refused instead of queueing without bound
+def test_caption_job_queue_bounded(client, tmp_path, monkeypatch):
+    from app.config import Config
+    import threading
+
+    monkeypatch.setattr(Config, 'CAPTION_JOBS_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'CAPTION_JOB_MAX_PENDING', 1)
+    release = threading.Event()
+
+    def blocked_generate(client_id, product_id):
+        release.wait(5)
+        return None
+
+    with patch('services.captioning.service.generate_marketing_captions', side_effect=blocked_generate):
+        first = client.post('/captioning/generate-captions/c1/p1/jobs')
+        second = client.post('/captioning/generate-captions/c1/p2/jobs')
+        release.set()
+        assert first.status_code == 202
+        assert second.status_code == 429
+
+        job = wait_for_job(client, f'/captioning/jobs/{first.get_json()["job_id"]}')
+        assert job["state"] == "failed"
+
+
+# Duplicate caption requests in flight together cause a single LLM call
+@patch('services.captioning.utils.llm')
+def test_generate_captions_single_flight(mock_llm):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest.mock import MagicMock
+    from services.captioning.utils import generate_captions_from_context
+
+    def slow_llm(prompt):
+        time.sleep(0.3)
+        return MagicMock(content="Day 1: Glow up #glow\n\nDay 2: Shine on #shine")
+
+    mock_llm.side_effect = slow_llm
+    barrier = threading.Barrier(6)
+
+    def request(_):
+        barrier.wait()
+        return generate_captions_from_context("Features: serum", "Post 1: glow", "launch", "18-25", 2)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(request, range(6)))
+
+    assert mock_llm.call_count == 1
+    assert all(result == results[0] for result in results)
+    assert len(results[0]) == 2
+
+    # A different campaign is a separate call
+    generate_captions_from_context("Features: serum", "Post 1: glow", "sale", "18-25", 2)
+    assert mock_llm.call_count == 2
+
+
+# A failed vision call fails the request instead of captioning the error text
+@patch('services.captioning.utils.perform_similarity_search')
+@patch('services.captioning.utils.extract_image_features')
+@patch('services.captioning.utils.get_campaign_from_client', return_value=CAMPAIGN)
+@patch('services.captioning.utils.get_s3_file', side_effect=lambda bucket, key: slow_s3_file(bucket, key))
+def test_generate_captions_vision_failure(mock_get_s3_file, mock_campaign, mock_features, mock_search, client):
+    from services.embedding.utils import IMAGE_FEATURES_ERROR
+
+    mock_features.return_value = IMAGE_FEATURES_ERROR
+    response = client.get('/captioning/generate-captions/c1/p1')
+
+    assert response.status_code == 500
+    mock_search.assert_not_called()
+
+
+# Jobs left active by a dead worker are reported as interrupted, and expired job files are removed
+def test_caption_job_interrupted_and_expired(client, tmp_path, monkeypatch):
+    import os
+    import json
+    import uuid
+    import socket
+    import subprocess
+    import sys
+    from app.config import Config
+    from services.captioning import jobs
+
+    monkeypatch.setattr(Config, 'CAPTION_JOBS_DIR', str(tmp_path))
+    monkeypatch.setattr(jobs, 'last_cleanup', 0.0)
+    dead_pid = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+
+    def write_job(state, host, pid, age=0):
+        job_id = str(uuid.uuid4())
+        path = tmp_path / f"{job_id}.json"
+        path.write_text(json.dumps({"job_id": job_id, "kind": "captioning", "state": state, "host": host, "pid": pid}))
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return job_id
+
+    def state(job_id):
+        return client.get(f'/captioning/jobs/{job_id}').get_json()["job"]["state"]
+
+    assert state(write_job("running", socket.gethostname(), int(dead_pid))) == "interrupted"
+    assert state(write_job("running", "other-host", 1234)) == "running"
+    assert state(write_job("queued", "other-host", 1234, age=Config.CAPTION_JOB_STALE_SECONDS + 60)) == "interrupted"
+
+    expired = write_job("completed", "other-host", 1234, age=Config.CAPTION_JOB_RETENTION_SECONDS + 60)
+    recent = write_job("completed", "other-host", 1234)
+    with patch('services.captioning.service.generate_marketing_captions', return_value=None):
+        response = client.post('/captioning/generate-captions/c1/p1/jobs')
+        assert response.status_code == 202
+        wait_for_job(client, f'/captioning/jobs/{response.get_json()["job_id"]}')
+    assert client.get(f'/captioning/jobs/{expired}').status_code == 404
+    assert state(recent) == "completed"
+
+
+# N duplicate caption requests in flight together make one vision, one embedding and one caption call
+@patch('services.captioning.utils.llm')
+@patch('services.embedding.utils.vision_llm')
+def test_duplicate_caption_requests_single_flight(mock_vision_llm, mock_llm):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest.mock import MagicMock
+    from PIL import Image
+    from app.clients import clients
+    from services.captioning.utils import generate_marketing_captions
+    from services.embedding.cache import LRUCache
+    from services.embedding.embeddings import CachedEmbeddings
+
+    def slow(result):
+        def call(*args):
+            time.sleep(0.3)
+            return result
+        return call
+
+    mock_vision_llm.side_effect = slow(MagicMock(content="amber, glass dropper"))
+    mock_llm.side_effect = slow(MagicMock(content="Day 1: Glow up #glow\n\nDay 2: Shine on #shine"))
+    underlying = MagicMock()
+    underlying.embed_documents.side_effect = lambda texts: slow([[1.0, 0.0] for _ in texts])()
+    embeddings = CachedEmbeddings(underlying, LRUCache(16), "test-model")
+
+    def similarity_search(query, k, filter):
+        embeddings.embed_query(query)
+        return [MagicMock(page_content="Glow serum post", metadata={"source": "insta_posts"})]
+
+    vector_store = MagicMock()
+    vector_store.similarity_search.side_effect = similarity_search
+    inputs = (Image.new("RGB", (4, 4), "green"), "Vitamin C serum", "launch", "18-25", 2)
+    report = {"context_tokens": 4, "posts_used": 1, "tokens_saved": 0}
+    clients.reset('search_cache')
+    barrier = threading.Barrier(6)
+
+    def request(_):
+        barrier.wait()
+        return generate_marketing_captions("c1", "p1")
+
+    with patch('services.captioning.utils.fetch_product_data', return_value=inputs), \
+            patch('services.embedding.utils.feature_cache', LRUCache(8)), \
+            patch('services.retriever.utils.vector_store', vector_store), \
+            patch('services.captioning.utils.build_caption_context', return_value=("Post 1: Glow serum post", report)):
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(request, range(6)))
+
+    assert mock_vision_llm.call_count == 1
+    assert underlying.embed_documents.call_count == 1
+    assert mock_llm.call_count == 1
+    assert all(result["campaign_day"] == results[0]["campaign_day"] for result in results)
@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock
+from app.clients import ClientRegistry
+
+
+# Clients are created on first use, once, and shared by every lazy reference
+def test_registry_creates_clients_lazily_and_once():
+    registry = ClientRegistry()
+    factory = MagicMock(return_value=MagicMock(name="s3"))
+    registry.register('s3', factory)
+
+    first = registry.lazy('s3')
+    second = registry.lazy('s3')
+    factory.assert_not_called()
+
+    first.get_object(Bucket="b", Key="k")
+    second.get_object(Bucket="b", Key="k")
+    factory.assert_called_once()
+    assert registry.get('s3').get_object.call_count == 2
+    assert 's3' in registry.init_seconds
+
+
+# Importing the app must not connect to ChromaDB, AWS or OpenAI
+def test_create_app_does_not_initialize_clients():
+    from app import create_app
+    from app.clients import clients
+
+    clients.reset()
+    app = create_app()
+    assert app.config['STARTUP_SECONDS'] > 0
+    assert not any(clients.is_initialized(name) for name in ('chromadb_client', 'vector_store', 's3'))
+
+
+# The fetching service reaches S3 only through the registry, so importing it leaves boto3 unloaded
+def test_fetching_import_does_not_load_boto3():
+    import subprocess
+    import sys
+
+    code = "import sys, services.fetching.utils; print('boto3' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
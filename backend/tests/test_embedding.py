@@ -11,12 +11,15 @@ def client():
     client = app.test_client()
     yield client
 
-# Mock the S3 and ChromaDB interactions
+# Mock the S3, vision model and ChromaDB interactions
 @patch('services.embedding.utils.get_s3_file')
 @patch('services.embedding.utils.Image.open')
-@patch('services.embedding.utils.vector_store.add_texts')
+@patch('services.embedding.utils.vector_store')
 @patch('services.embedding.utils.update_dynamo_db')
-def test_process_embedding_success(mock_dynamo, mock_add_texts, mock_image_open, mock_get_s3_file, client):
+@patch('services.embedding.utils.lexical_index')
+@patch('services.embedding.utils.extract_image_features', return_value="red, glass bottle")
+def test_process_embedding_success(mock_features, mock_lexical_index, mock_dynamo, mock_vector_store,
+                                   mock_image_open, mock_get_s3_file, client):
     # Mocking S3 image and description fetching
     mock_get_s3_file.side_effect = [
         b'test_image_data',   # Mock image
@@ -26,7 +29,7 @@ def test_process_embedding_success(mock_dynamo, mock_add_texts, mock_image_open,
     mock_image_open.return_value = MagicMock()  # Mock the PIL Image.open behavior
 
     # Mocking successful ChromaDB and DynamoDB operations
-    mock_add_texts.return_value = None
+    mock_vector_store.add_texts.return_value = None
     mock_dynamo.return_value = None
 
     # Send a GET request to process a specific product_id
@@ -48,3 +51,407 @@ def test_process_embedding_failure(mock_get_s3_file, client):
     response = client.get('/embedding/process/12345')
     assert response.status_code == 500
     assert b"error" in response.data
+
+
+def png_bytes(color="red"):
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fake_s3_file(bucket_name, file_key):
+    return png_bytes() if file_key.endswith("image.png") else b"test_description"
+
+
+def written_product_ids(mock_table):
+    """Product IDs sent through BatchWriteItem on a mocked DynamoDB table."""
+    return [
+        request['PutRequest']['Item']['product_id']
+        for call in mock_table.meta.client.batch_write_item.call_args_list
+        for requests in call.kwargs['RequestItems'].values()
+        for request in requests
+    ]
+
+
+# Only new or changed products are reprocessed on a bulk run
+@patch('services.embedding.utils.lexical_index')
+@patch('services.embedding.utils.table')
+@patch('services.embedding.utils.get_chroma_collection')
+@patch('services.embedding.utils.embedding_model')
+@patch('services.embedding.utils.extract_image_features')
+@patch('services.embedding.utils.get_s3_file')
+@patch('services.embedding.utils.list_product_etags')
+def test_process_all_skips_unchanged_products(mock_list_etags, mock_get_s3_file, mock_features,
+                                              mock_embedding_model, mock_collection, mock_table,
+                                              mock_lexical_index, tmp_path):
+    from services.embedding.utils import process_all_products, Config
+
+    manifest_path = tmp_path / "manifest.json"
+    mock_get_s3_file.side_effect = fake_s3_file
+    mock_features.return_value = "red, glass bottle"
+    mock_embedding_model.embed_documents.side_effect = lambda texts: [[0.1, 0.2] for _ in texts]
+    mock_table.meta.client.batch_write_item.return_value = {}
+    mock_list_etags.return_value = {
+        "1": {"image.png": "a1", "description.txt": "d1"},
+        "2": {"image.png": "a2", "description.txt": "d2"},
+    }
+
+    with patch.object(Config, 'INDEX_MANIFEST_PATH', str(manifest_path)):
+        summary = process_all_products()
+        assert summary["processed"] == 2
+        assert mock_features.call_count == 2
+
+        # Second run: product 2's image changed, product 1 is untouched
+        mock_features.reset_mock()
+        mock_table.reset_mock()
+        mock_list_etags.return_value["2"]["image.png"] = "a2-new"
+        summary = process_all_products()
+
+    assert mock_features.call_count == 1
+    assert written_product_ids(mock_table) == ["2"]
+    assert summary["skipped"] == 1
+    assert summary["processed"] == 1
+
+
+# A failed vision call is recorded as failed, not indexed, so the next run retries the product
+@patch('services.embedding.utils.lexical_index')
+@patch('services.embedding.utils.table')
+@patch('services.embedding.utils.get_chroma_collection')
+@patch('services.embedding.utils.embedding_model')
+@patch('services.embedding.utils.extract_image_features')
+@patch('services.embedding.utils.get_s3_file')
+@patch('services.embedding.utils.list_product_etags')
+def test_process_all_retries_vision_failures(mock_list_etags, mock_get_s3_file, mock_features,
+                                             mock_embedding_model, mock_collection, mock_table,
+                                             mock_lexical_index, tmp_path):
+    import json
+    from services.embedding.utils import process_all_products, Config, IMAGE_FEATURES_ERROR
+
+    manifest_path = tmp_path / "manifest.json"
+    mock_get_s3_file.side_effect = fake_s3_file
+    mock_features.side_effect = [IMAGE_FEATURES_ERROR, "red, glass bottle"]
+    mock_embedding_model.embed_documents.side_effect = lambda texts: [[0.1, 0.2] for _ in texts]
+    mock_table.meta.client.batch_write_item.return_value = {}
+    mock_list_etags.return_value = {"1": {"image.png": "a1", "description.txt": "d1"}}
+
+    with patch.object(Config, 'INDEX_MANIFEST_PATH', str(manifest_path)):
+        summary = process_all_products()
+        assert (summary["processed"], summary["failed"]) == (0, 1)
+        assert json.loads(manifest_path.read_text())["1"]["status"] == "failed"
+        mock_collection.return_value.upsert.assert_not_called()
+
+        # Nothing changed in S3, but the failed product is picked up again
+        summary = process_all_products()
+
+    assert (summary["processed"], summary["skipped"]) == (1, 0)
+    assert "Error" not in mock_collection.return_value.upsert.call_args.kwargs["documents"][0]
+
+
+# Products flow through the staged pipeline; embeddings, Chroma and DynamoDB writes are batched
+@patch('services.embedding.utils.lexical_index')
+@patch('services.embedding.utils.table')
+@patch('services.embedding.utils.get_chroma_collection')
+@patch('services.embedding.utils.embedding_model')
+@patch('services.embedding.utils.extract_image_features')
+@patch('services.embedding.utils.get_s3_file')
+def test_indexing_pipeline_batches_writes(mock_get_s3_file, mock_features, mock_embedding_model,
+                                          mock_collection, mock_table, mock_lexical_index):
+    from services.embedding.utils import build_indexing_pipeline, Config
+
+    mock_get_s3_file.side_effect = lambda bucket, key: None if "/bad/" in key else fake_s3_file(bucket, key)
+    mock_features.return_value = "red, glass bottle"
+    mock_embedding_model.embed_documents.side_effect = lambda texts: [[0.1, 0.2] for _ in texts]
+    mock_table.name = "links"
+
+    def batch_write_item(RequestItems):
+        # Product 6 is throttled on every attempt
+        unprocessed = [r for r in RequestItems["links"] if r['PutRequest']['Item']['product_id'] == "6"]
+        return {"UnprocessedItems": {"links": unprocessed}} if unprocessed else {}
+
+    mock_table.meta.client.batch_write_item.side_effect = batch_write_item
+
+    with patch.object(Config, 'S3_BASE_FOLDER', 'products/'), \
+            patch.object(Config, 'EMBEDDING_BATCH_SIZE', 3), \
+            patch.object(Config, 'DYNAMODB_BATCH_MAX_RETRIES', 1), \
+            patch.object(Config, 'PIPELINE_BATCH_LINGER_SECONDS', 5.0):
+        results = build_indexing_pipeline().run([str(pid) for pid in range(7)] + ["bad"])
+
+    assert results == {**{str(pid): pid != 6 for pid in range(7)}, "bad": False}
+    assert mock_embedding_model.embed_documents.call_count == 3
+    upserts = mock_collection.return_value.upsert.call_args_list
+    assert sorted(len(call.kwargs["ids"]) for call in upserts) == [1, 3, 3]
+    # One request per batch, plus a single retry for the throttled item
+    assert mock_table.meta.client.batch_write_item.call_count == 4
+    mock_table.put_item.assert_not_called()
+    # Every product written to ChromaDB is also added to the lexical index
+    assert mock_lexical_index.add.call_count == 7
+
+
+# Repeated images are served from the feature cache, including after a restart
+@patch('services.embedding.utils.vision_llm')
+def test_extract_image_features_cached(mock_llm, tmp_path):
+    from PIL import Image
+    from services.embedding import utils
+    from services.embedding.cache import TieredCache
+
+    mock_llm.return_value = MagicMock(content=" red, glass bottle ")
+    cache_path = str(tmp_path / "features.sqlite3")
+
+    with patch.object(utils, 'feature_cache', TieredCache(max_size=8, path=cache_path, table="image_features")):
+        image = Image.new("RGB", (4, 4), "red")
+        assert utils.extract_image_features(image) == "red, glass bottle"
+        assert utils.extract_image_features(Image.new("RGB", (4, 4), "red")) == "red, glass bottle"
+        assert mock_llm.call_count == 1
+
+        # A different image is a cache miss
+        utils.extract_image_features(Image.new("RGB", (4, 4), "blue"))
+        assert mock_llm.call_count == 2
+
+    # A fresh process reads the persistent tier
+    with patch.object(utils, 'feature_cache', TieredCache(max_size=8, path=cache_path, table="image_features")):
+        assert utils.extract_image_features(Image.new("RGB", (4, 4), "red")) == "red, glass bottle"
+        assert mock_llm.call_count == 2
+
+
+# Vision images are downscaled and re-encoded before upload
+def test_preprocess_image_downscales_and_encodes():
+    import io
+    from PIL import Image
+    from services.embedding.imaging import preprocess_image
+
+    image = Image.new("RGBA", (3000, 1500), (255, 0, 0, 128))
+
+    data, mime_type = preprocess_image(image, max_dimension=1024, image_format="JPEG", quality=80)
+    assert mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(data)).size == (1024, 512)
+
+    data, mime_type = preprocess_image(image, max_dimension=1024, image_format="WEBP", detail="low")
+    assert mime_type == "image/webp"
+    assert max(Image.open(io.BytesIO(data)).size) == 512
+
+
+# Bulk indexing runs as a background job that reports progress and can be resumed
+@patch('services.embedding.jobs.process_all_products')
+def test_indexing_job_lifecycle(mock_process_all, client, tmp_path):
+    import json
+    from services.embedding import jobs
+    from services.embedding.utils import Config
+
+    def fake_process_all(force=False, progress=None):
+        summary = {"total": 3, "pending": 2, "processed": 0, "skipped": 1, "failed": 0}
+        progress(dict(summary))
+        summary["processed"] = 2
+        return summary
+
+    mock_process_all.side_effect = fake_process_all
+
+    with patch.object(Config, 'INDEX_JOBS_DIR', str(tmp_path)):
+        response = client.post('/embedding/jobs', json={"force": True})
+        assert response.status_code == 202
+        job_id = json.loads(response.data)["job_id"]
+        jobs.executor.submit(lambda: None).result()  # wait for the single worker
+
+        status = json.loads(client.get(f'/embedding/jobs/{job_id}').data)["job"]
+        assert status["state"] == "completed"
+        assert status["processed"] == 2 and status["remaining"] == 0
+        mock_process_all.assert_called_once()
+        assert mock_process_all.call_args.kwargs["force"] is True
+
+        # A job left running by a dead process shows as interrupted and resumes unforced
+        with jobs.jobs_lock:
+            stale = dict(jobs.jobs.pop(job_id), state="running")
+        jobs.save_job(stale)
+        status = json.loads(client.get(f'/embedding/jobs/{job_id}').data)["job"]
+        assert status["state"] == "interrupted"
+
+        assert client.post(f'/embedding/jobs/{job_id}/resume').status_code == 202
+        jobs.executor.submit(lambda: None).result()
+        status = json.loads(client.get(f'/embedding/jobs/{job_id}').data)["job"]
+        assert status["state"] == "completed" and status["attempts"] == 2
+        assert mock_process_all.call_args.kwargs["force"] is False
+
+    assert client.get('/embedding/jobs/not-a-job').status_code == 404
+
+
+# Another worker's live job is not mistaken for an interrupted one, and only one bulk run exists per host
+@patch('services.embedding.jobs.process_all_products')
+def test_indexing_job_cross_process(mock_process_all, client, tmp_path):
+    import os
+    import json
+    import socket
+    from services.embedding import jobs
+    from services.embedding.utils import Config
+
+    mock_process_all.return_value = {"total": 0, "pending": 0, "processed": 0, "skipped": 0, "failed": 0}
+
+    with patch.object(Config, 'INDEX_JOBS_DIR', str(tmp_path)):
+        # Running in the worker that spawned this one
+        live = {"job_id": "6f1c1a3e-3a4c-4d5e-8f00-000000000001", "state": "running", "host": socket.gethostname(),
+                "pid": os.getppid(), "processed": 1, "failed": 0, "pending": 3}
+        jobs.save_job(live)
+        assert json.loads(client.get(f'/embedding/jobs/{live["job_id"]}').data)["job"]["state"] == "running"
+        assert client.post(f'/embedding/jobs/{live["job_id"]}/resume').status_code == 409
+
+        # A run holding the host-wide lock blocks new jobs and synchronous runs in any process
+        lock_file = jobs.acquire_run_lock(live["job_id"])
+        response = client.post('/embedding/jobs', json={})
+        assert response.status_code == 409
+        assert json.loads(response.data)["job_id"] == live["job_id"]
+        assert client.get('/embedding/process_all').status_code == 409
+        mock_process_all.assert_not_called()
+
+        jobs.release_run_lock(lock_file)
+        assert client.get('/embedding/process_all').status_code == 200
+        assert client.post('/embedding/jobs', json={}).status_code == 202
+        jobs.executor.submit(lambda: None).result()
+        assert mock_process_all.call_count == 2
+
+
+# Repeated texts are embedded once and shared between documents and queries
+def test_cached_embeddings_only_embeds_misses():
+    from services.embedding.cache import TieredCache
+    from services.embedding.embeddings import CachedEmbeddings
+
+    underlying = MagicMock()
+    underlying.embed_documents.side_effect = lambda texts: [[float(len(text)), 0.5] for text in texts]
+    embeddings = CachedEmbeddings(underlying, TieredCache(max_size=16), "test-model")
+
+    assert embeddings.embed_documents(["red bottle", "blue jar", "red bottle"]) == [
+        [10.0, 0.5], [8.0, 0.5], [10.0, 0.5]
+    ]
+    underlying.embed_documents.assert_called_once_with(["red bottle", "blue jar"])
+
+    assert embeddings.embed_query("blue jar") == [8.0, 0.5]
+    embeddings.embed_documents(["blue jar", "green tube"])
+    assert underlying.embed_documents.call_args_list[-1].args == (["green tube"],)
+    assert underlying.embed_documents.call_count == 2
+
+
+def run_concurrently(fn, count):
+    """Call fn from count threads released together; returns the results."""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    barrier = threading.Barrier(count)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(lambda _: call(), range(count)))
+
+
+# Concurrent requests for the same uncached image share one vision call
+@patch('services.embedding.utils.vision_llm')
+def test_extract_image_features_single_flight(mock_llm):
+    import time
+    from PIL import Image
+    from services.embedding import utils
+    from services.embedding.cache import LRUCache
+
+    def slow_vision(prompt):
+        time.sleep(0.3)
+        return MagicMock(content="amber, glass dropper")
+
+    mock_llm.side_effect = slow_vision
+    with patch.object(utils, 'feature_cache', LRUCache(8)):
+        results = run_concurrently(lambda: utils.extract_image_features(Image.new("RGB", (4, 4), "green")), 8)
+
+    assert results == ["amber, glass dropper"] * 8
+    assert mock_llm.call_count == 1
+
+
+# Concurrent embed_query calls for the same text share one embedding request
+def test_cached_embeddings_single_flight():
+    import time
+    from services.embedding.cache import LRUCache
+    from services.embedding.embeddings import CachedEmbeddings
+
+    def slow_embed(texts):
+        time.sleep(0.3)
+        return [[1.0, 0.0] for _ in texts]
+
+    underlying = MagicMock()
+    underlying.embed_documents.side_effect = slow_embed
+    embeddings = CachedEmbeddings(underlying, LRUCache(16), "test-model")
+
+    assert run_concurrently(lambda: embeddings.embed_query("vitamin c serum"), 8) == [[1.0, 0.0]] * 8
+    assert underlying.embed_documents.call_count == 1
+    assert embeddings.flight.stats() == {"executed": 1, "coalesced": 7, "in_flight": 0}
+
+
+# Failures reach every waiting caller, and the key is released for a retry
+def test_single_flight_shares_errors():
+    import time
+    import pytest
+    from services.embedding.singleflight import SingleFlight
+
+    flight = SingleFlight("test")
+    calls = []
+
+    def failing():
+        calls.append(1)
+        time.sleep(0.3)
+        raise RuntimeError("upstream down")
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except RuntimeError as e:
+            return str(e)
+
+    assert run_concurrently(call, 4) == ["upstream down"] * 4
+    assert len(calls) == 1
+    with pytest.raises(RuntimeError):
+        flight.do("key", failing)
+    assert len(calls) == 2
+
+
+# The search cache is invalidated only once the local indexes hold the new batch
+@patch('services.embedding.utils.get_chroma_collection')
+def test_write_batch_invalidates_after_local_sync(mock_collection):
+    from services.embedding.utils import write_batch_to_chroma
+
+    calls = MagicMock()
+    batch = [{"product_id": "1", "embedding": [0.1, 0.2], "metadata": {"source": "insta_posts"}, "text": "red"}]
+    with patch('services.embedding.utils.sync_local_indexes', calls.sync), \
+            patch('services.embedding.utils.search_cache', calls.cache):
+        write_batch_to_chroma(batch)
+
+    assert [name for name, args, kwargs in calls.mock_calls] == ["sync", "cache.invalidate"]
+
+
+# Bulk runs stage local index updates and write both indexes at manifest checkpoints, not per batch
+@patch('services.embedding.utils.Config.RETRIEVER_BACKEND', 'numpy')
+@patch('services.embedding.utils.vector_index')
+@patch('services.embedding.utils.lexical_index')
+@patch('services.embedding.utils.table')
+@patch('services.embedding.utils.get_chroma_collection')
+@patch('services.embedding.utils.embedding_model')
+@patch('services.embedding.utils.extract_image_features')
+@patch('services.embedding.utils.get_s3_file')
+@patch('services.embedding.utils.list_product_etags')
+def test_process_all_saves_local_indexes_at_checkpoints(mock_list_etags, mock_get_s3_file, mock_features,
+                                                        mock_embedding_model, mock_collection, mock_table,
+                                                        mock_lexical_index, mock_vector_index, tmp_path):
+    from services.embedding.utils import process_all_products, Config
+
+    mock_get_s3_file.side_effect = fake_s3_file
+    mock_features.return_value = "red, glass bottle"
+    mock_embedding_model.embed_documents.side_effect = lambda texts: [[0.1, 0.2] for _ in texts]
+    mock_table.meta.client.batch_write_item.return_value = {}
+    mock_list_etags.return_value = {str(pid): {"image.png": f"a{pid}", "description.txt": "d"} for pid in range(5)}
+
+    with patch.object(Config, 'INDEX_MANIFEST_PATH', str(tmp_path / "manifest.json")), \
+            patch.object(Config, 'INDEX_CHECKPOINT_INTERVAL', 2), \
+            patch.object(Config, 'EMBEDDING_BATCH_SIZE', 1):
+        assert process_all_products()["processed"] == 5
+
+    assert mock_vector_index.add.call_count == 5
+    assert mock_lexical_index.add.call_count == 5
+    # Two checkpoints plus the final save
+    assert mock_vector_index.save.call_count == 3
+    assert mock_lexical_index.save.call_count == 3
@@ -1,7 +1,15 @@
 import pytest
+import threading
+import numpy as np
 from flask import Flask, json
 from services.retriever.service import retriever_bp
 from unittest.mock import patch, MagicMock
+from app.clients import clients
+from services.retriever.cache import QueryResultCache
+from services.retriever.index import NumpyVectorIndex, load_from_chroma
+from services.retriever.lexical import BM25Index
+from services.retriever.locking import file_lock
+from services.retriever.utils import mmr_select
 
 # Create a test client for Flask
 @pytest.fixture
@@ -9,13 +17,15 @@ def client():
     app = Flask(__name__)
     app.register_blueprint(retriever_bp, url_prefix='/retriever')
     client = app.test_client()
+    # Start every test with an empty search result cache
+    clients.reset('search_cache')
     yield client
 
 # Mock the ChromaDB similarity search
-@patch('services.retriever.utils.vector_store.similarity_search')
-def test_similarity_search_success(mock_similarity_search, client):
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_success(mock_vector_store, client):
     # Mock the ChromaDB results
-    mock_similarity_search.return_value = [
+    mock_vector_store.similarity_search.return_value = [
         MagicMock(page_content="Mock content 1", metadata={"product_id": "123"}),
         MagicMock(page_content="Mock content 2", metadata={"product_id": "456"})
     ]
@@ -43,10 +53,10 @@ def test_similarity_search_no_query(client):
     assert b"Query is required" in response.data
 
 # Mock a failure in ChromaDB
-@patch('services.retriever.utils.vector_store.similarity_search')
-def test_similarity_search_failure(mock_similarity_search, client):
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_failure(mock_vector_store, client):
     # Simulate an exception being thrown by the ChromaDB client
-    mock_similarity_search.side_effect = Exception("ChromaDB error")
+    mock_vector_store.similarity_search.side_effect = Exception("ChromaDB error")
 
     query_data = {
         "query": "Yellow dropper, white bottle",
@@ -56,3 +66,378 @@ def test_similarity_search_failure(mock_similarity_search, client):
     response = client.post('/retriever/search', data=json.dumps(query_data), content_type='application/json')
     assert response.status_code == 500
     assert b"error" in response.data
+
+# Many queries are embedded in one call and searched with one ChromaDB query
+@patch('services.retriever.utils.chroma_collection')
+@patch('services.retriever.utils.embedding_model')
+def test_batch_similarity_search(mock_embedding_model, mock_collection, client):
+    mock_embedding_model.embed_documents.return_value = [[0.1, 0.2], [0.3, 0.4]]
+    mock_collection.query.return_value = {
+        "documents": [["Mock content 1"], ["Mock content 2"]],
+        "metadatas": [[{"product_id": "123"}], [{"product_id": "456"}]]
+    }
+
+    query_data = {"queries": ["Yellow dropper", "White bottle"], "k": 1}
+    response = client.post('/retriever/search_batch', data=json.dumps(query_data), content_type='application/json')
+
+    assert response.status_code == 200
+    results = json.loads(response.data)["results"]
+    assert [r["query"] for r in results] == ["Yellow dropper", "White bottle"]
+    assert results[1]["results"][0]["content"] == "Mock content 2"
+    mock_embedding_model.embed_documents.assert_called_once_with(["Yellow dropper", "White bottle"])
+    mock_collection.query.assert_called_once()
+    assert mock_collection.query.call_args.kwargs["query_embeddings"] == [[0.1, 0.2], [0.3, 0.4]]
+
+# Test the case where queries are missing
+def test_batch_similarity_search_no_queries(client):
+    response = client.post('/retriever/search_batch', data=json.dumps({"queries": []}), content_type='application/json')
+    assert response.status_code == 400
+
+# Repeated searches are served from the result cache until the index changes
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_cached(mock_vector_store, client):
+    mock_vector_store.similarity_search.return_value = [
+        MagicMock(page_content="Mock content 1", metadata={"product_id": "123"})
+    ]
+
+    for query in ["Yellow dropper", "  Yellow   dropper "]:
+        response = client.post('/retriever/search', data=json.dumps({"query": query, "k": 1}),
+                               content_type='application/json')
+        assert response.status_code == 200
+    assert mock_vector_store.similarity_search.call_count == 1
+
+    # A write to the collection invalidates every cached result
+    clients.get('search_cache').invalidate()
+    client.post('/retriever/search', data=json.dumps({"query": "Yellow dropper", "k": 1}),
+                content_type='application/json')
+    assert mock_vector_store.similarity_search.call_count == 2
+
+    stats = json.loads(client.get('/retriever/cache_stats').data)["cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["invalidations"] == 1
+
+# Entries expire after the TTL, and results from an older generation are not stored
+def test_query_result_cache_ttl_and_generation():
+    cache = QueryResultCache(max_size=2, ttl_seconds=60)
+    key = cache.make_key("Yellow dropper", 2, {"source": "insta_posts"})
+
+    generation = cache.generation
+    cache.invalidate()
+    cache.set(key, ["stale"], generation)
+    assert cache.get(key) is None
+
+    cache.set(key, ["fresh"])
+    assert cache.get(key) == ["fresh"]
+    with patch('services.retriever.cache.time.monotonic', return_value=float('inf')):
+        assert cache.get(key) is None
+    assert cache.stats()["expired"] == 1
+
+# An invalidation in one process drops results cached by another sharing the marker
+def test_query_result_cache_shared_invalidation(tmp_path):
+    marker_path = str(tmp_path / "search_cache.marker")
+    reader = QueryResultCache(max_size=2, ttl_seconds=60, marker_path=marker_path)
+    writer = QueryResultCache(max_size=2, ttl_seconds=60, marker_path=marker_path)
+    key = reader.make_key("Yellow dropper", 2, None)
+
+    reader.set(key, ["cached"])
+    assert reader.get(key) == ["cached"]
+
+    # A search started before the other process's write must not store its result
+    generation = reader.generation
+    writer.invalidate()
+    reader.set(key, ["stale"], generation)
+    assert reader.get(key) is None
+
+    reader.set(key, ["fresh"])
+    assert reader.get(key) == ["fresh"]
+    writer.invalidate()
+    assert reader.get(key) is None
+    assert reader.stats()["invalidations"] == 2
+
+# The local index is bulk loaded from ChromaDB and returns exact cosine top-k
+def test_numpy_vector_index(tmp_path):
+    collection = MagicMock()
+    collection.get.side_effect = [
+        {
+            "ids": ["1", "2", "3"],
+            "embeddings": [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]],
+            "documents": ["red", "blue", "purple"],
+            "metadatas": [{"source": "insta_posts"}, {"source": "insta_posts"}, {"source": "other"}]
+        },
+        {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    ]
+    index = NumpyVectorIndex(str(tmp_path))
+    assert load_from_chroma(index, collection) == 3
+
+    hits = index.search([[1.0, 0.1]], k=2)[0]
+    assert [hit["id"] for hit in hits] == ["1", "3"]
+    hits = index.search([[1.0, 0.1]], k=2, where={"source": "insta_posts"})[0]
+    assert [hit["id"] for hit in hits] == ["1", "2"]
+
+    # Upserts replace existing ids and are visible to other readers of the same directory
+    index.upsert(["2", "4"], [[1.0, 0.0], [0.0, 1.0]], ["blue v2", "green"],
+                 [{"source": "insta_posts"}, {"source": "insta_posts"}])
+    reader = NumpyVectorIndex(str(tmp_path))
+    assert len(reader) == 4
+    hits = reader.search([[0.0, 1.0]], k=1)[0]
+    assert hits[0]["id"] == "4"
+    assert reader.search([[1.0, 0.0]], k=3, where={"source": "insta_posts"})[0][1]["content"] == "blue v2"
+
+# Staged records are written in place: replaced rows patched, new rows appended to the same vectors file
+def test_numpy_vector_index_staged_save(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path))
+    index.write(["1", "2"], [[1.0, 0.0], [0.0, 1.0]], ["red", "blue"], [{"source": "insta_posts"}] * 2)
+    vectors_file = index.vectors_file
+
+    index.add(["2", "3"], [[1.0, 0.0], [0.6, 0.8]], ["blue v2", "purple"], [{"source": "insta_posts"}] * 2)
+    assert len(index) == 2
+    index.save()
+
+    assert index.vectors_file == vectors_file
+    assert (tmp_path / vectors_file).stat().st_size == 3 * 2 * 4
+    reader = NumpyVectorIndex(str(tmp_path))
+    hits = reader.search([[1.0, 0.0]], k=3)[0]
+    assert [hit["id"] for hit in hits] == ["1", "2", "3"]
+    assert hits[1]["content"] == "blue v2"
+    assert hits[1]["score"] == pytest.approx(1.0)
+
+# Writers in different processes take turns: a save waits for the lock and keeps the other writer's rows
+def test_numpy_vector_index_concurrent_saves(tmp_path):
+    first, second = NumpyVectorIndex(str(tmp_path)), NumpyVectorIndex(str(tmp_path))
+    first.write(["1"], [[1.0, 0.0]], ["red"], [{"source": "insta_posts"}])
+    first.add(["2"], [[0.0, 1.0]], ["blue"], [{"source": "insta_posts"}])
+    second.add(["3"], [[0.6, 0.8]], ["purple"], [{"source": "insta_posts"}])
+
+    with file_lock(first.lock_path()):
+        saver = threading.Thread(target=first.save)
+        saver.start()
+        saver.join(timeout=0.2)
+        assert saver.is_alive()
+    saver.join(timeout=5)
+    assert not saver.is_alive()
+    second.save()
+
+    reader = NumpyVectorIndex(str(tmp_path))
+    assert sorted(hit["id"] for hit in reader.search([[1.0, 0.0]], k=3)[0]) == ["1", "2", "3"]
+
+# With the numpy backend, a missing index is loaded from ChromaDB on first use instead of serving nothing
+@patch('app.clients.Config.RETRIEVER_BACKEND', 'numpy')
+def test_vector_index_loads_from_chroma_when_missing(tmp_path):
+    from app.clients import create_vector_index, Config
+
+    collection = MagicMock()
+    collection.get.side_effect = [
+        {"ids": ["1"], "embeddings": [[1.0, 0.0]], "documents": ["red"], "metadatas": [{"source": "insta_posts"}]},
+        {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    ]
+    with patch.object(Config, 'VECTOR_INDEX_PATH', str(tmp_path / "index")), \
+            patch.object(clients, 'get', return_value=collection) as mock_get:
+        index = create_vector_index()
+        assert len(index) == 1
+        mock_get.assert_called_once_with('chroma_collection')
+
+        # An index already on disk is used as is
+        create_vector_index()
+        mock_get.assert_called_once()
+
+# A missing BM25 file is built from ChromaDB on first use
+def test_lexical_index_builds_from_chroma_when_missing(tmp_path):
+    from app.clients import create_lexical_index, Config
+
+    collection = MagicMock()
+    collection.get.side_effect = [
+        {"ids": ["1"], "documents": ["amber serum"], "metadatas": [{"source": "insta_posts"}]},
+        {"ids": [], "documents": [], "metadatas": []}
+    ]
+    with patch.object(Config, 'LEXICAL_INDEX_PATH', str(tmp_path / "lexical.json")), \
+            patch.object(clients, 'get', return_value=collection) as mock_get:
+        assert create_lexical_index().search("serum", k=1)[0]["id"] == "1"
+        assert len(create_lexical_index()) == 1
+        mock_get.assert_called_once_with('chroma_collection')
+
+# Quantized scanning with exact re-scoring returns the same neighbours and scores
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_numpy_vector_index_quantized(tmp_path, quantization):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 32)).astype(np.float32)
+    ids = [str(i) for i in range(500)]
+    metadatas = [{"source": "insta_posts"}] * 500
+    NumpyVectorIndex(str(tmp_path)).write(ids, vectors, ids, metadatas)
+
+    exact = NumpyVectorIndex(str(tmp_path))
+    quantized = NumpyVectorIndex(str(tmp_path), quantization=quantization, rescore_candidates=50)
+    queries = rng.standard_normal((5, 32))
+    for expected, found in zip(exact.search(queries, k=5), quantized.search(queries, k=5)):
+        assert [hit["id"] for hit in found] == [hit["id"] for hit in expected]
+        assert found[0]["score"] == pytest.approx(expected[0]["score"], abs=1e-5)
+    assert quantized.memory_bytes() < exact.memory_bytes()
+
+# With the numpy backend, searches embed the query and skip ChromaDB entirely
+@patch('services.retriever.utils.Config.RETRIEVER_BACKEND', 'numpy')
+@patch('services.retriever.utils.vector_store')
+@patch('services.retriever.utils.vector_index')
+@patch('services.retriever.utils.embedding_model')
+def test_similarity_search_numpy_backend(mock_embedding_model, mock_vector_index, mock_vector_store, client):
+    mock_embedding_model.embed_query.return_value = [0.1, 0.2]
+    mock_vector_index.search.return_value = [[
+        {"id": "123", "content": "Mock content 1", "metadata": {"product_id": "123"}, "score": 0.9}
+    ]]
+
+    response = client.post('/retriever/search', data=json.dumps({"query": "Yellow dropper", "k": 1}),
+                           content_type='application/json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["results"] == [{"content": "Mock content 1", "metadata": {"product_id": "123"}}]
+    mock_vector_index.search.assert_called_once_with([[0.1, 0.2]], 1, where={"source": "insta_posts"})
+    mock_vector_store.similarity_search.assert_not_called()
+
+# The BM25 index is updated document by document and survives a reload
+def test_bm25_index_incremental(tmp_path):
+    path = str(tmp_path / "lexical.json")
+    index = BM25Index(path)
+    index.add("1", "Features: hyaluronic acid, serum\nDescription: #hydration dropper", {"source": "insta_posts"})
+    index.add("2", "Features: vitamin c, serum\nDescription: brightening", {"source": "insta_posts"})
+    index.add("3", "Features: hyaluronic acid\nDescription: draft", {"source": "other"})
+    index.save()
+
+    assert [hit["id"] for hit in index.search("hyaluronic hydration", k=5)] == ["1", "3"]
+    assert [hit["id"] for hit in index.search("hyaluronic", k=5, where={"source": "insta_posts"})] == ["1"]
+
+    # Re-adding a product replaces its old terms
+    index.add("1", "Features: retinol", {"source": "insta_posts"})
+    index.save()
+    reader = BM25Index(path)
+    assert reader.search("hydration", k=5) == []
+    assert [hit["id"] for hit in reader.search("retinol", k=5)] == ["1"]
+
+# Unsaved adds survive a reload of another writer's save, and neither writer's documents are lost
+def test_bm25_index_concurrent_writers(tmp_path):
+    path = str(tmp_path / "lexical.json")
+    first, second = BM25Index(path), BM25Index(path)
+    first.add("1", "hyaluronic serum", {"source": "insta_posts"})
+    second.add("2", "vitamin c serum", {"source": "insta_posts"})
+    second.save()
+    first.add("3", "retinol serum", {"source": "insta_posts"})
+    first.save()
+
+    with open(path) as f:
+        assert sorted(json.load(f)) == ["1", "2", "3"]
+    second.add("4", "niacinamide serum", {"source": "insta_posts"})
+    assert sorted(hit["id"] for hit in second.search("serum", k=5)) == ["1", "2", "3", "4"]
+
+# Lexical mode answers from the BM25 index without an embedding call
+@patch('services.retriever.utils.lexical_index')
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_lexical_mode(mock_vector_store, mock_lexical_index, client):
+    mock_lexical_index.search.return_value = [
+        {"id": "123", "content": "Mock content 1", "metadata": {"product_id": "123"}, "score": 2.5}
+    ]
+
+    response = client.post('/retriever/search', data=json.dumps({"query": "#hydration", "k": 1, "mode": "lexical"}),
+                           content_type='application/json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["results"][0]["content"] == "Mock content 1"
+    mock_vector_store.similarity_search.assert_not_called()
+
+    response = client.post('/retriever/search', data=json.dumps({"query": "serum", "mode": "fuzzy"}),
+                           content_type='application/json')
+    assert response.status_code == 400
+
+# Hybrid mode fuses both rankings by reciprocal rank
+@patch('services.retriever.utils.lexical_index')
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_hybrid_mode(mock_vector_store, mock_lexical_index, client):
+    mock_vector_store.similarity_search.return_value = [
+        MagicMock(page_content="A", metadata={"product_id": "1"}),
+        MagicMock(page_content="B", metadata={"product_id": "2"})
+    ]
+    mock_lexical_index.search.return_value = [
+        {"id": "2", "content": "B", "metadata": {"product_id": "2"}, "score": 3.0},
+        {"id": "3", "content": "C", "metadata": {"product_id": "3"}, "score": 1.0}
+    ]
+
+    response = client.post('/retriever/search', data=json.dumps({"query": "serum", "k": 2, "mode": "hybrid"}),
+                           content_type='application/json')
+
+    results = json.loads(response.data)["results"]
+    assert [r["metadata"]["product_id"] for r in results] == ["2", "1"]
+
+# Metadata predicates narrow the candidate rows before scoring, on both storage modes
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_numpy_vector_index_metadata_filter(tmp_path, quantization):
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((200, 16)).astype(np.float32)
+    ids = [str(i) for i in range(200)]
+    metadatas = [{"source": "insta_posts", "account": "acme" if i % 10 == 0 else "other", "product_id": str(i)}
+                 for i in range(200)]
+    NumpyVectorIndex(str(tmp_path)).write(ids, vectors, ids, metadatas)
+    index = NumpyVectorIndex(str(tmp_path), quantization=quantization, filter_fields=("source", "account"))
+
+    # Selective: 20 of 200 rows, scored on their own
+    hits = index.search(vectors[:1], k=5, where={"source": "insta_posts", "account": "acme"})[0]
+    assert hits[0]["id"] == "0"
+    assert all(hit["metadata"]["account"] == "acme" for hit in hits)
+
+    # Broad: everything except two products, scored in a full scan
+    hits = index.search(vectors[:1], k=3, where={"product_id": {"$nin": ["0", "1"]}})[0]
+    assert len(hits) == 3
+    assert {"0", "1"}.isdisjoint(hit["id"] for hit in hits)
+
+# Caller filters are validated and passed to ChromaDB alongside the source filter
+@patch('services.retriever.utils.vector_store')
+def test_similarity_search_with_filter(mock_vector_store, client):
+    mock_vector_store.similarity_search.return_value = []
+    query_data = {"query": "serum", "k": 2, "filter": {"product_id": {"$in": ["1", "2"]}}}
+
+    response = client.post('/retriever/search', data=json.dumps(query_data), content_type='application/json')
+
+    assert response.status_code == 200
+    assert mock_vector_store.similarity_search.call_args.kwargs["filter"] == {
+        "$and": [{"product_id": {"$in": ["1", "2"]}}, {"source": "insta_posts"}]
+    }
+
+    query_data["filter"] = {"product_id": {"$regex": "1.*"}}
+    response = client.post('/retriever/search', data=json.dumps(query_data), content_type='application/json')
+    assert response.status_code == 400
+
+# MMR skips a near-duplicate of an already picked candidate in favour of a different one
+def test_mmr_select_prefers_diverse_candidates():
+    query = [1.0, 0.0, 0.0]
+    candidates = [[1.0, 0.1, 0.0], [1.0, 0.11, 0.0], [0.6, 0.0, 0.8]]
+    assert mmr_select(query, candidates, k=2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, candidates, k=2, lambda_mult=0.5) == [0, 2]
+
+# The MMR rerank over-fetches candidates with their embeddings from ChromaDB
+@patch('services.retriever.utils.Config.MMR_CANDIDATES', 3)
+@patch('services.retriever.utils.chroma_collection')
+@patch('services.retriever.utils.embedding_model')
+def test_similarity_search_mmr_rerank(mock_embedding_model, mock_collection, client):
+    mock_embedding_model.embed_query.return_value = [1.0, 0.0, 0.0]
+    mock_collection.query.return_value = {
+        "documents": [["A", "A again", "B"]],
+        "metadatas": [[{"product_id": "1"}, {"product_id": "2"}, {"product_id": "3"}]],
+        "embeddings": [[[1.0, 0.1, 0.0], [1.0, 0.11, 0.0], [0.6, 0.0, 0.8]]]
+    }
+
+    query_data = {"query": "serum", "k": 2, "rerank": "mmr"}
+    response = client.post('/retriever/search', data=json.dumps(query_data), content_type='application/json')
+
+    assert [r["content"] for r in json.loads(response.data)["results"]] == ["A", "B"]
+    assert mock_collection.query.call_args.kwargs["n_results"] == 3
+
+
+# Only the most recently used filter masks are kept, whatever filters callers send
+def test_filter_index_mask_cache_bounded():
+    from services.retriever.filters import FilterIndex
+
+    metadatas = [{"source": "insta_posts", "product_id": str(i)} for i in range(10)]
+    filter_index = FilterIndex(metadatas, fields=("source",), max_cached_masks=3)
+
+    for i in range(10):
+        assert filter_index.mask({"product_id": {"$in": [str(i), "missing"]}}).sum() == 1
+    assert len(filter_index._masks) == 3
+    # Postings are kept only for the precomputed fields
+    assert set(filter_index.postings) == {"source"}
+    assert filter_index.mask({"source": "insta_posts"}).all()